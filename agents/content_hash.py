@@ -0,0 +1,24 @@
+import hashlib
+import re
+import unicodedata
+
+_MARKUP = re.compile(r'<[^>]+>')
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_text(text):
+    """Case-, markup-, punctuation- and whitespace-insensitive form of article text"""
+    text = unicodedata.normalize('NFKC', text or '')
+    text = _MARKUP.sub(' ', text).lower()
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def content_hash(content, title=None):
+    """Stable key for an article's text; reposts of the same story hash identically.
+
+    None when there is no text to compare: such articles are never treated as duplicates.
+    """
+    normalized = normalize_text(content) or normalize_text(title)
+    if not normalized:
+        return None
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
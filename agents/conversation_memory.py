@@ -0,0 +1,272 @@
+import atexit
+import os
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from textwrap import shorten
+
+from . import storage
+from .llm import estimate_tokens
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def summarize_turn(question, answer):
+    """One compact line for a turn leaving the window: the question and the answer's first sentence"""
+    first_sentence = _SENTENCE_END.split(answer.strip(), 1)[0]
+    return f'Asked "{shorten(question, 80)}"; answered: {shorten(first_sentence, 120)}'
+
+
+class _UserMemory:
+    __slots__ = ('turns', 'summary', 'tokens', 'last_used', 'seq')
+
+    def __init__(self, turns, summary):
+        self.turns = turns
+        self.summary = summary
+        self.tokens = sum(turn['tokens'] for turn in turns)
+        self.last_used = time.monotonic()
+        # Sequence number of the user's latest queued write (0: nothing queued)
+        self.seq = 0
+
+
+class ConversationMemory:
+    """Recent conversation turns per user, served from memory and persisted write-behind.
+
+    Each user keeps at most `window` recent turns within `token_budget` tokens; older turns
+    are folded into a rolling summary capped at `summary_tokens`, and answers are stored
+    truncated to `max_answer_chars`, so memory per user is bounded. At most `max_users` users
+    are held (least recently used first out); a user not in memory is loaded from the
+    database once, outside the lock so a miss never stalls other users' turns. New turns and
+    summaries are queued and written by a background thread every `flush_interval` seconds,
+    in batches; a crash can lose at most that much, and a failed write is queued again for
+    the next flush. Users with writes still queued are never dropped from memory (the map
+    may run over `max_users` meanwhile), so a reload always finds them.
+    """
+
+    def __init__(self, memory_config=None):
+        self.memory_config = {
+            'window': int(os.getenv('CONVERSATION_WINDOW', '10')),
+            'token_budget': int(os.getenv('CONVERSATION_TOKEN_BUDGET', '1000')),
+            'summary_tokens': int(os.getenv('CONVERSATION_SUMMARY_TOKENS', '250')),
+            'max_answer_chars': int(os.getenv('CONVERSATION_MAX_ANSWER_CHARS', '2000')),
+            'max_users': int(os.getenv('CONVERSATION_CACHE_USERS', '10000')),
+            'flush_interval': float(os.getenv('CONVERSATION_FLUSH_INTERVAL', '1')),
+            'idle_seconds': float(os.getenv('CONVERSATION_IDLE_SECONDS', '1800')),
+            'retention_days': float(os.getenv('CONVERSATION_RETENTION_DAYS', '90')),
+            'purge_batch_size': int(os.getenv('CONVERSATION_PURGE_BATCH_SIZE', '5000')),
+        }
+        self.memory_config.update(memory_config or {})
+        self._lock = threading.Lock()
+        # Serializes database writes, which happen outside `_lock` so chat turns never wait on them
+        self._write_lock = threading.Lock()
+        self._users = OrderedDict()
+        self._pending_turns = []
+        self._pending_summaries = {}
+        self._seq = 0
+        self._committed = 0
+        self._wake = threading.Condition(self._lock)
+        self._flusher = None
+        self._stopping = False
+        self.stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'summarized': 0, 'flushes': 0, 'written': 0,
+                      'flush_failures': 0}
+        self.last_flush_error = None
+
+    @property
+    def conn(self):
+        return storage.connection('conversation')
+
+    def _load(self, user_id):
+        window = self.memory_config['window']
+        rows = self.conn.execute(
+            'SELECT question, answer, timestamp FROM conversation_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?',
+            (user_id, window)
+        ).fetchall()
+        summary = self.conn.execute(
+            'SELECT summary FROM conversation_summaries WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        turns = deque((self._turn(question, answer, timestamp) for question, answer, timestamp in reversed(rows)),
+                      maxlen=window)
+        return _UserMemory(turns, summary[0] if summary else '')
+
+    def _turn(self, question, answer, timestamp):
+        return {'question': question, 'answer': answer, 'timestamp': timestamp,
+                'tokens': estimate_tokens(question) + estimate_tokens(answer)}
+
+    @contextmanager
+    def _user(self, user_id):
+        """Hold the lock with the user's memory; a miss is loaded from the database unlocked"""
+        loaded = False
+        while True:
+            with self._lock:
+                memory = self._users.get(user_id)
+                if memory is not None:
+                    self._users.move_to_end(user_id)
+                    if not loaded:
+                        self.stats['hits'] += 1
+                    memory.last_used = time.monotonic()
+                    yield memory
+                    return
+            # Safe to read unlocked: a user with queued writes is never out of memory
+            memory = self._load(user_id)
+            loaded = True
+            with self._lock:
+                if user_id not in self._users:
+                    self._users[user_id] = memory
+                    self.stats['loads'] += 1
+                    self._evict(len(self._users) - self.memory_config['max_users'], keep=user_id)
+
+    def _evict(self, count, keep=None):
+        # Least recently used first, skipping `keep` and users whose writes have not landed yet
+        if count <= 0:
+            return
+        victims = []
+        for user_id, memory in self._users.items():
+            if user_id != keep and memory.seq <= self._committed:
+                victims.append(user_id)
+                if len(victims) == count:
+                    break
+        for user_id in victims:
+            del self._users[user_id]
+        self.stats['evictions'] += len(victims)
+
+    def recent(self, user_id, limit=None):
+        """(summary, turns newest first) for a user; no database access once they are in memory"""
+        with self._user(user_id) as memory:
+            turns = list(memory.turns)[::-1][:limit]
+            return memory.summary, [{key: turn[key] for key in ('question', 'answer', 'timestamp')} for turn in turns]
+
+    def add(self, user_id, question, answer):
+        config = self.memory_config
+        answer = answer if len(answer) <= config['max_answer_chars'] else answer[:config['max_answer_chars'] - 3] + '...'
+        now = datetime.now()
+        with self._user(user_id) as memory:
+            if len(memory.turns) == memory.turns.maxlen:
+                self._fold(user_id, memory, memory.turns.popleft())
+            # As read back from SQLite, so cached and reloaded turns look the same
+            turn = self._turn(question, answer, str(now))
+            memory.turns.append(turn)
+            memory.tokens += turn['tokens']
+            while memory.tokens > config['token_budget'] and len(memory.turns) > 1:
+                self._fold(user_id, memory, memory.turns.popleft())
+            self._seq += 1
+            memory.seq = self._seq
+            self._pending_turns.append((user_id, question, answer, now))
+            self._start_flusher()
+
+    def _fold(self, user_id, memory, turn):
+        """Move a turn out of the window into the rolling summary; call with the lock held"""
+        memory.tokens -= turn['tokens']
+        lines = [line for line in memory.summary.split('\n') if line]
+        lines.append(summarize_turn(turn['question'], turn['answer']))
+        # Oldest summary lines go first once the summary is over its budget
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.memory_config['summary_tokens']:
+            lines.pop(0)
+        memory.summary = '\n'.join(lines)
+        self.stats['summarized'] += 1
+        self._pending_summaries[user_id] = (memory.summary, datetime.now())
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._stopping = False
+            self._flusher = threading.Thread(target=self._flush_loop, name='conversation-flusher', daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                if self._stopping:
+                    break
+                self._wake.wait(self.memory_config['flush_interval'])
+            try:
+                self.flush()
+            except Exception:
+                # Already queued again by flush(); retried at the next interval
+                pass
+        storage.release()
+
+    def flush(self):
+        """Write every queued turn and summary now; returns the number of turns written.
+
+        If the write fails, the batch goes back on the queue ahead of newer turns and the
+        error is raised.
+        """
+        with self._write_lock:
+            with self._lock:
+                turns, self._pending_turns = self._pending_turns, []
+                summaries, self._pending_summaries = self._pending_summaries, {}
+                seq = self._seq
+            if turns or summaries:
+                try:
+                    self._write(turns, summaries)
+                except Exception:
+                    with self._lock:
+                        self._pending_turns[:0] = turns
+                        # A summary folded since the swap is newer than the failed one
+                        self._pending_summaries = {**summaries, **self._pending_summaries}
+                        self.stats['flush_failures'] += 1
+                        self.last_flush_error = traceback.format_exc(limit=3)
+                    raise
+            with self._lock:
+                self._committed = seq
+                self.stats['flushes'] += 1
+                self.stats['written'] += len(turns)
+        return len(turns)
+
+    def _write(self, turns, summaries):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO conversation_history (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
+                turns
+            )
+            self.conn.executemany(
+                '''INSERT INTO conversation_summaries (user_id, summary, updated_at) VALUES (?, ?, ?)
+                   ON CONFLICT (user_id) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at''',
+                [(user_id, summary, updated_at) for user_id, (summary, updated_at) in summaries.items()]
+            )
+
+    def close(self):
+        with self._lock:
+            self._stopping = True
+            self._wake.notify()
+            flusher, self._flusher = self._flusher, None
+        if flusher is not None and flusher is not threading.current_thread():
+            flusher.join()
+        self.flush()
+
+    def purge(self, deadline=None):
+        """Apply retention: drop turns and summaries older than `retention_days` and forget
+        users idle for `idle_seconds`. Deletes in batches so writers are never blocked long."""
+        config = self.memory_config
+        cutoff = datetime.now() - timedelta(days=config['retention_days'])
+        deleted = 0
+        while deadline is None or time.monotonic() < deadline:
+            with self.conn:
+                removed = self.conn.execute(
+                    '''DELETE FROM conversation_history WHERE id IN
+                       (SELECT id FROM conversation_history WHERE timestamp < ? LIMIT ?)''',
+                    (cutoff, config['purge_batch_size'])
+                ).rowcount
+            deleted += removed
+            if removed < config['purge_batch_size']:
+                break
+        with self.conn:
+            summaries = self.conn.execute(
+                'DELETE FROM conversation_summaries WHERE updated_at < ?', (cutoff,)
+            ).rowcount
+
+        idle_before = time.monotonic() - config['idle_seconds']
+        with self._lock:
+            idle = [user_id for user_id, memory in self._users.items()
+                    if memory.last_used < idle_before and memory.seq <= self._committed]
+            for user_id in idle:
+                del self._users[user_id]
+        return {'turns': deleted, 'summaries': summaries, 'forgotten_users': len(idle), 'users': len(self._users)}
+
+    def memory_stats(self):
+        with self._lock:
+            return {**self.stats, 'users': len(self._users), 'pending': len(self._pending_turns)}
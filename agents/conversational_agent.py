@@ -1,50 +1,178 @@
-import sqlite3
-from datetime import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from . import storage
+from .conversation_memory import ConversationMemory
+from .intents import IntentClassifier
+from . import llm as llm_clients
+from .llm import Completion, normalize_question, snapshot_digest
+
+SYSTEM_PROMPT = (
+    'You are a financial assistant for a portfolio dashboard. Answer the question using only '
+    'the data provided. Be concise, cite figures from the data, and say so when the data does '
+    'not answer the question. Do not give personalised investment advice.'
+)
+HELP_MESSAGE = 'I can help with portfolio analysis, risk metrics, recommendations, and market news. What would you like to know?'
+FALLBACK_CONFIDENCE = 0.6
+
+# intent -> (label, confidence, fetch(agents, user_id))
+INTENT_SOURCES = {
+    'portfolio': ('Your portfolio', 0.9, lambda agents, user_id: agents['portfolio'].get_user_portfolio(user_id)),
+    'risk': ('Risk metrics', 0.85, lambda agents, user_id: agents['risk'].get_risk_metrics(user_id)),
+    'recommendations': ('Recommendations', 0.8,
+                        lambda agents, user_id: agents['recommendation'].get_user_recommendations(user_id)),
+    'news': ('Latest news', 0.75, lambda agents, user_id: agents['market_insight'].get_latest_reports()),
+}
 
 class ConversationalAgent:
-    def __init__(self):
-        self.conn = sqlite3.connect('conversation.db', check_same_thread=False)
-        self._create_tables()
-
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS conversation_history
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              question TEXT, 
-                              answer TEXT, 
-                              timestamp DATETIME)''')
+    def __init__(self, fanout_config=None, memory_config=None, llm=None):
+        self.fanout_config = {
+            'workers': int(os.getenv('CHAT_FANOUT_WORKERS', '16')),
+            # Seconds each agent may take; a slower agent is left out of the answer
+            'timeout': float(os.getenv('CHAT_AGENT_TIMEOUT', '2')),
+            # intent -> seconds, overriding `timeout`
+            'timeouts': {},
+            # Calls per intent still queued or running, timed-out ones included, before further
+            # questions skip that intent; keeps one stuck agent from taking the whole pool
+            'max_inflight': int(os.getenv('CHAT_MAX_INFLIGHT_PER_INTENT', '4')),
+        }
+        self.fanout_config.update(fanout_config or {})
+        self.classifier = IntentClassifier()
+        self.memory = ConversationMemory(memory_config)
+        self._pool = ThreadPoolExecutor(max_workers=self.fanout_config['workers'], thread_name_prefix='chat-fanout')
+        self._inflight = dict.fromkeys(INTENT_SOURCES, 0)
+        self._inflight_lock = threading.Lock()
+        # LLM client used when the agents passed to respond() carry no 'llm' entry
+        self.llm = llm
+        self._llm_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        return storage.connection('conversation')
 
     def add_conversation(self, user_id, question, answer):
-        with self.conn:
-            self.conn.execute(
-                'INSERT INTO conversation_history (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
-                (user_id, question, answer, datetime.now())
-            )
+        # Queued in memory; the conversation memory writes it to the database in the background
+        self.memory.add(user_id, question, answer)
 
     def get_conversation_history(self, user_id, limit=5):
-        return self.conn.execute(
-            'SELECT * FROM conversation_history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?', 
-            (user_id, limit)
-        ).fetchall()
+        """The user's latest turns, newest first, as {'question', 'answer', 'timestamp'} dicts"""
+        return self.memory.recent(user_id, limit)[1]
+
+    def purge_conversations(self, deadline=None):
+        return self.memory.purge(deadline)
+
+    def _llm(self, other_agents):
+        # The constructor's client, else the caller's; callers predating the LLM client pass
+        # only the four data agents, and get one built from the environment
+        if self.llm is not None:
+            return self.llm
+        if 'llm' in other_agents:
+            return other_agents['llm']
+        with self._llm_lock:
+            if self.llm is None:
+                self.llm = llm_clients.from_env()
+            return self.llm
+
+    def _fetch(self, fetch, other_agents, user_id):
+        started = time.perf_counter()
+        try:
+            return fetch(other_agents, user_id), time.perf_counter() - started
+        finally:
+            # Pool threads are long-lived; hand their SQLite connections back
+            storage.release()
+
+    def _submit(self, intent, other_agents, user_id):
+        # A timed-out call keeps its pool thread until the agent returns (cancel() cannot stop
+        # a running call), so its slot is only freed when the call really ends
+        with self._inflight_lock:
+            if self._inflight[intent] >= self.fanout_config['max_inflight']:
+                return None
+            self._inflight[intent] += 1
+        future = self._pool.submit(self._fetch, INTENT_SOURCES[intent][2], other_agents, user_id)
+        future.add_done_callback(lambda _, intent=intent: self._release(intent))
+        return future
+
+    def _release(self, intent):
+        with self._inflight_lock:
+            self._inflight[intent] -= 1
+
+    def _gather(self, user_id, intents, other_agents):
+        """Fetch every intent's data concurrently, each within its own timeout.
+
+        Returns {intent: {'label', 'confidence', 'status', 'seconds', 'data'}}; status is
+        'ok', 'timeout', 'error' or 'busy' (too many calls for that intent still in flight),
+        and only 'ok' entries carry data.
+        """
+        started = time.monotonic()
+        futures = {intent: self._submit(intent, other_agents, user_id) for intent in intents}
+        results = {}
+        for intent, future in futures.items():
+            label, confidence, _ = INTENT_SOURCES[intent]
+            timeout = self.fanout_config['timeouts'].get(intent, self.fanout_config['timeout'])
+            result = {'label': label, 'confidence': confidence}
+            if future is None:
+                results[intent] = dict(result, status='busy', seconds=0.0)
+                continue
+            try:
+                # Deadlines count from the fan-out start, so waiting on one agent never adds
+                # to another's allowance
+                data, seconds = future.result(timeout=max(0.0, started + timeout - time.monotonic()))
+                result.update(status='ok', seconds=seconds, data=data)
+            except TimeoutError:
+                future.cancel()
+                result.update(status='timeout', seconds=timeout)
+            except Exception as e:
+                result.update(status='error', seconds=time.monotonic() - started, error=f'{type(e).__name__}: {e}')
+            results[intent] = result
+        return results
+
+    def respond(self, user_id, question, other_agents):
+        """Stream an LLM answer grounded in the data of every agent the question needs.
+
+        The question is classified into intents in one pass and the agents behind them are
+        queried concurrently, so gathering costs the slowest agent, not the sum. Returns an
+        llm.Completion carrying the answer's `confidence` (that of the least certain intent
+        answered) and per-intent `sources`. Answers are cached per (normalized question,
+        data snapshot), so a repeated question about unchanged data skips the model; if the
+        model fails the answer falls back to the data itself.
+        """
+        intents = self.classifier.classify(question)
+        sources = self._gather(user_id, intents, other_agents) if intents else {}
+        answered = [source for source in sources.values() if source['status'] == 'ok']
+        if not answered:
+            completion = Completion.fixed(HELP_MESSAGE)
+            completion.confidence = FALLBACK_CONFIDENCE
+            completion.sources = self._source_summary(sources)
+            return completion
+
+        sections = [f"{source['label']}:\n{json.dumps(source['data'], default=str)}" for source in answered]
+        sections += [f"{source['label']}: unavailable ({source['status']})"
+                     for source in sources.values() if source['status'] != 'ok']
+        snapshot = '\n\n'.join(sections)
+        summary, history = self.memory.recent(user_id, limit=5)
+        context = "Previous conversation:\n" + "\n".join([f"Q: {turn['question']} A: {turn['answer']}" for turn in reversed(history)]) if history else ""
+        if summary:
+            context = f'Earlier in the conversation:\n{summary}\n\n{context}'
+        messages = [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': f'{snapshot}\n\n{context}\n\nQuestion: {question}'},
+        ]
+        completion = self._llm(other_agents).stream(
+            messages,
+            cache_key=(normalize_question(question), snapshot_digest(snapshot)),
+            fallback='\n'.join(f"{source['label']}: {source['data']}" for source in answered)
+        )
+        completion.confidence = min(source['confidence'] for source in answered)
+        completion.sources = self._source_summary(sources)
+        return completion
+
+    def _source_summary(self, sources):
+        return {intent: {key: value for key, value in source.items() if key not in ('data', 'label')}
+                for intent, source in sources.items()}
 
     def generate_response(self, user_id, question, other_agents):
-        # Simple Q&A with memory integration
-        history = self.get_conversation_history(user_id)
-        context = "Previous conversation:\n" + "\n".join([f"Q: {row[2]} A: {row[3]}" for row in history]) if history else ""
-        
-        # Basic routing to other agents
-        if "portfolio" in question.lower():
-            portfolio_data = other_agents['portfolio'].get_user_portfolio(user_id)
-            return f"Your portfolio: {portfolio_data}", 0.9
-        elif "risk" in question.lower():
-            risk_data = other_agents['risk'].get_risk_metrics(user_id)
-            return f"Risk metrics: {risk_data}", 0.85
-        elif "recommendations" in question.lower():
-            recs = other_agents['recommendation'].get_user_recommendations(user_id)
-            return f"Recommendations: {recs}", 0.8
-        elif "news" in question.lower():
-            news = other_agents['market_insight'].get_latest_reports()
-            return f"Latest news: {news}", 0.75
-        else:
-            return "I can help with portfolio analysis, risk metrics, recommendations, and market news. What would you like to know?", 0.6
+        completion = self.respond(user_id, question, other_agents)
+        return completion.read(), completion.confidence
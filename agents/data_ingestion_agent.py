@@ -1,57 +1,224 @@
-import requests
-import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
 
+from . import events, price_store, rollups, storage
+from .content_hash import content_hash
+from .entity_index import SymbolMatcher
+from .http_client import HostLimiter, build_session, get_with_retry
+from .metrics import percentile, rate
+
 class DataIngestionAgent:
-    def __init__(self):
+    def __init__(self, fetch_config=None):
         self.api_keys = {
             'market': os.getenv('MARKET_API_KEY'),
             'news': os.getenv('NEWS_API_KEY')
         }
-        self.conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
+        self.fetch_config = {
+            'market_url': os.getenv('MARKET_API_URL', 'https://api.marketdata.com/v1'),
+            'news_url': os.getenv('NEWS_API_URL', 'https://api.newsdata.com/v1'),
+            'workers': int(os.getenv('MARKET_FETCH_WORKERS', '16')),
+            'per_host': int(os.getenv('MARKET_FETCH_PER_HOST', '16')),
+            'timeout': float(os.getenv('MARKET_FETCH_TIMEOUT', '5')),
+            'budget': float(os.getenv('MARKET_FETCH_BUDGET', '60')),
+            'retries': int(os.getenv('MARKET_FETCH_RETRIES', '3')),
+            'backoff': float(os.getenv('MARKET_FETCH_BACKOFF', '0.25')),
+            # Symbols per request; values above 1 switch to the batch quote endpoint
+            'batch_size': int(os.getenv('MARKET_BATCH_SIZE', '1')),
+            'index_batch_size': int(os.getenv('SYMBOL_INDEX_BATCH_SIZE', '1000')),
+        }
+        self.fetch_config.update(fetch_config or {})
+        self.session = build_session(
+            pool_size=max(self.fetch_config['workers'], self.fetch_config['per_host']),
+            headers={'Authorization': f'Bearer {self.api_keys["market"]}'}
+        )
+        # Separate from the market session so the market API key never goes to the news host
+        self.news_session = build_session(pool_size=1)
+        self.host_limiter = HostLimiter(self.fetch_config['per_host'])
+        self.symbol_matcher = SymbolMatcher()
+        self.last_fetch_stats = None
+
+    @property
+    def conn(self):
+        return storage.connection('market_data')
+
+    def _quote_row(self, quote, symbol=None):
+        timestamp = quote.get('timestamp')
+        if isinstance(timestamp, (int, float)):
+            timestamp = datetime.fromtimestamp(timestamp)
+        elif isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            if timestamp.tzinfo is not None:
+                # Stored timestamps are naive local time, like datetime.now() and fromtimestamp()
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+        else:
+            timestamp = datetime.now()
+        return (symbol or quote['symbol'], quote['price'], timestamp)
+
+    def _fetch_quotes(self, symbols, deadline):
+        config = self.fetch_config
+        if len(symbols) == 1:
+            url, params = f'{config["market_url"]}/quotes/{symbols[0]}', None
+        else:
+            url, params = f'{config["market_url"]}/quotes', {'symbols': ','.join(symbols)}
+        started = time.perf_counter()
+        response = get_with_retry(
+            self.session,
+            url,
+            deadline,
+            timeout=config['timeout'],
+            retries=config['retries'],
+            backoff=config['backoff'],
+            limiter=self.host_limiter,
+            params=params
+        )
+        latency = time.perf_counter() - started
+        if response is None:
+            return [], latency
+        if params is None:
+            return [self._quote_row(response.json(), symbols[0])], latency
+        return [self._quote_row(quote) for quote in response.json()['quotes']], latency
+
+    def _insert_ticks(self, rows):
+        # Stage the batch so ticks already stored can be filtered out up front; only genuinely
+        # new ticks may feed the rollups and the price store
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS incoming_ticks (symbol TEXT, timestamp DATETIME)')
+        self.conn.execute('DELETE FROM incoming_ticks')
+        self.conn.executemany('INSERT INTO incoming_ticks VALUES (?, ?)', [(row[0], row[2]) for row in rows])
+        stored = set(self.conn.execute(
+            '''SELECT symbol, timestamp FROM incoming_ticks AS incoming
+               WHERE EXISTS (SELECT 1 FROM market_data
+                             WHERE symbol = incoming.symbol AND timestamp = incoming.timestamp)'''
+        ))
+        new_rows = [row for row in rows if (row[0], str(row[2])) not in stored]
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)',
+            new_rows
+        )
+        return new_rows
+
+    def fetch_market_data(self, symbols, deadline=None):
+        symbols = list(dict.fromkeys(symbols))
+        started = time.perf_counter()
+        # Callers with their own time budget (e.g. the scheduler) pass a monotonic deadline
+        deadline = deadline or time.monotonic() + self.fetch_config['budget']
+        batch_size = max(1, self.fetch_config['batch_size'])
+        chunks = [symbols[i:i + batch_size] for i in range(0, len(symbols), batch_size)]
+        ticks, latencies = {}, []
 
-    def _create_tables(self):
+        # Workers only do network I/O; all writes happen below in a single transaction
+        workers = max(1, min(self.fetch_config['workers'], len(chunks)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self._fetch_quotes, chunk, deadline) for chunk in chunks]
+            for future in as_completed(futures):
+                try:
+                    rows, latency = future.result()
+                except Exception:
+                    # Any failure (bad payload, transport error) marks the chunk's symbols failed
+                    rows, latency = [], 0.0
+                latencies.append(latency)
+                for row in rows:
+                    ticks[(row[0], row[2])] = row
+
+        rows = list(ticks.values())
         with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS market_data
-                             (id INTEGER PRIMARY KEY, 
-                              symbol TEXT, 
-                              price REAL, 
-                              timestamp DATETIME)''')
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS news_articles
-                             (id INTEGER PRIMARY KEY, 
-                              title TEXT, 
-                              content TEXT, 
-                              source TEXT, 
-                              timestamp DATETIME)''')
-
-    def fetch_market_data(self, symbols):
-        for symbol in symbols:
-            response = requests.get(
-                f'https://api.marketdata.com/v1/quotes/{symbol}',
-                headers={'Authorization': f'Bearer {self.api_keys["market"]}'} 
-            )
-            if response.status_code == 200:
-                data = response.json()
-                self.conn.execute(
-                    'INSERT INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)',
-                    (symbol, data['price'], datetime.now())
-                )
-        self.conn.commit()
+            new_rows = self._insert_ticks(rows)
+            daily_bars = rollups.update_bars(self.conn, new_rows)
+        inserted = len(new_rows)
+        new_rows.sort(key=lambda row: row[2])
+        price_store.store.extend(new_rows)
+        price_store.daily.extend(sorted(
+            ((symbol, bar['close'], bucket) for (symbol, bucket), bar in daily_bars.items()),
+            key=lambda row: row[2]
+        ))
+        if new_rows:
+            # One event per batch, oldest tick first
+            events.bus.publish('ticks', [
+                {'symbol': symbol, 'price': price, 'timestamp': timestamp.isoformat(sep=' ')}
+                for symbol, price, timestamp in new_rows
+            ])
+
+        fetched = {row[0] for row in rows}
+        elapsed = time.perf_counter() - started
+        self.last_fetch_stats = {
+            'requested': len(symbols),
+            'requests': len(chunks),
+            'fetched': len(fetched),
+            'inserted': inserted,
+            'duplicates': len(rows) - inserted,
+            'failed': [symbol for symbol in symbols if symbol not in fetched],
+            'elapsed_seconds': elapsed,
+            'symbols_per_second': rate(len(fetched), elapsed),
+            'p99_latency_seconds': percentile(latencies, 99),
+        }
+        return self.last_fetch_stats
 
-    def fetch_news(self, topics):
-        response = requests.get(
-            'https://api.newsdata.com/v1/news',
+    def fetch_news(self, topics, deadline=None):
+        """Store new articles for `topics`; returns their counts, or None if the feed failed"""
+        config = self.fetch_config
+        response = get_with_retry(
+            self.news_session,
+            f'{config["news_url"]}/news',
+            deadline or time.monotonic() + config['budget'],
+            timeout=config['timeout'],
+            retries=config['retries'],
+            backoff=config['backoff'],
             params={'api-key': self.api_keys['news'], 'q': ','.join(topics)}
         )
-        if response.status_code == 200:
-            for article in response.json()['results']:
+        if response is None:
+            return None
+        # Reposts and repeated polls share a content hash; the unique index drops them
+        articles, seen = [], set()
+        now = datetime.now()
+        results = response.json()['results']
+        for article in results:
+            digest = content_hash(article['content'], article['title'])
+            # Articles without text (digest None) are all kept; NULL passes the unique index
+            if digest is None or digest not in seen:
+                seen.add(digest)
+                articles.append((article['title'], article['content'], article['source'], now, digest))
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO news_articles (title, content, source, timestamp, content_hash) VALUES (?, ?, ?, ?, ?)',
+                articles
+            )
+            inserted = self.conn.total_changes - before
+        received = len(results)
+        indexed = self.index_article_symbols()
+        return {'received': received, 'inserted': inserted, 'duplicates': received - inserted, 'indexed': indexed}
+
+    def index_article_symbols(self):
+        """Tag every article past the indexing high-water mark with the symbols it mentions"""
+        high_water_mark = self.conn.execute(
+            "SELECT value FROM pipeline_state WHERE name = 'symbol_index_high_water_mark'"
+        ).fetchone()[0]
+        indexed = 0
+        while True:
+            articles = self.conn.execute(
+                'SELECT id, title, content FROM news_articles WHERE id > ? ORDER BY id LIMIT ?',
+                (high_water_mark, self.fetch_config['index_batch_size'])
+            ).fetchall()
+            if not articles:
+                break
+            pairs = [(article_id, symbol)
+                     for article_id, title, content in articles
+                     for symbol in self.symbol_matcher.extract(f'{title or ""}\n{content or ""}')]
+            high_water_mark = articles[-1][0]
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO article_symbols (article_id, symbol) VALUES (?, ?)', pairs)
                 self.conn.execute(
-                    'INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)',
-                    (article['title'], article['content'], article['source'], datetime.now())
+                    "UPDATE pipeline_state SET value = MAX(value, ?), updated_at = ? "
+                    "WHERE name = 'symbol_index_high_water_mark'",
+                    (high_water_mark, datetime.now())
                 )
-            self.conn.commit()
+            indexed += len(articles)
+        return indexed
+
+    def compact_market_data(self):
+        """Apply tick and bar retention; safe to run on a schedule"""
+        return rollups.compact(self.conn)
 
     def get_latest_data(self, table, limit=10):
         return self.conn.execute(f'SELECT * FROM {table} ORDER BY timestamp DESC LIMIT ?', (limit,)).fetchall()
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+
+# Fallback dictionary; deployments point SYMBOL_ALIASES_PATH at a full {ticker: [aliases]} file
+DEFAULT_ALIASES = {
+    'AAPL': ['Apple'],
+    'MSFT': ['Microsoft'],
+    'GOOGL': ['Alphabet', 'Google'],
+    'AMZN': ['Amazon'],
+    'META': ['Meta Platforms', 'Facebook'],
+    'NVDA': ['Nvidia'],
+    'TSLA': ['Tesla'],
+    'JPM': ['JPMorgan', 'JPMorgan Chase', 'JP Morgan'],
+    'XOM': ['Exxon', 'Exxon Mobil', 'ExxonMobil'],
+    'JNJ': ['Johnson & Johnson'],
+}
+
+# Tickers that are also everyday words only match as cashtags ($ALL, $IT, ...)
+AMBIGUOUS_TICKERS = {'A', 'AI', 'ALL', 'ARE', 'BE', 'CAN', 'FOR', 'GO', 'IT', 'NOW', 'ON', 'ONE', 'SO', 'US'}
+
+_TOKEN = re.compile(r"\$?[A-Za-z0-9][A-Za-z0-9&.]*")
+_END = object()
+
+
+def load_aliases(path=None):
+    path = path or os.getenv('SYMBOL_ALIASES_PATH')
+    if not path or not os.path.exists(path):
+        return DEFAULT_ALIASES
+    with open(path) as f:
+        return json.load(f)
+
+
+def _alias_tokens(text):
+    return [token.lstrip('$').rstrip('.').lower() for token in _TOKEN.findall(text)]
+
+
+class SymbolMatcher:
+    """Finds every ticker and company alias in a text in one left-to-right pass.
+
+    Aliases live in a trie keyed by lowercase tokens, so matching costs O(tokens x longest
+    alias) however large the dictionary is. Bare tickers must be written in capitals;
+    cashtags match in any case.
+    """
+
+    def __init__(self, aliases=None):
+        aliases = load_aliases() if aliases is None else aliases
+        self.tickers = {ticker.upper() for ticker in aliases}
+        self._trie = {}
+        for ticker, names in aliases.items():
+            for name in names:
+                node = self._trie
+                for token in _alias_tokens(name):
+                    node = node.setdefault(token, {})
+                node[_END] = ticker.upper()
+
+    def extract(self, text):
+        if not text:
+            return set()
+        symbols = set()
+        for token in _TOKEN.findall(text):
+            bare = token.lstrip('$').rstrip('.')
+            if bare.upper() not in self.tickers:
+                continue
+            if token.startswith('$') or (bare.isupper() and bare not in AMBIGUOUS_TICKERS):
+                symbols.add(bare.upper())
+
+        tokens = _alias_tokens(text)
+        for start in range(len(tokens)):
+            node = self._trie
+            for token in tokens[start:]:
+                node = node.get(token)
+                if node is None:
+                    break
+                if _END in node:
+                    symbols.add(node[_END])
+        return symbols
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One subscriber's bounded event queue.
+
+    When the queue is full the oldest event is dropped (and counted), so a slow client costs
+    at most `maxsize` events of memory and never slows publishers down. Consumers either block
+    in get() or pass `on_ready`, called (at most once per drain) from the publishing thread
+    when new events arrive, e.g. to wake an event loop.
+    """
+
+    def __init__(self, bus, topics, user_id=None, maxsize=256, on_ready=None):
+        self.bus = bus
+        self.topics = frozenset(topics)
+        self.user_id = user_id
+        self.on_ready = on_ready
+        self.dropped = 0
+        self.closed = False
+        self._events = deque(maxlen=maxsize)
+        self._ready = threading.Condition()
+        self._signalled = False
+        self._on_close = []
+
+    def put(self, event):
+        with self._ready:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._ready.notify()
+            signal = self.on_ready is not None and not self._signalled
+            self._signalled = True
+        if signal:
+            self.on_ready()
+
+    def drain(self):
+        """Take every queued (topic, data) event without waiting"""
+        with self._ready:
+            events = list(self._events)
+            self._events.clear()
+            self._signalled = False
+        return events
+
+    def get(self, timeout=None):
+        """Wait up to `timeout` seconds for events, then take all of them (possibly none)"""
+        with self._ready:
+            if not self._events and not self.closed:
+                self._ready.wait(timeout)
+        return self.drain()
+
+    def on_close(self, callback):
+        self._on_close.append(callback)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.bus.unsubscribe(self)
+        with self._ready:
+            self._ready.notify_all()
+        for callback in self._on_close:
+            callback()
+
+
+class EventBus:
+    """In-process publish/subscribe with per-topic and per-(topic, user) fan-out.
+
+    Events published with a user_id reach only that user's subscriptions; events without one
+    reach every subscriber of the topic. Listeners are plain callbacks run synchronously in
+    the publishing thread, for in-process consumers that derive further events; one that
+    raises is logged and skipped, so it never stops the others or the publisher.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or int(os.getenv('EVENT_QUEUE_SIZE', '256'))
+        self._lock = threading.Lock()
+        self._topics = {}
+        self._users = {}
+        self._listeners = {}
+        self.published = 0
+
+    def subscribe(self, topics, user_id=None, maxsize=None, on_ready=None):
+        subscription = Subscription(self, topics, user_id, maxsize or self.maxsize, on_ready)
+        with self._lock:
+            for topic in subscription.topics:
+                self._topics.setdefault(topic, set()).add(subscription)
+                if user_id is not None:
+                    self._users.setdefault((topic, user_id), set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                self._discard(self._topics, topic, subscription)
+                if subscription.user_id is not None:
+                    self._discard(self._users, (topic, subscription.user_id), subscription)
+
+    def _discard(self, index, key, subscription):
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del index[key]
+
+    def add_listener(self, topic, callback):
+        with self._lock:
+            self._listeners.setdefault(topic, []).append(callback)
+
+    def remove_listener(self, topic, callback):
+        with self._lock:
+            listeners = self._listeners.get(topic, [])
+            if callback in listeners:
+                listeners.remove(callback)
+            if not listeners:
+                self._listeners.pop(topic, None)
+
+    def has_subscribers(self, topic, user_id=None):
+        if user_id is None:
+            return topic in self._topics
+        return (topic, user_id) in self._users
+
+    def publish(self, topic, data, user_id=None):
+        """Deliver `data` to the topic's subscribers (or one user's); returns how many got it"""
+        with self._lock:
+            listeners = list(self._listeners.get(topic, ()))
+            if user_id is None:
+                targets = list(self._topics.get(topic, ()))
+            else:
+                targets = list(self._users.get((topic, user_id), ()))
+            self.published += 1
+        for callback in listeners:
+            try:
+                callback(data)
+            except Exception:
+                logger.exception('%s listener %r failed', topic, callback)
+        event = (topic, data)
+        for subscription in targets:
+            subscription.put(event)
+        return len(targets)
+
+    def stats(self):
+        with self._lock:
+            subscriptions = set().union(*self._topics.values()) if self._topics else set()
+        return {
+            'subscriptions': len(subscriptions),
+            'published': self.published,
+            'dropped': sum(subscription.dropped for subscription in subscriptions),
+        }
+
+
+bus = EventBus()
@@ -0,0 +1,122 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def build_session(pool_size=32, headers=None):
+    """Keep-alive session whose connection pool is shared by all worker threads"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class HostLimiter:
+    """Caps the number of in-flight requests per host"""
+
+    def __init__(self, per_host=8):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _semaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self._semaphores[host]
+
+    @contextmanager
+    def slot(self, url, timeout):
+        semaphore = self._semaphore(url)
+        acquired = semaphore.acquire(timeout=max(timeout, 0))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                semaphore.release()
+
+
+class TokenBucket:
+    """Request-rate limit: `rate` tokens per second, bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self, deadline):
+        """Take one token, sleeping until one is free; False if that would pass `deadline`"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if now + wait > deadline:
+                return False
+            # Claim the token now (the balance may go negative) so waiters queue up in order
+            self._tokens -= 1
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get('Retry-After', 0))
+    except ValueError:
+        return 0.0
+
+
+def get_with_retry(session, url, deadline, timeout=5.0, retries=3, backoff=0.25, limiter=None,
+                   rate_limiter=None, **kwargs):
+    """GET with exponential backoff that never runs past `deadline` (a time.monotonic() value).
+
+    Every attempt first takes a token from `rate_limiter`, if given, and a 429 response waits
+    at least as long as its Retry-After header asks. Returns the successful response, or None
+    once retries or the time budget run out.
+    """
+    for attempt in range(retries + 1):
+        if rate_limiter is not None and not rate_limiter.acquire(deadline):
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        retry_after = 0.0
+        try:
+            if limiter is None:
+                response = session.get(url, timeout=min(timeout, remaining), **kwargs)
+            else:
+                with limiter.slot(url, remaining) as acquired:
+                    remaining = deadline - time.monotonic()
+                    if not acquired or remaining <= 0:
+                        return None
+                    response = session.get(url, timeout=min(timeout, remaining), **kwargs)
+            if response.status_code == 200:
+                return response
+            if response.status_code not in RETRY_STATUSES:
+                return None
+            if response.status_code == 429:
+                retry_after = _retry_after(response)
+        except requests.RequestException:
+            # Connection resets, timeouts, chunked-encoding and other transport errors
+            pass
+        if attempt < retries:
+            delay = max(backoff * (2 ** attempt), retry_after)
+            if time.monotonic() + delay >= deadline:
+                return None
+            time.sleep(delay)
+    return None
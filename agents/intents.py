@@ -0,0 +1,33 @@
+import re
+
+# intent -> keyword patterns (regex fragments, matched case-insensitively as whole words).
+# Order is the order intents are reported and answered in.
+DEFAULT_INTENTS = {
+    'portfolio': [r'portfolios?', r'holdings?', r'positions?', r'shares', r'stocks? i (?:own|hold)',
+                  r'(?:net )?worth', r'balance', r'allocation'],
+    'risk': [r'risk(?:s|y)?', r'var', r'value at risk', r'volatil\w*', r'exposure', r'drawdown',
+             r'(?:expected )?shortfall', r'hedg\w*', r'diversif\w*'],
+    'recommendations': [r'recommend\w*', r'suggest\w*', r'advi[cs]e', r'should i', r'buy', r'sell',
+                        r'opportunit\w*', r'ideas?'],
+    'news': [r'news', r'headlines?', r'articles?', r'sentiment', r'market insights?', r'happening',
+             r'reports?'],
+}
+
+
+class IntentClassifier:
+    """Finds every intent a question mentions in one pass of a single compiled regex.
+
+    Each intent's keywords form one named alternative of the pattern, so the cost is one
+    scan of the question however many intents and keywords there are.
+    """
+
+    def __init__(self, intents=None):
+        intents = DEFAULT_INTENTS if intents is None else intents
+        self.intents = list(intents)
+        alternatives = '|'.join(f'(?P<{name}>{"|".join(patterns)})' for name, patterns in intents.items())
+        self._pattern = re.compile(rf'\b(?:{alternatives})\b', re.IGNORECASE)
+
+    def classify(self, question):
+        """The intents found in `question`, in declaration order (empty if none)"""
+        found = {match.lastgroup for match in self._pattern.finditer(question or '')}
+        return [name for name in self.intents if name in found]
@@ -0,0 +1,227 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from .cache import TTLCache
+from .metrics import percentile
+
+_WORDS = re.compile(r'[a-z0-9$.%]+')
+
+
+def normalize_question(question):
+    """Case, spacing and punctuation-insensitive form of a question, for cache keys"""
+    return ' '.join(word.strip('.') for word in _WORDS.findall(question.lower()) if word.strip('.'))
+
+
+def snapshot_digest(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; used when a backend reports no usage
+    return max(1, len(text) // 4) if text else 0
+
+
+class CerebrasChat:
+    """Chat completions from the Cerebras cloud SDK, streamed"""
+
+    def __init__(self, client=None, model=None, max_tokens=None, temperature=None):
+        self._client = client
+        self.model = model or os.getenv('CEREBRAS_MODEL', 'llama3.1-8b')
+        self.max_tokens = max_tokens or int(os.getenv('LLM_MAX_TOKENS', '512'))
+        self.temperature = float(os.getenv('LLM_TEMPERATURE', '0.2')) if temperature is None else temperature
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use so importing this module never loads the SDK
+        with self._lock:
+            if self._client is None:
+                from cerebras.cloud.sdk import Cerebras
+                self._client = Cerebras(api_key=os.getenv('CEREBRAS_API_KEY'))
+            return self._client
+
+    def stream(self, messages, usage):
+        """Yield the answer's text chunks; fills `usage` with the reported token counts"""
+        chunks = self.client.chat.completions.create(
+            messages=messages,
+            model=self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True
+        )
+        for chunk in chunks:
+            reported = getattr(chunk, 'usage', None)
+            if reported is not None:
+                usage['prompt_tokens'] = reported.prompt_tokens
+                usage['completion_tokens'] = reported.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class FakeChat:
+    """Deterministic local backend for tests and offline development.
+
+    Answers `reply` (by default an echo of the question) word by word, sleeping `delay`
+    seconds before each word to imitate generation speed.
+    """
+
+    def __init__(self, reply=None, delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = 0
+
+    def stream(self, messages, usage):
+        self.calls += 1
+        question = messages[-1]['content'].rsplit('Question:', 1)[-1].strip()
+        answer = self.reply if self.reply is not None else f'You asked: {question}'
+        for word in re.findall(r'\S+\s*', answer):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word
+
+
+BACKENDS = {
+    'cerebras': CerebrasChat,
+    'fake': FakeChat,
+}
+
+
+class Completion:
+    """One answer, iterable once as it streams in.
+
+    `text` and `usage` are complete after iteration ends; read() consumes the stream and
+    returns the text. On a backend error the stream yields `fallback` instead, if given,
+    and records the error in `usage`.
+    """
+
+    def __init__(self, chunks, usage, fallback=None):
+        self._chunks = chunks
+        self.usage = usage
+        self.fallback = fallback
+        self.parts = []
+        self.done = False
+
+    def __iter__(self):
+        if self.done:
+            return
+        try:
+            for chunk in self._chunks:
+                self.parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            self.usage['error'] = f'{type(e).__name__}: {e}'
+            fallback = f'\n\n{self.fallback}' if self.parts else self.fallback
+            self.parts.append(fallback)
+            yield fallback
+        finally:
+            self.done = True
+
+    @classmethod
+    def fixed(cls, text):
+        """A canned answer that never reached a model"""
+        return cls(iter([text]), {'cached': False, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                  'first_token_seconds': 0.0, 'latency_seconds': 0.0})
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    def read(self):
+        for _ in self:
+            pass
+        return self.text
+
+
+class LLMClient:
+    """Backend-agnostic chat client with a response cache and token / latency accounting.
+
+    Answers are cached under a caller-supplied key (e.g. a normalized question plus a digest
+    of the data it was answered from) for `cache_ttl` seconds; only complete, error-free
+    answers are stored. Every call's usage is returned on its Completion and aggregated in
+    stats().
+    """
+
+    def __init__(self, backend, cache_size=None, cache_ttl=None, history=1000):
+        self.backend = backend
+        self.cache = TTLCache(
+            maxsize=cache_size or int(os.getenv('LLM_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('LLM_CACHE_TTL', '300')) if cache_ttl is None else cache_ttl
+        )
+        self._lock = threading.Lock()
+        self.totals = {'requests': 0, 'cached': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.latencies = deque(maxlen=history)
+        self.first_token_latencies = deque(maxlen=history)
+
+    def stream(self, messages, cache_key=None, fallback=None):
+        usage = {'cached': False, 'prompt_tokens': None, 'completion_tokens': None,
+                 'first_token_seconds': None, 'latency_seconds': None}
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            usage.update(cached=True, prompt_tokens=0, completion_tokens=0,
+                         first_token_seconds=0.0, latency_seconds=0.0)
+            self._record(usage)
+            return Completion(iter([cached]), usage)
+        return Completion(self._generate(messages, cache_key, usage), usage, fallback)
+
+    def complete(self, messages, cache_key=None, fallback=None):
+        return self.stream(messages, cache_key, fallback).read()
+
+    def _generate(self, messages, cache_key, usage):
+        started = time.perf_counter()
+        parts = []
+        try:
+            for chunk in self.backend.stream(messages, usage):
+                if usage['first_token_seconds'] is None:
+                    usage['first_token_seconds'] = time.perf_counter() - started
+                parts.append(chunk)
+                yield chunk
+        except Exception:
+            usage['error'] = True
+            raise
+        finally:
+            usage['latency_seconds'] = time.perf_counter() - started
+            if usage['prompt_tokens'] is None:
+                usage['prompt_tokens'] = sum(estimate_tokens(message['content']) for message in messages)
+            if usage['completion_tokens'] is None:
+                usage['completion_tokens'] = estimate_tokens(''.join(parts))
+            self._record(usage)
+        if cache_key is not None:
+            self.cache.set(cache_key, ''.join(parts))
+
+    def _record(self, usage):
+        with self._lock:
+            self.totals['requests'] += 1
+            self.totals['cached'] += usage['cached']
+            self.totals['errors'] += 'error' in usage
+            self.totals['prompt_tokens'] += usage['prompt_tokens'] or 0
+            self.totals['completion_tokens'] += usage['completion_tokens'] or 0
+            if not usage['cached']:
+                self.latencies.append(usage['latency_seconds'])
+                if usage['first_token_seconds'] is not None:
+                    self.first_token_latencies.append(usage['first_token_seconds'])
+
+    def stats(self):
+        with self._lock:
+            latencies, first_tokens = list(self.latencies), list(self.first_token_latencies)
+            return {
+                **self.totals,
+                'p50_latency_seconds': percentile(latencies, 50),
+                'p99_latency_seconds': percentile(latencies, 99),
+                'p50_first_token_seconds': percentile(first_tokens, 50),
+                'p99_first_token_seconds': percentile(first_tokens, 99),
+                'cache': self.cache.stats(),
+            }
+
+
+def from_env():
+    """LLMClient over the LLM_BACKEND backend ('cerebras' by default, or 'fake')"""
+    name = os.getenv('LLM_BACKEND', 'cerebras')
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown LLM_BACKEND {name!r}; expected one of {sorted(BACKENDS)}')
+    return LLMClient(BACKENDS[name]())
@@ -1,69 +1,214 @@
-import sqlite3
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from textblob import TextBlob
+
+from . import events, storage
+from .cache import TTLCache
+from .content_hash import content_hash
+from .metrics import rate
+
+def _worker_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def generate_summary(content, max_length=150):
+    # Simple summary by truncating content (replace with NLP model if needed)
+    if len(content) <= max_length:
+        return content
+    return content[:max_length].rsplit(' ', 1)[0] + '...'
+
+def analyze_sentiment(text):
+    # Imported on first use: TextBlob pulls in NLTK, which only scoring needs
+    from textblob import TextBlob
+    analysis = TextBlob(text)
+    polarity = analysis.sentiment.polarity
+    if polarity > 0.1:
+        return 'positive', polarity
+    elif polarity < -0.1:
+        return 'negative', polarity
+    else:
+        return 'neutral', polarity
+
+def score_article(content):
+    # Module-level so process-pool workers can unpickle it
+    summary = generate_summary(content)
+    label, polarity = analyze_sentiment(summary)
+    return summary, label, polarity
 
 class MarketInsightAgent:
-    def __init__(self):
-        self.conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
-
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS sentiment_reports
-                             (id INTEGER PRIMARY KEY, 
-                              article_id INTEGER, 
-                              summary TEXT, 
-                              sentiment_polarity REAL, 
-                              sentiment_label TEXT, 
-                              timestamp DATETIME,
-                             FOREIGN KEY(article_id) REFERENCES news_articles(id))''')
-
-    def _get_recent_articles(self, limit=5):
+    def __init__(self, pipeline_config=None):
+        self.pipeline_config = {
+            'batch_size': int(os.getenv('SENTIMENT_BATCH_SIZE', '500')),
+            'workers': int(os.getenv('SENTIMENT_WORKERS', str(os.cpu_count() or 1))),
+        }
+        self.pipeline_config.update(pipeline_config or {})
+        # content_hash -> (summary, label, polarity); backed by the analysis_cache table
+        self.analysis_cache = TTLCache(maxsize=int(os.getenv('ANALYSIS_CACHE_SIZE', '50000')))
+        self.last_pipeline_stats = None
+
+    @property
+    def conn(self):
+        return storage.connection('market_data')
+
+    def _get_high_water_mark(self):
+        row = self.conn.execute(
+            "SELECT value FROM pipeline_state WHERE name = 'sentiment_high_water_mark'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _get_articles_after(self, article_id, limit):
         return self.conn.execute(
-            'SELECT * FROM news_articles ORDER BY timestamp DESC LIMIT ?', 
-            (limit,)
+            'SELECT id, title, content, content_hash FROM news_articles WHERE id > ? ORDER BY id LIMIT ?',
+            (article_id, limit)
         ).fetchall()
 
+    def _cached_analyses(self, digests):
+        found = {}
+        for digest in digests:
+            analysis = self.analysis_cache.get(digest)
+            if analysis is not None:
+                found[digest] = analysis
+        missing = [digest for digest in digests if digest not in found]
+        if missing:
+            rows = self.conn.execute(
+                '''SELECT content_hash, summary, sentiment_label, sentiment_polarity
+                   FROM analysis_cache
+                   WHERE content_hash IN (SELECT value FROM json_each(?))''',
+                (json.dumps(missing),)
+            )
+            for digest, summary, label, polarity in rows:
+                found[digest] = (summary, label, polarity)
+                self.analysis_cache.set(digest, found[digest])
+        return found
+
     def _generate_summary(self, content, max_length=150):
-        # Simple summary by truncating content (replace with NLP model if needed)
-        if len(content) <= max_length:
-            return content
-        return content[:max_length].rsplit(' ', 1)[0] + '...'
+        return generate_summary(content, max_length)
 
     def analyze_sentiment(self, text):
-        analysis = TextBlob(text)
-        polarity = analysis.sentiment.polarity
-        if polarity > 0.1:
-            return 'positive', polarity
-        elif polarity < -0.1:
-            return 'negative', polarity
-        else:
-            return 'neutral', polarity
-
-    def generate_insight_report(self):
-        articles = self._get_recent_articles()
-        reports = []
-        
-        for article in articles:
-            summary = self._generate_summary(article[2])  # content field
-            sentiment_label, polarity = self.analyze_sentiment(summary)
-            
-            self.conn.execute(
-                'INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp) VALUES (?, ?, ?, ?, ?)',
-                (article[0], summary, polarity, sentiment_label, datetime.now())
-            )
-            reports.append({
-                'title': article[1],
+        return analyze_sentiment(text)
+
+    def run_sentiment_pipeline(self, batch_size=None, workers=None, deadline=None):
+        """Score every article past the high-water mark exactly once, in batches.
+
+        Small increments are scored in-process; the process pool only starts once a full
+        batch shows there is a backlog. Reports are upserted on article_id and the mark
+        advances in the same transaction, so re-runs and overlapping runs are idempotent.
+        With a `deadline` (time.monotonic() value) no new batch starts after it; the next
+        run resumes from the mark.
+        """
+        batch_size = batch_size or self.pipeline_config['batch_size']
+        workers = workers or self.pipeline_config['workers']
+        started = time.perf_counter()
+        processed, batches, cache_hits = 0, 0, 0
+        high_water_mark = self._get_high_water_mark()
+
+        pool = None
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                articles = self._get_articles_after(high_water_mark, batch_size)
+                if not articles:
+                    break
+                # Identical text (reposts, repeats within the batch) is only ever analysed once
+                digests = [article[3] or content_hash(article[2], article[1]) for article in articles]
+                # Articles without text (digest None) all score alike but are never cached
+                analyses = self._cached_analyses([digest for digest in dict.fromkeys(digests) if digest is not None])
+                pending = {}
+                for article, digest in zip(articles, digests):
+                    if digest not in analyses:
+                        pending.setdefault(digest, article[2] or '')
+                if pool is None and workers > 1 and len(pending) == batch_size:
+                    # Never fork: this process runs threads (scheduler, flushers, pools) whose
+                    # held locks and SQLite handles a forked child would inherit mid-use
+                    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_worker_context())
+                contents = list(pending.values())
+                if pool is None:
+                    scores = map(score_article, contents)
+                else:
+                    scores = pool.map(score_article, contents, chunksize=max(1, len(contents) // (workers * 4)))
+                scored = dict(zip(pending, scores))
+                cache_hits += len(articles) - len(scored)
+                now = datetime.now()
+                high_water_mark = articles[-1][0]
+                cacheable = {digest: analysis for digest, analysis in scored.items() if digest is not None}
+                for digest, analysis in cacheable.items():
+                    self.analysis_cache.set(digest, analysis)
+                analyses.update(scored)
+                reports = []
+                for article, digest in zip(articles, digests):
+                    summary, label, polarity = analyses[digest]
+                    reports.append((article[0], summary, polarity, label, now))
+                with self.conn:
+                    self.conn.executemany(
+                        'INSERT OR IGNORE INTO analysis_cache (content_hash, summary, sentiment_label, sentiment_polarity, created_at) VALUES (?, ?, ?, ?, ?)',
+                        [(digest, summary, label, polarity, now) for digest, (summary, label, polarity) in cacheable.items()]
+                    )
+                    self.conn.executemany(
+                        '''INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp)
+                           VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT (article_id) DO UPDATE SET
+                             summary = excluded.summary,
+                             sentiment_polarity = excluded.sentiment_polarity,
+                             sentiment_label = excluded.sentiment_label,
+                             timestamp = excluded.timestamp''',
+                        reports
+                    )
+                    self.conn.execute(
+                        '''INSERT INTO pipeline_state (name, value, updated_at)
+                           VALUES ('sentiment_high_water_mark', ?, ?)
+                           ON CONFLICT (name) DO UPDATE SET
+                             value = MAX(value, excluded.value),
+                             updated_at = excluded.updated_at''',
+                        (high_water_mark, now)
+                    )
+                events.bus.publish('insights', [
+                    {'article_id': article[0], 'title': article[1], 'summary': summary,
+                     'sentiment': label, 'polarity': round(polarity, 3)}
+                    for article, (_, summary, polarity, label, _) in zip(articles, reports)
+                ])
+                processed += len(articles)
+                batches += 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - started
+        self.last_pipeline_stats = {
+            'articles': processed,
+            'batches': batches,
+            'workers': workers if pool is not None else 1,
+            'high_water_mark': high_water_mark,
+            'cache_hits': cache_hits,
+            'elapsed_seconds': elapsed,
+            'articles_per_second': rate(processed, elapsed),
+        }
+        return self.last_pipeline_stats
+
+    def generate_insight_report(self, limit=5):
+        # Only articles newer than the high-water mark cost any scoring work
+        self.run_sentiment_pipeline()
+        rows = self.conn.execute(
+            '''SELECT article.title, report.summary, report.sentiment_label, report.sentiment_polarity
+               FROM sentiment_reports AS report
+               JOIN news_articles AS article ON article.id = report.article_id
+               ORDER BY report.article_id DESC
+               LIMIT ?''',
+            (limit,)
+        ).fetchall()
+        return [
+            {
+                'title': title,
                 'summary': summary,
                 'sentiment': sentiment_label,
                 'polarity': round(polarity, 3)
-            })
-        
-        self.conn.commit()
-        return reports
+            }
+            for title, summary, sentiment_label, polarity in rows
+        ]
 
     def get_latest_reports(self, limit=5):
-        return self.conn.execute(
+        return storage.records(self.conn.execute(
             'SELECT * FROM sentiment_reports ORDER BY timestamp DESC LIMIT ?', 
             (limit,)
-        ).fetchall()
+        ))
@@ -0,0 +1,109 @@
+import threading
+from collections import Counter
+
+from . import events, price_store, storage
+
+
+class PortfolioValueTracker:
+    """Live portfolio value for users with an open stream, kept current from tick events.
+
+    Positions are loaded once, when a user's first stream opens; after that each tick batch
+    costs one update per (user holding a ticked symbol), and each affected user gets one
+    'portfolio' event with the new value and the change since the previous one.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._watchers = Counter()
+        self._positions = {}
+        self._holders = {}
+        self._prices = {}
+        self._values = {}
+        bus.add_listener('ticks', self._on_ticks)
+        bus.add_listener('positions', self._on_positions)
+
+    def _load_positions(self, user_id):
+        return dict(storage.connection('portfolio').execute(
+            'SELECT symbol, quantity FROM holdings WHERE user_id = ?', (user_id,)
+        ))
+
+    def watch(self, user_id):
+        """Start tracking a user (reference counted); publishes their current value"""
+        with self._lock:
+            self._watchers[user_id] += 1
+            if self._watchers[user_id] > 1:
+                return
+        self.reload(user_id)
+
+    def unwatch(self, user_id):
+        with self._lock:
+            self._watchers[user_id] -= 1
+            if self._watchers[user_id] > 0:
+                return
+            del self._watchers[user_id]
+            self._forget(user_id)
+
+    def _forget(self, user_id):
+        for symbol in self._positions.pop(user_id, {}):
+            holders = self._holders.get(symbol)
+            if holders is not None:
+                holders.discard(user_id)
+                if not holders:
+                    del self._holders[symbol]
+        self._values.pop(user_id, None)
+
+    def reload(self, user_id):
+        """Re-read a tracked user's positions, e.g. after a portfolio sync"""
+        price_store.ensure_warm(lambda: storage.connection('market_data'))
+        positions = self._load_positions(user_id)
+        with self._lock:
+            if user_id not in self._watchers:
+                return
+            previous = self._values.get(user_id)
+            self._forget(user_id)
+            self._positions[user_id] = positions
+            value = 0.0
+            for symbol, quantity in positions.items():
+                self._holders.setdefault(symbol, set()).add(user_id)
+                if symbol not in self._prices:
+                    price = price_store.latest_price(symbol)
+                    if price is not None:
+                        self._prices[symbol] = price
+                value += quantity * self._prices.get(symbol, 0.0)
+            self._values[user_id] = value
+        self.bus.publish('portfolio', {'value': value, 'delta': value - (previous or value), 'symbols': []},
+                         user_id=user_id)
+
+    def _on_positions(self, change):
+        if change['user_id'] in self._watchers:
+            self.reload(change['user_id'])
+
+    def watched(self):
+        with self._lock:
+            return list(self._watchers)
+
+    def value(self, user_id):
+        return self._values.get(user_id)
+
+    def _on_ticks(self, ticks):
+        updates = {}
+        with self._lock:
+            for tick in ticks:
+                symbol, price = tick['symbol'], tick['price']
+                previous = self._prices.get(symbol)
+                self._prices[symbol] = price
+                for user_id in self._holders.get(symbol, ()):
+                    delta = self._positions[user_id][symbol] * (price - (previous or 0.0))
+                    self._values[user_id] += delta
+                    update = updates.setdefault(user_id, {'delta': 0.0, 'symbols': set()})
+                    update['delta'] += delta
+                    update['symbols'].add(symbol)
+            for user_id, update in updates.items():
+                update['value'] = self._values[user_id]
+                update['symbols'] = sorted(update['symbols'])
+        for user_id, update in updates.items():
+            self.bus.publish('portfolio', update, user_id=user_id)
+
+
+tracker = PortfolioValueTracker(events.bus)
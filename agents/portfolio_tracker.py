@@ -1,43 +1,213 @@
-import requests
-import sqlite3
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
 
+from . import events, storage
+from .http_client import TokenBucket, build_session, get_with_retry
+from .metrics import percentile, rate
+
 class PortfolioTracker:
-    def __init__(self):
+    def __init__(self, sync_config=None):
         self.api_key = os.getenv('BROKERAGE_API_KEY')
-        self.conn = sqlite3.connect('portfolio.db', check_same_thread=False)
-        self._create_tables()
+        self.sync_config = {
+            'url': os.getenv('BROKERAGE_API_URL', 'https://api.brokerage.com/v1'),
+            'workers': int(os.getenv('BROKERAGE_SYNC_WORKERS', '16')),
+            # Requests per second across all workers, and the burst allowed above that
+            'rate': float(os.getenv('BROKERAGE_RATE_LIMIT', '20')),
+            'burst': int(os.getenv('BROKERAGE_RATE_BURST', '20')),
+            'timeout': float(os.getenv('BROKERAGE_TIMEOUT', '5')),
+            'budget': float(os.getenv('BROKERAGE_SYNC_BUDGET', '600')),
+            'retries': int(os.getenv('BROKERAGE_RETRIES', '3')),
+            'backoff': float(os.getenv('BROKERAGE_BACKOFF', '0.5')),
+            # Users whose positions are written per transaction
+            'batch_size': int(os.getenv('BROKERAGE_SYNC_BATCH_SIZE', '100')),
+        }
+        self.sync_config.update(sync_config or {})
+        self.session = build_session(
+            pool_size=self.sync_config['workers'],
+            headers={'Authorization': f'Bearer {self.api_key}'}
+        )
+        self.rate_limiter = TokenBucket(self.sync_config['rate'], self.sync_config['burst'])
+        self.last_sync_stats = None
 
-    def _create_tables(self):
-        with self.conn:
-            self.conn.execute('''CREATE TABLE IF NOT EXISTS portfolio
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              symbol TEXT, 
-                              quantity REAL, 
-                              purchase_price REAL, 
-                              timestamp DATETIME)''')
+    @property
+    def conn(self):
+        return storage.connection('portfolio')
 
-    def fetch_portfolio_data(self, user_id):
-        response = requests.get(
-            'https://api.brokerage.com/v1/portfolio',
-            headers={'Authorization': f'Bearer {self.api_key}'},
+    def _fetch_positions(self, user_id, deadline):
+        config = self.sync_config
+        started = time.perf_counter()
+        response = get_with_retry(
+            self.session,
+            f'{config["url"]}/portfolio',
+            deadline,
+            timeout=config['timeout'],
+            retries=config['retries'],
+            backoff=config['backoff'],
+            rate_limiter=self.rate_limiter,
             params={'user_id': user_id}
         )
-        if response.status_code == 200:
-            positions = response.json()['positions']
-            with self.conn:
-                for position in positions:
-                    self.conn.execute(
-                        'INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)',
-                        (user_id, position['symbol'], position['quantity'], position['price'], datetime.now())
-                    )
-            return positions
-        return None
+        latency = time.perf_counter() - started
+        if response is None:
+            return None, latency
+        return response.json()['positions'], latency
+
+    def fetch_portfolio_data(self, user_id):
+        positions, _ = self._fetch_positions(user_id, time.monotonic() + self.sync_config['budget'])
+        if positions is not None:
+            self.sync_positions(user_id, positions)
+        return positions
+
+    def _aggregate(self, positions):
+        incoming = {}
+        for position in positions:
+            quantity, price = float(position['quantity']), float(position['price'])
+            held = incoming.get(position['symbol'])
+            if held is not None:
+                # Several lots of one symbol: one position at their average cost
+                total = held[0] + quantity
+                price = (held[0] * held[1] + quantity * price) / total if total else price
+                quantity = total
+            incoming[position['symbol']] = (quantity, price)
+        return incoming
+
+    def sync_positions(self, user_id, positions):
+        """Make a user's holdings match a full position list from the brokerage.
+
+        Only positions that changed are written: upserted into `holdings` (or deleted when
+        closed) and logged once in `holdings_history`. Returns the changes as
+        (symbol, quantity, purchase_price) tuples, with quantity 0 for closed positions.
+        """
+        return self.sync_many({user_id: positions})[user_id]
+
+    def sync_many(self, positions_by_user):
+        """sync_positions() for several users in one transaction; returns their changes by user"""
+        current = {user_id: {} for user_id in positions_by_user}
+        for user_id, symbol, quantity, price in self.conn.execute(
+            'SELECT user_id, symbol, quantity, purchase_price FROM holdings WHERE user_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(list(positions_by_user)),)
+        ):
+            current[user_id][symbol] = (quantity, price)
+
+        changes_by_user = {}
+        for user_id, positions in positions_by_user.items():
+            incoming, held = self._aggregate(positions), current[user_id]
+            changes = [(symbol, quantity, price) for symbol, (quantity, price) in incoming.items()
+                       if held.get(symbol) != (quantity, price) and (quantity or symbol in held)]
+            changes += [(symbol, 0.0, price) for symbol, (_, price) in held.items() if symbol not in incoming]
+            changes_by_user[user_id] = changes
+
+        changed = [(user_id, change) for user_id, changes in changes_by_user.items() for change in changes]
+        if not changed:
+            return changes_by_user
+
+        now = datetime.now()
+        with self.conn:
+            self.conn.executemany(
+                '''INSERT INTO holdings (user_id, symbol, quantity, purchase_price, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (user_id, symbol) DO UPDATE SET
+                     quantity = excluded.quantity,
+                     purchase_price = excluded.purchase_price,
+                     updated_at = excluded.updated_at''',
+                [(user_id, symbol, quantity, price, now) for user_id, (symbol, quantity, price) in changed if quantity]
+            )
+            self.conn.executemany(
+                'DELETE FROM holdings WHERE user_id = ? AND symbol = ?',
+                [(user_id, symbol) for user_id, (symbol, quantity, _) in changed if not quantity]
+            )
+            self.conn.executemany(
+                'INSERT INTO holdings_history (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)',
+                [(user_id, symbol, quantity, price, now) for user_id, (symbol, quantity, price) in changed]
+            )
+        for user_id, changes in changes_by_user.items():
+            if changes:
+                events.bus.publish('positions', {'user_id': user_id, 'changes': changes})
+        return changes_by_user
+
+    def _active_users(self):
+        # Imported here: the live tracker pulls in numpy through the price store
+        from .portfolio_stream import tracker
+        return tracker.watched()
+
+    def sync_all_portfolios(self, user_ids=None, active_users=None, deadline=None, progress=None):
+        """Sync many users' positions from the brokerage concurrently.
+
+        Defaults to every user with holdings or a sync history, plus the users with an open
+        session (`active_users`, by default those with a live portfolio stream), who are
+        fetched first. Requests share one token bucket, so the brokerage sees at most `rate`
+        requests per second however many workers run, and fetched positions are written
+        `batch_size` users per transaction.
+        `progress`, if given, is called with the running stats after each batch.
+        """
+        config = self.sync_config
+        started, waited = time.perf_counter(), self.rate_limiter.waited
+        deadline = deadline or time.monotonic() + config['budget']
+        active = set(self._active_users() if active_users is None else active_users)
+        if user_ids is None:
+            # Everyone ever synced, not just current holders: a user who closed every position
+            # may open new ones; plus streaming users not synced yet
+            user_ids = [row[0] for row in self.conn.execute(
+                'SELECT user_id FROM holdings UNION SELECT user_id FROM holdings_history'
+            )] + sorted(active)
+        # Stable sort: active users first, otherwise in the given order
+        user_ids = sorted(dict.fromkeys(user_ids), key=lambda user_id: user_id not in active)
+
+        stats = {'users': len(user_ids), 'active_users': len(active.intersection(user_ids)), 'synced': 0,
+                 'failed': 0, 'changed_users': 0, 'position_changes': 0, 'batches': 0}
+        latencies, batch = [], {}
+
+        def flush():
+            changes_by_user = self.sync_many(batch)
+            stats['synced'] += len(batch)
+            stats['changed_users'] += sum(1 for changes in changes_by_user.values() if changes)
+            stats['position_changes'] += sum(len(changes) for changes in changes_by_user.values())
+            stats['batches'] += 1
+            batch.clear()
+            if progress is not None:
+                elapsed = time.perf_counter() - started
+                progress(dict(stats, elapsed_seconds=elapsed, users_per_second=rate(stats['synced'], elapsed)))
+
+        # Workers only do network I/O; writes happen here, one transaction per batch
+        workers = max(1, min(config['workers'], len(user_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self._fetch_positions, user_id, deadline): user_id for user_id in user_ids}
+            for future in as_completed(futures):
+                try:
+                    positions, latency = future.result()
+                except Exception:
+                    # Any failure (bad payload, transport error) counts the user as failed
+                    positions, latency = None, 0.0
+                latencies.append(latency)
+                if positions is None:
+                    stats['failed'] += 1
+                    continue
+                batch[futures[future]] = positions
+                if len(batch) >= config['batch_size']:
+                    flush()
+        if batch:
+            flush()
+
+        elapsed = time.perf_counter() - started
+        stats.update({
+            'elapsed_seconds': elapsed,
+            'users_per_second': rate(stats['synced'], elapsed),
+            'p99_latency_seconds': percentile(latencies, 99),
+            'rate_limit_wait_seconds': self.rate_limiter.waited - waited,
+        })
+        self.last_sync_stats = stats
+        return stats
 
     def get_user_portfolio(self, user_id, limit=10):
         return self.conn.execute(
-            'SELECT * FROM portfolio WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?',
+            'SELECT * FROM holdings WHERE user_id = ? ORDER BY updated_at DESC LIMIT ?',
+            (user_id, limit)
+        ).fetchall()
+
+    def get_position_history(self, user_id, limit=50):
+        return self.conn.execute(
+            'SELECT * FROM holdings_history WHERE user_id = ? ORDER BY id DESC LIMIT ?',
             (user_id, limit)
         ).fetchall()
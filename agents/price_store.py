@@ -0,0 +1,278 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from . import storage
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_ns(timestamp):
+    """Naive datetime (or its ISO string, as stored in SQLite) to int64 epoch nanoseconds"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+class PriceSeries:
+    """Fixed-capacity ring buffer of (time, price) points for one symbol.
+
+    Every point is written twice, one ring length apart, so the latest n are always
+    a single contiguous slice and can be handed out as views. The ring has one spare
+    slot, so a window never covers the slot the next append writes to.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._ring = capacity + 1
+        self._prices = np.empty(2 * self._ring, dtype=np.float64)
+        self._times = np.empty(2 * self._ring, dtype=np.int64)
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self._prices.nbytes + self._times.nbytes
+
+    @property
+    def last_time(self):
+        if not self._count:
+            return None
+        return int(self._times[(self._count - 1) % self._ring])
+
+    def append(self, timestamp_ns, price):
+        # Points must arrive in time order: one at the latest time replaces it (e.g. the
+        # still-open daily bar), older stragglers are dropped
+        if self._count:
+            last_time = self.last_time
+            if timestamp_ns < last_time:
+                return False
+            if timestamp_ns == last_time:
+                slot = (self._count - 1) % self._ring
+                self._prices[slot] = self._prices[slot + self._ring] = price
+                return True
+        slot = self._count % self._ring
+        self._prices[slot] = self._prices[slot + self._ring] = price
+        self._times[slot] = self._times[slot + self._ring] = timestamp_ns
+        self._count += 1
+        return True
+
+    def window(self, n=None):
+        """Read-only (times, prices) views of the latest n points, oldest first"""
+        size = len(self) if n is None else min(n, len(self))
+        end = (self._count - 1) % self._ring + self._ring + 1 if self._count else 0
+        times = self._times[end - size:end]
+        prices = self._prices[end - size:end]
+        times.flags.writeable = False
+        prices.flags.writeable = False
+        return times, prices
+
+
+TICKS_QUERY = '''SELECT symbol, price, timestamp FROM
+                   (SELECT symbol, price, timestamp,
+                           ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY timestamp DESC) AS age
+                    FROM market_data)
+                 WHERE age <= ?
+                 ORDER BY symbol, timestamp'''
+
+DAILY_CLOSES_QUERY = '''SELECT symbol, close, bucket FROM
+                          (SELECT symbol, close, bucket,
+                                  ROW_NUMBER() OVER (PARTITION BY symbol ORDER BY bucket DESC) AS age
+                           FROM market_bars
+                           WHERE resolution = '1d')
+                        WHERE age <= ?
+                        ORDER BY symbol, bucket'''
+
+# What other processes wrote since the last look: new ticks by id, and the daily closes they touched
+NEW_TICKS_QUERY = 'SELECT symbol, price, timestamp FROM market_data WHERE id > ? AND id <= ? ORDER BY timestamp'
+NEW_DAILY_CLOSES_QUERY = '''SELECT symbol, close, bucket FROM market_bars
+                            WHERE resolution = '1d' AND bucket >= ?
+                            ORDER BY bucket'''
+
+
+class PriceStore:
+    """Resident per-symbol price history shared by ingestion and risk analysis.
+
+    `query` selects (symbol, price, timestamp) rows, oldest first, limited to `capacity`
+    per symbol; it is what warm() loads. Views returned by window() and since() alias the
+    ring buffers, so callers that keep them across later appends should copy them first.
+    """
+
+    def __init__(self, capacity, query=TICKS_QUERY):
+        self.capacity = capacity
+        self.query = query
+        self._series = {}
+        self._lock = threading.Lock()
+        self.warmed = False
+
+    def __contains__(self, symbol):
+        return symbol in self._series
+
+    def symbols(self):
+        return list(self._series)
+
+    def _append(self, symbol, timestamp_ns, price):
+        series = self._series.get(symbol)
+        if series is None:
+            series = self._series[symbol] = PriceSeries(self.capacity)
+        return series.append(timestamp_ns, price)
+
+    def extend(self, rows):
+        """Append (symbol, price, timestamp) rows, e.g. the ticks ingestion just wrote.
+
+        Ignored until the store is warmed, since warming reads those rows from SQLite anyway.
+        """
+        if not self.warmed:
+            return 0
+        with self._lock:
+            return sum(self._append(symbol, to_epoch_ns(timestamp), price) for symbol, price, timestamp in rows)
+
+    def warm(self, conn):
+        """(Re)load the latest `capacity` points of every symbol from SQLite"""
+        rows = conn.execute(self.query, (self.capacity,))
+        with self._lock:
+            self._series = {}
+            for symbol, price, timestamp in rows:
+                self._append(symbol, to_epoch_ns(timestamp), price)
+            self.warmed = True
+
+    def ensure_warm(self, conn_factory):
+        if not self.warmed:
+            self.warm(conn_factory())
+
+    def window(self, symbol, n=None):
+        series = self._series.get(symbol)
+        if series is None or not len(series):
+            return None
+        return series.window(n)
+
+    def since(self, symbol, start_ns):
+        """Views of every point at or after `start_ns` still held for `symbol`"""
+        window = self.window(symbol)
+        if window is None:
+            return None
+        times, prices = window
+        start = np.searchsorted(times, start_ns)
+        return times[start:], prices[start:]
+
+    def last_time(self, symbol):
+        series = self._series.get(symbol)
+        return None if series is None else series.last_time
+
+    def memory_usage(self):
+        """Bytes held per symbol"""
+        return {symbol: series.nbytes for symbol, series in self._series.items()}
+
+
+# Raw ticks, and daily closes (the open day's close tracks the latest tick)
+store = PriceStore(int(os.getenv('PRICE_STORE_CAPACITY', '1024')))
+daily = PriceStore(int(os.getenv('DAILY_STORE_CAPACITY', '2600')), DAILY_CLOSES_QUERY)
+
+
+def latest_price(symbol):
+    """A symbol's newest price: its latest tick, else (once compaction dropped its ticks) its last daily close"""
+    for source in (store, daily):
+        window = source.window(symbol, 1)
+        if window is not None:
+            return float(window[1][-1])
+    return None
+
+
+# Only the process running the scheduler ingests; every other process (e.g. further ASGI
+# workers) catches up from SQLite, checking for new ticks this often from a background thread
+REFRESH_SECONDS = float(os.getenv('PRICE_STORE_REFRESH_SECONDS', '1'))
+_refresh_lock = threading.Lock()
+_refresh_state = {'tick_id': 0}
+_refresher_lock = threading.Lock()
+_refresher = {'thread': None, 'stop': None}
+
+
+def _latest_tick_id(conn):
+    # MAX of the rowid is a single b-tree seek
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM market_data').fetchone()[0]
+
+
+def _warm(conn):
+    # Mark first: ticks landing mid-warm are read again on the next refresh, which is harmless
+    _refresh_state['tick_id'] = _latest_tick_id(conn)
+    store.warm(conn)
+    daily.warm(conn)
+
+
+def refresh(conn):
+    """Append ticks and daily closes written to SQLite since the last warm or refresh.
+
+    Returns the number of new ticks read. Rows this process already appended are replayed
+    harmlessly (a point at a series' latest time replaces it); if the table shrank below
+    the last mark (e.g. the database was replaced), both stores are re-warmed.
+    """
+    with _refresh_lock:
+        if not (store.warmed and daily.warmed):
+            _warm(conn)
+            return 0
+        latest, seen = _latest_tick_id(conn), _refresh_state['tick_id']
+        if latest == seen:
+            return 0
+        if latest < seen:
+            _warm(conn)
+            return 0
+        rows = conn.execute(NEW_TICKS_QUERY, (seen, latest)).fetchall()
+        _refresh_state['tick_id'] = latest
+        if rows:
+            store.extend(rows)
+            first_day = datetime.fromisoformat(min(row[2] for row in rows)).replace(hour=0, minute=0, second=0, microsecond=0)
+            daily.extend(conn.execute(NEW_DAILY_CLOSES_QUERY, (str(first_day),)).fetchall())
+        return len(rows)
+
+
+def ensure_warm(conn_factory):
+    """Warm both stores on first use; start_refresher() keeps them current after that"""
+    if not (store.warmed and daily.warmed):
+        with _refresh_lock:
+            if not (store.warmed and daily.warmed):
+                _warm(conn_factory())
+
+
+def _refresh_loop(stop, interval):
+    try:
+        while not stop.wait(interval):
+            try:
+                refresh(storage.connection('market_data'))
+            except Exception:
+                # Retried at the next interval; readers keep the points already held
+                logger.exception('Price store refresh failed')
+    finally:
+        storage.release()
+
+
+def start_refresher(interval=None):
+    """Warm both stores now and refresh() them every `interval` seconds (REFRESH_SECONDS)
+    from a background thread, so requests never wait on the catch-up. Starting it again
+    while it runs does nothing; stop_refresher() ends it."""
+    with _refresher_lock:
+        if _refresher['thread'] is not None:
+            return False
+        ensure_warm(lambda: storage.connection('market_data'))
+        stop = threading.Event()
+        thread = threading.Thread(target=_refresh_loop, args=(stop, interval or REFRESH_SECONDS),
+                                  name='price-store-refresher', daemon=True)
+        _refresher.update(thread=thread, stop=stop)
+        thread.start()
+        return True
+
+
+def stop_refresher():
+    with _refresher_lock:
+        thread, stop = _refresher['thread'], _refresher['stop']
+        _refresher.update(thread=None, stop=None)
+    if thread is not None:
+        stop.set()
+        thread.join()
@@ -1,42 +1,113 @@
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
+import os
+import time
 import pandas as pd
 
+from . import storage
+from .metrics import rate
+
+# How far back news counts as current when matching sentiment to holdings
+SENTIMENT_LOOKBACK_HOURS = float(os.getenv('SENTIMENT_LOOKBACK_HOURS', '72'))
+
+RISK_VAR_THRESHOLD = 5
+
+
+def _risk_message(var_percentage):
+    return f'High portfolio risk ({var_percentage:.1f}% VaR). Consider diversifying high-risk positions.'
+
+
+def _negative_message(symbol, reason):
+    return f'Consider reviewing position in {symbol} due to negative sentiment: {reason}'
+
+
+def _opportunity_message(symbol, reason):
+    return f'Positive sentiment detected for {symbol}: {reason} - may warrant consideration'
+
+
 class RecommendationAgent:
-    def __init__(self):
-        self.portfolio_conn = sqlite3.connect('portfolio.db', check_same_thread=False)
-        self.market_conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self._create_tables()
+    def __init__(self, batch_config=None):
+        self.batch_config = {
+            # Holding rows fetched per round trip in bulk runs
+            'chunk_size': int(os.getenv('RECOMMENDATION_CHUNK_SIZE', '5000')),
+        }
+        self.batch_config.update(batch_config or {})
+        self.last_bulk_stats = None
 
-    def _create_tables(self):
-        with self.market_conn:
-            self.market_conn.execute('''CREATE TABLE IF NOT EXISTS recommendations
-                             (id INTEGER PRIMARY KEY, 
-                              user_id TEXT, 
-                              recommendation TEXT, 
-                              confidence REAL, 
-                              timestamp DATETIME)''')
+    @property
+    def portfolio_conn(self):
+        return storage.connection('portfolio')
+
+    @property
+    def market_conn(self):
+        return storage.connection('market_data')
 
     def _get_portfolio_risk(self, user_id):
-        risk_conn = sqlite3.connect('portfolio.db')
-        risk_metrics = pd.read_sql(f"SELECT * FROM risk_metrics WHERE user_id = '{user_id}' ORDER BY timestamp DESC LIMIT 1", risk_conn)
+        risk_metrics = pd.read_sql(
+            'SELECT * FROM risk_metrics WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1',
+            self.portfolio_conn,
+            params=(user_id,)
+        )
         return risk_metrics.iloc[0] if not risk_metrics.empty else None
 
-    def _get_sentiment_data(self):
-        return pd.read_sql("SELECT * FROM sentiment_reports ORDER BY timestamp DESC LIMIT 5", self.market_conn)
+    def _get_holdings(self, user_id):
+        return [row[0] for row in self.portfolio_conn.execute(
+            'SELECT symbol FROM holdings WHERE user_id = ?', (user_id,)
+        )]
+
+    def _first_recent_article(self):
+        # Articles are numbered in ingestion order, so "recent" is an id range on article_symbols
+        since = datetime.now() - timedelta(hours=SENTIMENT_LOOKBACK_HOURS)
+        row = self.market_conn.execute('SELECT MIN(id) FROM news_articles WHERE timestamp >= ?', (since,)).fetchone()
+        return row[0]
+
+    def _get_symbol_sentiment(self, first_article, symbols=None):
+        """Latest scored (symbol, label, summary) per symbol mentioned since `first_article`.
+
+        Covers every mentioned symbol when `symbols` is None.
+        """
+        params = [first_article]
+        symbol_filter = ''
+        if symbols is not None:
+            symbol_filter = 'AND mention.symbol IN (SELECT value FROM json_each(?))'
+            params.append(json.dumps(symbols))
+        return self.market_conn.execute(
+            f'''SELECT symbol, sentiment_label, summary FROM
+                  (SELECT mention.symbol, report.sentiment_label, report.summary,
+                          ROW_NUMBER() OVER (PARTITION BY mention.symbol ORDER BY mention.article_id DESC) AS age
+                   FROM article_symbols AS mention
+                   JOIN sentiment_reports AS report ON report.article_id = mention.article_id
+                   WHERE mention.article_id >= ? {symbol_filter})
+                WHERE age = 1''',
+            params
+        ).fetchall()
+
+    def _get_positive_mentions(self, first_article, limit):
+        """The `limit` symbols with the most recent positive coverage, and that coverage's summary"""
+        # SQLite takes the bare `summary` column from the row that supplied MAX(article_id)
+        return self.market_conn.execute(
+            '''SELECT mention.symbol, report.summary, MAX(report.article_id) AS latest
+               FROM sentiment_reports AS report
+               JOIN article_symbols AS mention ON mention.article_id = report.article_id
+               WHERE report.article_id >= ? AND report.sentiment_label = 'positive'
+               GROUP BY mention.symbol
+               ORDER BY latest DESC
+               LIMIT ?''',
+            (first_article, limit)
+        ).fetchall()
 
     def generate_recommendations(self, user_id):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
+        holdings = self._get_holdings(user_id)
         risk_metrics = self._get_portfolio_risk(user_id)
-        sentiment_data = self._get_sentiment_data()
+        first_article = self._first_recent_article()
         
         recommendations = []
         
         # Risk-based recommendations
-        if risk_metrics and risk_metrics['var_percentage'] > 5:
+        if risk_metrics is not None and risk_metrics['var_percentage'] > RISK_VAR_THRESHOLD:
             recommendations.append({
                 'type': 'risk',
-                'message': f'High portfolio risk ({risk_metrics["var_percentage"]:.1f}% VaR). Consider diversifying high-risk positions.',
+                'message': _risk_message(risk_metrics['var_percentage']),
                 'confidence': 0.8
             })
         
@@ -44,20 +115,18 @@ class RecommendationAgent:
         negative_assets = []
         positive_opportunities = []
         
-        for _, row in sentiment_data.iterrows():
-            if row['sentiment_label'] == 'negative':
-                # Check if user holds this asset
-                matching = portfolio[portfolio['symbol'] == row['title'].split()[0]]
-                if not matching.empty:
+        if first_article is not None:
+            for symbol, label, summary in self._get_symbol_sentiment(first_article, holdings):
+                if label == 'negative':
                     negative_assets.append({
-                        'symbol': row['title'].split()[0],
-                        'reason': row['summary'],
+                        'symbol': symbol,
+                        'reason': summary,
                         'confidence': 0.7
                     })
-            elif row['sentiment_label'] == 'positive' and len(positive_opportunities) < 2:
+            for symbol, summary, _ in self._get_positive_mentions(first_article, 2):
                 positive_opportunities.append({
-                    'symbol': row['title'].split()[0],
-                    'reason': row['summary'],
+                    'symbol': symbol,
+                    'reason': summary,
                     'confidence': 0.65
                 })
         
@@ -65,7 +134,7 @@ class RecommendationAgent:
         for asset in negative_assets:
             recommendations.append({
                 'type': 'sentiment',
-                'message': f'Consider reviewing position in {asset["symbol"]} due to negative sentiment: {asset["reason"]}',
+                'message': _negative_message(asset['symbol'], asset['reason']),
                 'confidence': asset["confidence"]
             })
         
@@ -73,22 +142,129 @@ class RecommendationAgent:
         for opp in positive_opportunities:
             recommendations.append({
                 'type': 'opportunity',
-                'message': f'Positive sentiment detected for {opp["symbol"]}: {opp["reason"]} - may warrant consideration',
+                'message': _opportunity_message(opp['symbol'], opp['reason']),
                 'confidence': opp["confidence"]
             })
         
         # Store recommendations
+        now = datetime.now()
         with self.market_conn:
-            for rec in recommendations:
+            self.market_conn.executemany(
+                'INSERT INTO recommendations (user_id, recommendation, confidence, timestamp) VALUES (?, ?, ?, ?)',
+                [(user_id, rec['message'], rec['confidence'], now) for rec in recommendations]
+            )
+        
+        return recommendations
+
+    def _recommendation_rows(self, holdings, var_by_user, negative, opportunities):
+        """Recommendation rows (user_id, message, confidence) for a chunk of (user_id, symbol) holdings.
+
+        Users come out in chunk order with risk, then sentiment, then opportunity rows, matching
+        generate_recommendations().
+        """
+        users = holdings['user_id'].drop_duplicates().reset_index(drop=True)
+        order = pd.Series(range(len(users)), index=users)
+
+        var = users.map(var_by_user)
+        risky = var > RISK_VAR_THRESHOLD
+        risk = pd.DataFrame({
+            'user_id': users[risky],
+            'message': [_risk_message(value) for value in var[risky]],
+            'confidence': 0.8,
+            'kind': 0,
+        })
+        sentiment = holdings.merge(negative, on='symbol')[['user_id', 'message', 'confidence']].assign(kind=1)
+        opportunity = pd.DataFrame({
+            'user_id': users.repeat(len(opportunities)).to_numpy(),
+            'message': list(opportunities['message']) * len(users),
+            'confidence': list(opportunities['confidence']) * len(users),
+            'kind': 2,
+        })
+
+        rows = pd.concat([risk, sentiment, opportunity], ignore_index=True)
+        rows['user_order'] = rows['user_id'].map(order)
+        rows = rows.sort_values(['user_order', 'kind'], kind='stable')
+        return list(rows[['user_id', 'message', 'confidence']].itertuples(index=False, name=None))
+
+    def generate_all_recommendations(self, chunk_size=None, progress=None):
+        """Recommendations for every user with holdings, in one pass.
+
+        Sentiment and risk inputs are loaded once; holdings are streamed `chunk_size` rows at a
+        time and each chunk's recommendations replace its users' earlier ones in one
+        transaction, so reruns do not grow the table. `progress`, if given, is called with the
+        running stats after every chunk.
+        """
+        chunk_size = chunk_size or self.batch_config['chunk_size']
+        started = time.perf_counter()
+
+        first_article = self._first_recent_article()
+        negative = pd.DataFrame(columns=['symbol', 'message', 'confidence'])
+        opportunities = pd.DataFrame(columns=['message', 'confidence'])
+        if first_article is not None:
+            negative = pd.DataFrame(
+                [(symbol, _negative_message(symbol, summary), 0.7)
+                 for symbol, label, summary in self._get_symbol_sentiment(first_article)
+                 if label == 'negative'],
+                columns=['symbol', 'message', 'confidence']
+            )
+            opportunities = pd.DataFrame(
+                [(_opportunity_message(symbol, summary), 0.65)
+                 for symbol, summary, _ in self._get_positive_mentions(first_article, 2)],
+                columns=['message', 'confidence']
+            )
+        var_by_user = dict(self.portfolio_conn.execute('SELECT user_id, var_percentage FROM risk_metrics'))
+
+        stats = {'users': 0, 'holdings': 0, 'recommendations': 0, 'chunks': 0}
+        # Primary-key order keeps each user's holdings together; a user cut off at the end of
+        # a chunk is carried into the next one
+        cursor = self.portfolio_conn.execute('SELECT user_id, symbol FROM holdings ORDER BY user_id, symbol')
+        carry = []
+        while True:
+            fetched = cursor.fetchmany(chunk_size)
+            batch = carry + fetched
+            if not batch:
+                break
+            carry = []
+            if fetched:
+                split = len(batch)
+                while split and batch[split - 1][0] == batch[-1][0]:
+                    split -= 1
+                batch, carry = batch[:split], batch[split:]
+                if not batch:
+                    continue
+
+            holdings = pd.DataFrame(batch, columns=['user_id', 'symbol'])
+            rows = self._recommendation_rows(holdings, var_by_user, negative, opportunities)
+            now = datetime.now()
+            with self.market_conn:
                 self.market_conn.execute(
+                    'DELETE FROM recommendations WHERE user_id IN (SELECT value FROM json_each(?))',
+                    (json.dumps(list(holdings['user_id'].unique())),)
+                )
+                self.market_conn.executemany(
                     'INSERT INTO recommendations (user_id, recommendation, confidence, timestamp) VALUES (?, ?, ?, ?)',
-                    (user_id, rec['message'], rec['confidence'], datetime.now())
+                    [row + (now,) for row in rows]
                 )
-        
-        return recommendations
+
+            elapsed = time.perf_counter() - started
+            stats['users'] += holdings['user_id'].nunique()
+            stats['holdings'] += len(holdings)
+            stats['recommendations'] += len(rows)
+            stats['chunks'] += 1
+            stats['elapsed_seconds'] = elapsed
+            stats['users_per_second'] = rate(stats['users'], elapsed)
+            if progress is not None:
+                progress(dict(stats))
+
+        elapsed = time.perf_counter() - started
+        stats['elapsed_seconds'] = elapsed
+        stats['users_per_second'] = rate(stats['users'], elapsed)
+        self.last_bulk_stats = stats
+        return stats
 
     def get_user_recommendations(self, user_id, limit=5):
-        return self.market_conn.execute(
-            'SELECT * FROM recommendations WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?', 
+        return storage.records(self.market_conn.execute(
+            # A run writes its rows with one timestamp; they come back in the order written
+            'SELECT * FROM recommendations WHERE user_id = ? ORDER BY timestamp DESC, id LIMIT ?',
             (user_id, limit)
-        ).fetchall()
+        ))
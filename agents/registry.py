@@ -0,0 +1,80 @@
+import importlib
+import threading
+
+# name -> 'module:attribute', resolved relative to this package on first use so that importing
+# the registry never pulls in pandas, numpy or the HTTP and NLP stacks
+DEFAULT_AGENTS = {
+    'data': '.data_ingestion_agent:DataIngestionAgent',
+    'portfolio': '.portfolio_tracker:PortfolioTracker',
+    'risk': '.risk_analyzer:RiskAnalyzer',
+    'market_insight': '.market_insight_agent:MarketInsightAgent',
+    'recommendation': '.recommendation_agent:RecommendationAgent',
+    'conversational': '.conversational_agent:ConversationalAgent',
+}
+
+
+def resolve(spec):
+    module_name, _, attribute = spec.partition(':')
+    module = importlib.import_module(module_name, __package__ if module_name.startswith('.') else None)
+    return getattr(module, attribute)
+
+
+class AgentRegistry:
+    """Creates each agent (or client) the first time it is asked for, then reuses it.
+
+    A factory is any zero-argument callable, or a 'module:attribute' string naming one.
+    Supports `registry['risk']` so it can stand in for a plain dict of agents.
+    """
+
+    def __init__(self, factories=None):
+        self._factories = dict(factories or {})
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def provide(self, name, instance):
+        """Use an already-built instance, e.g. a fake injected by a test"""
+        with self._lock:
+            self._factories[name] = lambda: instance
+            self._instances[name] = instance
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        with self._lock:
+            # Double-checked: concurrent first requests must not build two copies
+            if name not in self._instances:
+                factory = self._factories[name]
+                if isinstance(factory, str):
+                    factory = resolve(factory)
+                self._instances[name] = factory()
+            return self._instances[name]
+
+    __getitem__ = get
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def loaded(self):
+        """Names that have been instantiated so far"""
+        return list(self._instances)
+
+    def reset(self, name=None):
+        """Forget one instance, or all of them, so the next get() builds afresh"""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+registry = AgentRegistry(DEFAULT_AGENTS)
+
+
+def get(name):
+    return registry.get(name)
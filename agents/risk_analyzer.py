@@ -1,74 +1,282 @@
-import sqlite3
+import hashlib
+import os
+import time
 import pandas as pd
-from datetime import datetime
-from sklearn.linear_model import LinearRegression
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from statistics import NormalDist
 import numpy as np
 
+from . import events, price_store, rollups, storage
+from .cache import TTLCache
+from .stress_testing import ScenarioSet, load_sector_map, replay_shocks, scenario_losses
+
+VAR_METHODS = ('parametric', 'historical', 'monte_carlo')
+
 class RiskAnalyzer:
-    def __init__(self):
-        self.market_conn = sqlite3.connect('market_data.db', check_same_thread=False)
-        self.portfolio_conn = sqlite3.connect('portfolio.db', check_same_thread=False)
+    def __init__(self, sector_map=None):
+        self.sector_map = load_sector_map() if sector_map is None else sector_map
+        self.metrics_cache = TTLCache(
+            maxsize=int(os.getenv('RISK_CACHE_SIZE', '10000')),
+            ttl=float(os.getenv('RISK_CACHE_TTL', '30'))
+        )
+        # A sync in this process drops the user's cached metrics at once; other processes'
+        # syncs are picked up when the entry expires, via the positions version. close()
+        # unregisters, so discarded analyzers are not kept alive by the bus
+        events.bus.add_listener('positions', self._on_positions)
+
+    def close(self):
+        events.bus.remove_listener('positions', self._on_positions)
+
+    @property
+    def market_conn(self):
+        return storage.connection('market_data')
+
+    @property
+    def portfolio_conn(self):
+        return storage.connection('portfolio')
 
     def _get_historical_prices(self, symbol, days=30):
-        query = '''SELECT timestamp, price 
-                   FROM market_data 
-                   WHERE symbol = ? 
-                   ORDER BY timestamp DESC 
-                   LIMIT ?'''
-        df = pd.read_sql(query, self.market_conn, params=(symbol, days))
+        start = datetime.now() - timedelta(days=days)
+        _, rows = rollups.load_prices(self.market_conn, symbol, start, step_seconds=86400)
+        df = pd.DataFrame(rows, columns=['timestamp', 'price'])
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df = df.sort_values('timestamp')
         return df
 
-    def calculate_value_at_risk(self, user_id, confidence_level=0.95, days=30):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
-        total_value = 0
-        var_total = 0
-        
-        for _, row in portfolio.iterrows():
-            symbol = row['symbol']
-            quantity = row['quantity']
-            price_data = self._get_historical_prices(symbol, days)
-            
-            if len(price_data) < 2:
-                continue
-                
-            returns = price_data['price'].pct_change().dropna()
-            if len(returns) == 0:
-                continue
-                
-            var = np.percentile(returns, 100 * (1 - confidence_level))
-            position_value = quantity * price_data['price'].iloc[-1]
-            var_total += position_value * var
-            total_value += position_value
-            
+    def _load_portfolio(self, user_id):
+        return pd.read_sql(
+            'SELECT symbol, quantity, purchase_price FROM holdings WHERE user_id = ?',
+            self.portfolio_conn,
+            params=(user_id,)
+        )
+
+    def _load_price_histories(self, symbols, days=30):
+        # Daily closes covering the last `days` days (today's close is the latest tick), served
+        # as views into the resident price store's ring buffers
+        price_store.ensure_warm(lambda: self.market_conn)
+        start = rollups.bucket_start(datetime.now() - timedelta(days=days), '1d')
+        start_ns = price_store.to_epoch_ns(start)
+        histories = {}
+        for symbol in symbols:
+            window = price_store.daily.since(symbol, start_ns)
+            if window is not None and len(window[1]):
+                histories[symbol] = window
+        return histories
+
+    def _price_matrix(self, symbols, histories):
+        # (day x symbol) matrix over every daily bucket any symbol has a close for; a symbol
+        # without a close that day is NaN, so rows always compare the same day across symbols
+        days = np.unique(np.concatenate([times for times, _ in histories.values()])) if histories else np.empty(0)
+        matrix = np.full((len(days), len(symbols)), np.nan)
+        for column, symbol in enumerate(symbols):
+            if symbol in histories:
+                times, prices = histories[symbol]
+                matrix[np.searchsorted(days, times), column] = prices
+        return matrix
+
+    def _portfolio_var(self, portfolio, confidence_level=0.95, days=30):
+        if portfolio.empty:
+            return 0, 0
+        symbols = list(dict.fromkeys(portfolio['symbol']))
+        histories = self._load_price_histories(symbols, days)
+        # Each symbol's VaR only needs its own consecutive closes, so no cross-symbol alignment
+        symbol_var = np.full(len(symbols), np.nan)
+        latest = np.full(len(symbols), np.nan)
+        for column, symbol in enumerate(symbols):
+            if symbol in histories and len(histories[symbol][1]) >= 2:
+                prices = histories[symbol][1]
+                symbol_var[column] = np.percentile(prices[1:] / prices[:-1] - 1, 100 * (1 - confidence_level))
+                latest[column] = prices[-1]
+        usable = ~np.isnan(symbol_var)
+
+        columns = pd.Index(symbols).get_indexer(portfolio['symbol'])
+        held = usable[columns]
+        columns = columns[held]
+        position_values = portfolio['quantity'].to_numpy(dtype=float)[held] * latest[columns]
+        if len(position_values) == 0:
+            return 0, 0
+        # cumsum accumulates strictly left to right, matching the per-position loop bit for bit
+        var_total = np.cumsum(position_values * symbol_var[columns])[-1]
+        total_value = np.cumsum(position_values)[-1]
         return abs(var_total), total_value
 
+    def calculate_value_at_risk(self, user_id, confidence_level=0.95, days=30):
+        return self._portfolio_var(self._load_portfolio(user_id), confidence_level, days)
+
+    def _position_exposures(self, portfolio, days=30):
+        # Holdings netted per symbol, plus joint return samples: returns between consecutive days
+        # on which every usable symbol has a close, so each row moves all symbols over the same span
+        symbols = list(dict.fromkeys(portfolio['symbol']))
+        histories = self._load_price_histories(symbols, days)
+        matrix = self._price_matrix(symbols, histories)
+        usable = np.count_nonzero(~np.isnan(matrix), axis=0) >= 3
+        shared = matrix[:, usable][~np.isnan(matrix[:, usable]).any(axis=1)]
+        if len(shared) < 3:
+            return [], np.empty(0), np.empty((0, 0))
+        returns = shared[1:] / shared[:-1] - 1
+        quantities = portfolio.groupby('symbol', sort=False)['quantity'].sum().reindex(symbols).to_numpy(dtype=float)
+        latest = np.array([histories[symbol][1][-1] if symbol in histories else np.nan for symbol in symbols])
+        values = (quantities * latest)[usable]
+        return [symbol for symbol, keep in zip(symbols, usable) if keep], values, returns
+
+    def _covariance_factor(self, cov):
+        try:
+            return np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError:
+            # Short or collinear histories give a singular covariance; use its PSD square root instead
+            eigenvalues, eigenvectors = np.linalg.eigh(cov)
+            return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+
+    def _tail_statistics(self, pnl, confidence_level):
+        var = -np.percentile(pnl, 100 * (1 - confidence_level))
+        tail = pnl <= -var
+        return var, -pnl[tail].mean(), tail
+
+    def _allocate_to_var(self, tail_contributions, var, cvar):
+        # Expected-shortfall contributions rescaled so the components add up to VaR
+        if cvar == 0:
+            return np.zeros_like(tail_contributions)
+        return -tail_contributions * var / cvar
+
+    def _parametric_var(self, values, returns, confidence_level, horizon_days):
+        mean = returns.mean(axis=0) * horizon_days
+        cov = np.atleast_2d(np.cov(returns, rowvar=False)) * horizon_days
+        drift = mean @ values
+        # A fully hedged book can round to a tiny negative variance
+        sigma = np.sqrt(max(values @ cov @ values, 0.0))
+        z = NormalDist().inv_cdf(1 - confidence_level)
+        var = -(drift + z * sigma)
+        cvar = -drift + sigma * NormalDist().pdf(z) / (1 - confidence_level)
+        if sigma == 0:
+            return var, cvar, -values * mean
+        return var, cvar, -values * mean - z * values * (cov @ values) / sigma
+
+    def _historical_var(self, values, returns, confidence_level, horizon_days):
+        # Full revaluation over every historical return row, scaled to the horizon by sqrt(time)
+        position_pnl = returns * values * np.sqrt(horizon_days)
+        var, cvar, tail = self._tail_statistics(position_pnl.sum(axis=1), confidence_level)
+        return var, cvar, self._allocate_to_var(position_pnl[tail].mean(axis=0), var, cvar)
+
+    def _monte_carlo_var(self, values, returns, confidence_level, horizon_days, paths, seed, chunk_size, workers):
+        mean = returns.mean(axis=0) * horizon_days
+        factor = self._covariance_factor(np.atleast_2d(np.cov(returns, rowvar=False)) * horizon_days)
+        # Portfolio P&L of a path is z @ (factor.T @ values) + mean @ values, so pass one never
+        # materializes per-position P&L
+        exposure = factor.T @ values
+        drift = mean @ values
+        count = len(values)
+        chunk_size = chunk_size or max(1, min(paths, 4000000 // count))
+        bounds = [(start, min(start + chunk_size, paths)) for start in range(0, paths, chunk_size)]
+        # One child seed per chunk keeps results reproducible regardless of worker count
+        seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+
+        def shocks(chunk):
+            start, stop = bounds[chunk]
+            return np.random.default_rng(seeds[chunk]).standard_normal((stop - start, count))
+
+        pnl = np.empty(paths)
+
+        def simulate(chunk):
+            start, stop = bounds[chunk]
+            pnl[start:stop] = shocks(chunk) @ exposure + drift
+
+        def tail_contributions(chunk):
+            # Regenerates the chunk from its seed rather than keeping every path in memory
+            start, stop = bounds[chunk]
+            in_tail = tail[start:stop]
+            if not in_tail.any():
+                return np.zeros(count)
+            return ((shocks(chunk)[in_tail] @ factor.T + mean) * values).sum(axis=0)
+
+        # NumPy releases the GIL for bulk RNG fills and matmul, so threads run on multiple cores
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(simulate, range(len(bounds))))
+            var, cvar, tail = self._tail_statistics(pnl, confidence_level)
+            contributions = sum(pool.map(tail_contributions, range(len(bounds)))) / tail.sum()
+        return var, cvar, self._allocate_to_var(contributions, var, cvar)
+
+    def simulate_value_at_risk(self, user_id, method='parametric', confidence_level=0.95, days=30,
+                               horizon_days=1, paths=100000, seed=None, chunk_size=None, workers=None):
+        """Correlation-aware portfolio VaR, expected shortfall and per-position component VaR"""
+        if method not in VAR_METHODS:
+            raise ValueError(f'Unknown VaR method {method!r}; expected one of {VAR_METHODS}')
+        symbols, values, returns = self._position_exposures(self._load_portfolio(user_id), days)
+        result = {
+            'method': method,
+            'confidence_level': confidence_level,
+            'horizon_days': horizon_days,
+            'total_value': float(values.sum()),
+            'var': 0.0,
+            'cvar': 0.0,
+            'component_var': {},
+        }
+        if not symbols or len(returns) < 2:
+            return result
+
+        if method == 'parametric':
+            var, cvar, components = self._parametric_var(values, returns, confidence_level, horizon_days)
+        elif method == 'historical':
+            var, cvar, components = self._historical_var(values, returns, confidence_level, horizon_days)
+        else:
+            var, cvar, components = self._monte_carlo_var(
+                values, returns, confidence_level, horizon_days, paths, seed, chunk_size, workers
+            )
+            result['paths'] = paths
+        result.update(
+            var=float(var),
+            cvar=float(cvar),
+            component_var=dict(zip(symbols, components.tolist()))
+        )
+        return result
+
+    def _latest_prices(self, symbols):
+        # Each symbol's newest price, however old it is (e.g. Friday's close on a Sunday)
+        price_store.ensure_warm(lambda: self.market_conn)
+        latest = [price_store.latest_price(symbol) for symbol in symbols]
+        return np.array([np.nan if price is None else price for price in latest], dtype=float)
+
+    def _price_snapshot(self, portfolio, days=None):
+        # Net position value per symbol at its latest price, plus (with `days`) the daily price
+        # matrix over that period
+        symbols = list(dict.fromkeys(portfolio['symbol']))
+        quantities = portfolio.groupby('symbol', sort=False)['quantity'].sum().reindex(symbols).to_numpy(dtype=float)
+        values = np.nan_to_num(quantities * self._latest_prices(symbols))
+        if not days:
+            return symbols, values, np.empty((0, len(symbols)))
+        return symbols, values, self._price_matrix(symbols, self._load_price_histories(symbols, days))
+
+    def run_stress_tests(self, user_id, scenarios, replay_window=None, days=30):
+        """Loss per scenario, all scenarios applied to one price snapshot as a single matrix product.
+
+        With `replay_window`, every historical move over that many steps of the last `days`
+        of prices is replayed as an extra scenario.
+        """
+        portfolio = self._load_portfolio(user_id)
+        symbols, values, matrix = self._price_snapshot(portfolio, days if replay_window else None)
+        shocks = scenarios.matrix(symbols, self.sector_map)
+        names = scenarios.names
+        if replay_window:
+            replay = replay_shocks(matrix, replay_window)
+            shocks = np.vstack([shocks, replay])
+            names = names + [f'replay-{replay_window}:{start}' for start in range(len(replay))]
+        return dict(zip(names, scenario_losses(shocks, values).tolist()))
+
     def perform_stress_test(self, user_id, crash_scenarios=[-0.2, -0.5, -0.7]):
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
-        results = {}
-        
-        for scenario in crash_scenarios:
-            scenario_loss = 0
-            for _, row in portfolio.iterrows():
-                symbol = row['symbol']
-                quantity = row['quantity']
-                price_data = self._get_historical_prices(symbol)
-                
-                if not price_data.empty:
-                    current_price = price_data['price'].iloc[-1]
-                    crash_price = current_price * (1 + scenario)
-                    loss = quantity * (current_price - crash_price)
-                    scenario_loss += loss
-                    
-            results[scenario] = scenario_loss
-            
-        return results
+        return self.run_stress_tests(user_id, ScenarioSet.uniform(crash_scenarios))
 
-    def get_risk_metrics(self, user_id):
-        var, total_value = self.calculate_value_at_risk(user_id)
-        portfolio = pd.read_sql(f"SELECT * FROM portfolio WHERE user_id = '{user_id}'", self.portfolio_conn)
-        
+    def _risk_inputs_version(self, user_id, portfolio):
+        # Cheap fingerprints of everything the metrics depend on: every position change is logged
+        # in holdings_history, so its latest id (an index lookup) versions the positions
+        positions = self.portfolio_conn.execute(
+            'SELECT COUNT(*), MAX(id) FROM holdings_history WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        price_store.ensure_warm(lambda: self.market_conn)
+        latest = [(symbol, price_store.store.last_time(symbol)) for symbol in sorted(set(portfolio['symbol']))]
+        prices = hashlib.sha1(repr(latest).encode()).hexdigest()
+        return f'{positions[0]}:{positions[1]}', prices
+
+    def _compute_risk_metrics(self, portfolio):
+        var, total_value = self._portfolio_var(portfolio)
         return {
             'timestamp': datetime.now(),
             'total_portfolio_value': total_value,
@@ -76,3 +284,72 @@ class RiskAnalyzer:
             'var_percentage': (var/total_value)*100 if total_value > 0 else 0,
             'position_count': len(portfolio)
         }
+
+    def refresh_risk_metrics(self, user_id, force=False):
+        """Recompute and persist a user's metrics only if their positions or held prices changed"""
+        portfolio = self._load_portfolio(user_id)
+        positions_version, prices_version = self._risk_inputs_version(user_id, portfolio)
+        stored = self.portfolio_conn.execute(
+            '''SELECT total_portfolio_value, value_at_risk_95, var_percentage, position_count,
+                      positions_version, prices_version, timestamp
+               FROM risk_metrics WHERE user_id = ?''',
+            (user_id,)
+        ).fetchone()
+        if stored and not force and stored[4:6] == (positions_version, prices_version):
+            metrics = {
+                'timestamp': datetime.fromisoformat(stored[6]),
+                'total_portfolio_value': stored[0],
+                'value_at_risk_95': stored[1],
+                'var_percentage': stored[2],
+                'position_count': stored[3]
+            }
+        else:
+            metrics = self._compute_risk_metrics(portfolio)
+            with self.portfolio_conn:
+                self.portfolio_conn.execute(
+                    '''INSERT OR REPLACE INTO risk_metrics
+                       (user_id, total_portfolio_value, value_at_risk_95, var_percentage, position_count,
+                        positions_version, prices_version, timestamp)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (user_id, float(metrics['total_portfolio_value']), float(metrics['value_at_risk_95']),
+                     float(metrics['var_percentage']), metrics['position_count'],
+                     positions_version, prices_version, metrics['timestamp'])
+                )
+            events.bus.publish('risk', metrics, user_id=user_id)
+        self.metrics_cache.set(user_id, metrics)
+        return metrics
+
+    def refresh_all_risk_metrics(self, deadline=None):
+        """refresh_risk_metrics() for every user with positions, stalest first.
+
+        With a `deadline` (time.monotonic() value) it stops there; users never refreshed, or
+        refreshed longest ago, come first so runs cut short do not starve the same users.
+        """
+        users = [row[0] for row in self.portfolio_conn.execute(
+            '''SELECT DISTINCT holdings.user_id
+               FROM holdings LEFT JOIN risk_metrics ON risk_metrics.user_id = holdings.user_id
+               ORDER BY risk_metrics.timestamp IS NOT NULL, risk_metrics.timestamp'''
+        )]
+        refreshed = 0
+        for user_id in users:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self.refresh_risk_metrics(user_id)
+            refreshed += 1
+        return {'users': len(users), 'refreshed': refreshed}
+
+    def invalidate_risk_metrics(self, user_id=None):
+        """Drop cached metrics for one user (or everyone) so the next read re-checks its inputs"""
+        if user_id is None:
+            self.metrics_cache.invalidate()
+        else:
+            self.metrics_cache.invalidate(user_id)
+
+    def _on_positions(self, change):
+        self.invalidate_risk_metrics(change['user_id'])
+
+    def get_risk_metrics(self, user_id):
+        metrics = self.metrics_cache.get(user_id)
+        if metrics is None:
+            metrics = self.refresh_risk_metrics(user_id)
+        return metrics
@@ -0,0 +1,153 @@
+import os
+from datetime import datetime, timedelta
+
+# Bar resolutions, finest first, with their width in seconds. `volume` on a bar is its
+# tick count, since quotes carry no traded size.
+RESOLUTIONS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+
+# Days of history kept per resolution (None keeps it forever); 'tick' is raw market_data
+RETENTION_DAYS = {
+    'tick': int(os.getenv('RAW_TICK_RETENTION_DAYS', '7')),
+    '1m': int(os.getenv('MINUTE_BAR_RETENTION_DAYS', '30')),
+    '1h': int(os.getenv('HOURLY_BAR_RETENTION_DAYS', '730')),
+    '1d': None,
+}
+
+# SQL equivalents of bucket_start() over timestamps stored as 'YYYY-MM-DD HH:MM:SS[.ffffff]'
+_BUCKET_SQL = {
+    '1m': "substr(timestamp, 1, 16) || ':00'",
+    '1h': "substr(timestamp, 1, 13) || ':00:00'",
+    '1d': "substr(timestamp, 1, 10) || ' 00:00:00'",
+}
+
+
+def bucket_start(timestamp, resolution):
+    if resolution == '1m':
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == '1h':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def backfill_bars(conn):
+    """Build every bar from the raw ticks currently in market_data"""
+    for resolution, _ in RESOLUTIONS:
+        conn.execute(f'''INSERT OR REPLACE INTO market_bars
+                         (symbol, resolution, bucket, open, high, low, close, volume, open_time, close_time)
+                         WITH spans AS
+                           (SELECT symbol, {_BUCKET_SQL[resolution]} AS bucket,
+                                   MIN(timestamp) AS open_time, MAX(timestamp) AS close_time,
+                                   MAX(price) AS high, MIN(price) AS low, COUNT(*) AS volume
+                            FROM market_data
+                            GROUP BY symbol, bucket)
+                         SELECT spans.symbol, ?, spans.bucket, first.price, spans.high, spans.low, last.price,
+                                spans.volume, spans.open_time, spans.close_time
+                         FROM spans
+                         JOIN market_data AS first ON first.symbol = spans.symbol AND first.timestamp = spans.open_time
+                         JOIN market_data AS last ON last.symbol = spans.symbol AND last.timestamp = spans.close_time''',
+                     (resolution,))
+
+
+def aggregate(rows, resolution):
+    """Fold (symbol, price, timestamp) ticks into {(symbol, bucket): bar} for one resolution"""
+    bars = {}
+    for symbol, price, timestamp in rows:
+        key = (symbol, bucket_start(timestamp, resolution))
+        bar = bars.get(key)
+        if bar is None:
+            bars[key] = {'open': price, 'high': price, 'low': price, 'close': price, 'volume': 1,
+                         'open_time': timestamp, 'close_time': timestamp}
+            continue
+        bar['high'] = max(bar['high'], price)
+        bar['low'] = min(bar['low'], price)
+        bar['volume'] += 1
+        if timestamp < bar['open_time']:
+            bar['open'], bar['open_time'] = price, timestamp
+        if timestamp >= bar['close_time']:
+            bar['close'], bar['close_time'] = price, timestamp
+    return bars
+
+
+def update_bars(conn, rows):
+    """Merge newly stored ticks into every resolution; call in the transaction that stored them.
+
+    Returns the daily bars the batch touched, with the close as stored, so callers can
+    refresh in-memory copies.
+    """
+    daily = {}
+    for resolution, _ in RESOLUTIONS:
+        bars = aggregate(rows, resolution)
+        conn.executemany(
+            '''INSERT INTO market_bars
+               (symbol, resolution, bucket, open, high, low, close, volume, open_time, close_time)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (symbol, resolution, bucket) DO UPDATE SET
+                 open = CASE WHEN excluded.open_time < open_time THEN excluded.open ELSE open END,
+                 high = MAX(high, excluded.high),
+                 low = MIN(low, excluded.low),
+                 close = CASE WHEN excluded.close_time >= close_time THEN excluded.close ELSE close END,
+                 volume = volume + excluded.volume,
+                 open_time = MIN(open_time, excluded.open_time),
+                 close_time = MAX(close_time, excluded.close_time)''',
+            [(symbol, resolution, bucket, bar['open'], bar['high'], bar['low'], bar['close'], bar['volume'],
+              bar['open_time'], bar['close_time'])
+             for (symbol, bucket), bar in bars.items()]
+        )
+        if resolution == '1d':
+            # A late tick loses to a later close already stored, so read back what was kept
+            for (symbol, bucket), bar in bars.items():
+                bar['close'] = conn.execute(
+                    'SELECT close FROM market_bars WHERE symbol = ? AND resolution = ? AND bucket = ?',
+                    (symbol, resolution, bucket)
+                ).fetchone()[0]
+            daily = bars
+    return daily
+
+
+def compact(conn, now=None):
+    """Drop raw ticks and bars that have aged past their retention; returns rows deleted per level"""
+    now = now or datetime.now()
+    deleted = {}
+    with conn:
+        for level, days in RETENTION_DAYS.items():
+            if days is None:
+                continue
+            cutoff = now - timedelta(days=days)
+            if level == 'tick':
+                cursor = conn.execute('DELETE FROM market_data WHERE timestamp < ?', (cutoff,))
+            else:
+                cursor = conn.execute(
+                    'DELETE FROM market_bars WHERE resolution = ? AND bucket < ?',
+                    (level, bucket_start(cutoff, level))
+                )
+            deleted[level] = cursor.rowcount
+    return deleted
+
+
+def choose_resolution(start, step_seconds, now=None):
+    """Coarsest level whose bars are no wider than `step_seconds` and still cover `start`"""
+    now = now or datetime.now()
+    chosen = 'tick'
+    for resolution, width in RESOLUTIONS:
+        days = RETENTION_DAYS[resolution]
+        if width <= step_seconds and (days is None or start >= now - timedelta(days=days)):
+            chosen = resolution
+    return chosen
+
+
+def load_prices(conn, symbol, start, step_seconds):
+    """(timestamp, price) rows since `start` at the coarsest resolution that answers the query"""
+    resolution = choose_resolution(start, step_seconds)
+    if resolution == 'tick':
+        rows = conn.execute(
+            'SELECT timestamp, price FROM market_data WHERE symbol = ? AND timestamp >= ? ORDER BY timestamp',
+            (symbol, start)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            '''SELECT bucket, close FROM market_bars
+               WHERE symbol = ? AND resolution = ? AND bucket >= ?
+               ORDER BY bucket''',
+            (symbol, resolution, bucket_start(start, resolution))
+        ).fetchall()
+    return resolution, rows
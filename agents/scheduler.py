@@ -0,0 +1,266 @@
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import storage
+from .metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A named unit of background work and its run statistics.
+
+    `func` takes the run's deadline (a time.monotonic() value, or None without a budget) and
+    should stop starting new work once it has passed; threads cannot be preempted, so the
+    budget is cooperative and overruns are counted. `interval` re-runs the job on a fixed
+    cadence; a job with upstream jobs (`after`) runs whenever one of them succeeds, but no
+    sooner than `min_interval` after its own previous start.
+    """
+
+    def __init__(self, name, func, interval=None, budget=None, after=(), min_interval=None, history=100):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.budget = budget
+        self.after = tuple(after)
+        self.min_interval = min_interval
+        self.running = False
+        self.pending = False
+        self.future = None
+        self.next_run = time.monotonic() if interval else None
+        self.last_started = None
+        self.runs = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.over_budget = 0
+        self.last_error = None
+        self.last_result = None
+        self.last_finished_at = None
+        self.durations = deque(maxlen=history)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'coalesced': self.coalesced,
+            'over_budget': self.over_budget,
+            'last_duration_seconds': self.durations[-1] if self.durations else None,
+            'p50_seconds': percentile(list(self.durations), 50),
+            'p99_seconds': percentile(list(self.durations), 99),
+            'last_finished_at': self.last_finished_at,
+            'last_error': self.last_error,
+            'last_result': self.last_result,
+        }
+
+
+class Scheduler:
+    """In-process scheduler: fixed cadences, dependency chains and coalesced runs.
+
+    A job triggered while it is already running is not run concurrently; it runs once more
+    after the current run ends, however many triggers arrived meanwhile. stop() shuts the
+    worker pool down; a later start() or trigger() brings up a fresh one.
+    """
+
+    def __init__(self, max_workers=4):
+        self.jobs = {}
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self._stopping = False
+
+    def add(self, name, func, interval=None, budget=None, after=(), min_interval=None):
+        for upstream in after:
+            if upstream not in self.jobs:
+                raise ValueError(f'Job {name!r} depends on unknown job {upstream!r}')
+        with self._lock:
+            self.jobs[name] = Job(name, func, interval, budget, after, min_interval)
+            self._wake.notify()
+        return self.jobs[name]
+
+    def trigger(self, name):
+        """Run a job now, or once more after its current run"""
+        with self._lock:
+            self._trigger(self.jobs[name])
+
+    def _trigger(self, job):
+        if job.running:
+            if job.pending:
+                job.coalesced += 1
+            job.pending = True
+            return
+        if job.min_interval and job.last_started is not None:
+            wait = job.last_started + job.min_interval - time.monotonic()
+            if wait > 0:
+                # Too soon after the previous run: defer to the earliest allowed time
+                job.next_run = min(job.next_run or float('inf'), time.monotonic() + wait)
+                self._wake.notify()
+                return
+        job.running = True
+        job.last_started = time.monotonic()
+        if job.interval:
+            job.next_run = job.last_started + job.interval
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scheduler')
+        job.future = self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        started = time.monotonic()
+        deadline = started + job.budget if job.budget else None
+        error, result = None, None
+        try:
+            result = job.func(deadline)
+        except Exception:
+            error = traceback.format_exc(limit=5)
+        finally:
+            # Job threads are pooled; hand their SQLite connections back
+            storage.release()
+        duration = time.monotonic() - started
+
+        with self._lock:
+            job.running = False
+            job.runs += 1
+            job.durations.append(duration)
+            job.last_finished_at = datetime.now()
+            job.last_result = result if isinstance(result, dict) else None
+            job.last_error = error
+            if error is not None:
+                job.failures += 1
+            if job.budget and duration > job.budget:
+                job.over_budget += 1
+            if self._stopping:
+                return
+            if error is None:
+                for downstream in self.jobs.values():
+                    if job.name in downstream.after:
+                        self._trigger(downstream)
+            if job.pending:
+                job.pending = False
+                self._trigger(job)
+
+    def _loop(self):
+        with self._lock:
+            while not self._stopping:
+                now = time.monotonic()
+                for job in self.jobs.values():
+                    if job.next_run is not None and job.next_run <= now:
+                        job.next_run = now + job.interval if job.interval else None
+                        self._trigger(job)
+                upcoming = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+                timeout = max(0.0, min(upcoming) - now) if upcoming else None
+                self._wake.wait(timeout)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._stopping = False
+            self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, wait=True):
+        with self._lock:
+            self._stopping = True
+            self._wake.notify()
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+        with self._lock:
+            # Runs cancelled before they started never reach _run(); free their jobs for a restart
+            for job in self.jobs.values():
+                if job.future is not None and job.future.cancelled():
+                    job.running = job.pending = False
+
+    def metrics(self):
+        with self._lock:
+            return {name: job.stats() for name, job in self.jobs.items()}
+
+
+def default_scheduler(agents, config=None):
+    """The ingest -> sentiment -> risk -> recommendations chain over an agent registry.
+
+    Only ingestion, brokerage sync (which also feeds risk), compaction and conversation
+    retention run on a clock; each later stage runs when the one before it succeeds, so API
+    requests read results that are already computed.
+    """
+    settings = {
+        'workers': int(os.getenv('SCHEDULER_WORKERS', '4')),
+        'ingest_interval': float(os.getenv('INGEST_INTERVAL', '60')),
+        'ingest_budget': float(os.getenv('INGEST_BUDGET', '45')),
+        'sentiment_budget': float(os.getenv('SENTIMENT_BUDGET', '120')),
+        'risk_budget': float(os.getenv('RISK_REFRESH_BUDGET', '120')),
+        'recommendation_interval': float(os.getenv('RECOMMENDATION_INTERVAL', '3600')),
+        'compact_interval': float(os.getenv('COMPACT_INTERVAL', '86400')),
+        'portfolio_sync_interval': float(os.getenv('BROKERAGE_SYNC_INTERVAL', '900')),
+        'portfolio_sync_budget': float(os.getenv('BROKERAGE_SYNC_BUDGET', '600')),
+        'conversation_purge_interval': float(os.getenv('CONVERSATION_PURGE_INTERVAL', '3600')),
+        'conversation_purge_budget': float(os.getenv('CONVERSATION_PURGE_BUDGET', '60')),
+        # Comma-separated; empty means every symbol currently held
+        'symbols': os.getenv('INGEST_SYMBOLS', ''),
+        'news_topics': os.getenv('NEWS_TOPICS', 'markets,stocks'),
+    }
+    settings.update(config or {})
+    news_failures = [0]
+
+    def ingest(deadline):
+        data = agents.get('data')
+        symbols = [symbol for symbol in settings['symbols'].split(',') if symbol]
+        if not symbols:
+            symbols = [row[0] for row in storage.connection('portfolio').execute(
+                'SELECT DISTINCT symbol FROM holdings'
+            )]
+        market = data.fetch_market_data(symbols, deadline=deadline) if symbols else None
+        # A failing news feed must not fail the run: the ticks are stored, and sentiment
+        # (chained on success) still has earlier articles to score
+        try:
+            news = data.fetch_news(settings['news_topics'].split(','), deadline=deadline)
+            error = None if news is not None else 'news feed unavailable'
+        except Exception as e:
+            news, error = None, f'{type(e).__name__}: {e}'
+        if error is not None:
+            news_failures[0] += 1
+            logger.warning('ingest: news fetch failed (%d so far): %s', news_failures[0], error)
+        return {'market': market, 'news': news, 'news_error': error, 'news_failures': news_failures[0]}
+
+    def portfolio_sync(deadline):
+        return agents.get('portfolio').sync_all_portfolios(deadline=deadline)
+
+    def sentiment(deadline):
+        return agents.get('market_insight').run_sentiment_pipeline(deadline=deadline)
+
+    def risk(deadline):
+        return agents.get('risk').refresh_all_risk_metrics(deadline=deadline)
+
+    def recommendations(deadline):
+        return agents.get('recommendation').generate_all_recommendations()
+
+    def compact(deadline):
+        return agents.get('data').compact_market_data()
+
+    def conversation_purge(deadline):
+        return agents.get('conversational').purge_conversations(deadline=deadline)
+
+    scheduler = Scheduler(max_workers=settings['workers'])
+    scheduler.add('ingest', ingest, interval=settings['ingest_interval'], budget=settings['ingest_budget'])
+    scheduler.add('portfolio_sync', portfolio_sync, interval=settings['portfolio_sync_interval'],
+                  budget=settings['portfolio_sync_budget'])
+    scheduler.add('sentiment', sentiment, budget=settings['sentiment_budget'], after=['ingest'])
+    scheduler.add('risk', risk, budget=settings['risk_budget'], after=['sentiment', 'portfolio_sync'])
+    scheduler.add('recommendations', recommendations, after=['risk'],
+                  min_interval=settings['recommendation_interval'])
+    scheduler.add('compact', compact, interval=settings['compact_interval'])
+    scheduler.add('conversation_purge', conversation_purge, interval=settings['conversation_purge_interval'],
+                  budget=settings['conversation_purge_budget'])
+    return scheduler
@@ -0,0 +1,269 @@
+from datetime import datetime
+
+from .content_hash import content_hash
+from .rollups import backfill_bars
+
+# Applied to every connection; journal_mode=WAL is persistent, the rest are per-connection
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA busy_timeout = 5000',
+)
+
+def _backfill_content_hashes(conn):
+    # Hash stored articles oldest first; later reposts keep a NULL hash rather than being deleted
+    seen = set()
+    updates = []
+    for article_id, title, content in conn.execute('SELECT id, title, content FROM news_articles ORDER BY id'):
+        digest = content_hash(content, title)
+        if digest is not None and digest not in seen:
+            seen.add(digest)
+            updates.append((digest, article_id))
+    conn.executemany('UPDATE news_articles SET content_hash = ? WHERE id = ?', updates)
+
+
+# Ordered (version, steps) per database. A step is an SQL string or a callable taking the
+# connection. Never edit a released migration; append a new version instead.
+MIGRATIONS = {
+    'market_data': [
+        (1, [
+            '''CREATE TABLE IF NOT EXISTS market_data
+               (id INTEGER PRIMARY KEY,
+                symbol TEXT,
+                price REAL,
+                timestamp DATETIME)''',
+            '''CREATE TABLE IF NOT EXISTS news_articles
+               (id INTEGER PRIMARY KEY,
+                title TEXT,
+                content TEXT,
+                source TEXT,
+                timestamp DATETIME)''',
+            '''CREATE TABLE IF NOT EXISTS sentiment_reports
+               (id INTEGER PRIMARY KEY,
+                article_id INTEGER,
+                summary TEXT,
+                sentiment_polarity REAL,
+                sentiment_label TEXT,
+                timestamp DATETIME,
+                FOREIGN KEY(article_id) REFERENCES news_articles(id))''',
+            '''CREATE TABLE IF NOT EXISTS recommendations
+               (id INTEGER PRIMARY KEY,
+                user_id TEXT,
+                recommendation TEXT,
+                confidence REAL,
+                timestamp DATETIME)''',
+        ]),
+        (2, [
+            '''DELETE FROM market_data WHERE id NOT IN
+               (SELECT MIN(id) FROM market_data GROUP BY symbol, timestamp)''',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_market_data_symbol_ts ON market_data (symbol, timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_news_articles_ts ON news_articles (timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_sentiment_reports_ts ON sentiment_reports (timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_recommendations_user_ts ON recommendations (user_id, timestamp)',
+        ]),
+        (3, [
+            '''CREATE TABLE IF NOT EXISTS market_bars
+               (symbol TEXT,
+                resolution TEXT,
+                bucket DATETIME,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                volume INTEGER,
+                open_time DATETIME,
+                close_time DATETIME,
+                PRIMARY KEY (symbol, resolution, bucket)) WITHOUT ROWID''',
+            backfill_bars,
+        ]),
+        (4, [
+            'CREATE INDEX IF NOT EXISTS idx_sentiment_reports_article ON sentiment_reports (article_id)',
+        ]),
+        (5, [
+            # One report per article; keep the newest of any repeats
+            '''DELETE FROM sentiment_reports WHERE id NOT IN
+               (SELECT MAX(id) FROM sentiment_reports GROUP BY article_id)''',
+            'DROP INDEX IF EXISTS idx_sentiment_reports_article',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_sentiment_reports_article_id ON sentiment_reports (article_id)',
+            '''CREATE TABLE IF NOT EXISTS pipeline_state
+               (name TEXT PRIMARY KEY,
+                value INTEGER,
+                updated_at DATETIME)''',
+            # Every article id up to the mark has a report: start just below the oldest unscored one
+            '''INSERT OR IGNORE INTO pipeline_state (name, value, updated_at)
+               SELECT 'sentiment_high_water_mark',
+                      COALESCE((SELECT MIN(id) - 1 FROM news_articles AS article
+                                WHERE NOT EXISTS (SELECT 1 FROM sentiment_reports WHERE article_id = article.id)),
+                               (SELECT MAX(id) FROM news_articles),
+                               0),
+                      datetime('now', 'localtime')''',
+        ]),
+        (6, [
+            'ALTER TABLE news_articles ADD COLUMN content_hash TEXT',
+            _backfill_content_hashes,
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_news_articles_content_hash ON news_articles (content_hash)',
+            '''CREATE TABLE IF NOT EXISTS analysis_cache
+               (content_hash TEXT PRIMARY KEY,
+                summary TEXT,
+                sentiment_polarity REAL,
+                sentiment_label TEXT,
+                created_at DATETIME) WITHOUT ROWID''',
+        ]),
+        (7, [
+            '''CREATE TABLE IF NOT EXISTS article_symbols
+               (article_id INTEGER,
+                symbol TEXT,
+                PRIMARY KEY (article_id, symbol)) WITHOUT ROWID''',
+            'CREATE INDEX IF NOT EXISTS idx_article_symbols_symbol ON article_symbols (symbol, article_id)',
+            # Start at 0 so the next indexing pass covers articles stored before this version
+            '''INSERT OR IGNORE INTO pipeline_state (name, value, updated_at)
+               VALUES ('symbol_index_high_water_mark', 0, datetime('now', 'localtime'))''',
+        ]),
+    ],
+    'portfolio': [
+        (1, [
+            '''CREATE TABLE IF NOT EXISTS portfolio
+               (id INTEGER PRIMARY KEY,
+                user_id TEXT,
+                symbol TEXT,
+                quantity REAL,
+                purchase_price REAL,
+                timestamp DATETIME)''',
+        ]),
+        (2, [
+            'CREATE INDEX IF NOT EXISTS idx_portfolio_user_ts ON portfolio (user_id, timestamp)',
+        ]),
+        (3, [
+            # One materialized row per user, tagged with the inputs it was computed from
+            '''CREATE TABLE IF NOT EXISTS risk_metrics
+               (user_id TEXT PRIMARY KEY,
+                total_portfolio_value REAL,
+                value_at_risk_95 REAL,
+                var_percentage REAL,
+                position_count INTEGER,
+                positions_version TEXT,
+                prices_version TEXT,
+                timestamp DATETIME)''',
+        ]),
+        (4, [
+            # Current positions, one row each, replacing the append-only `portfolio` snapshots
+            # (kept, but no longer written), plus a log holding only the changes
+            '''CREATE TABLE IF NOT EXISTS holdings
+               (user_id TEXT,
+                symbol TEXT,
+                quantity REAL,
+                purchase_price REAL,
+                updated_at DATETIME,
+                PRIMARY KEY (user_id, symbol)) WITHOUT ROWID''',
+            '''CREATE TABLE IF NOT EXISTS holdings_history
+               (id INTEGER PRIMARY KEY,
+                user_id TEXT,
+                symbol TEXT,
+                quantity REAL,
+                purchase_price REAL,
+                timestamp DATETIME)''',
+            'CREATE INDEX IF NOT EXISTS idx_holdings_history_user ON holdings_history (user_id, id)',
+            # A snapshot's rows were stamped one by one, microseconds apart; a later snapshot
+            # starts over a second after a position's last row. A position left out of a later
+            # snapshot was closed then, so it gets a 0-quantity row at that snapshot
+            '''INSERT INTO holdings_history (user_id, symbol, quantity, purchase_price, timestamp)
+               SELECT user_id, symbol, quantity, purchase_price, timestamp FROM
+                 (SELECT id, user_id, symbol, quantity, purchase_price, timestamp FROM
+                    (SELECT id, user_id, symbol, quantity, purchase_price, timestamp,
+                            ROW_NUMBER() OVER position AS seq,
+                            LAG(quantity) OVER position AS previous_quantity,
+                            LAG(purchase_price) OVER position AS previous_price
+                     FROM portfolio
+                     WINDOW position AS (PARTITION BY user_id, symbol ORDER BY timestamp, id))
+                  WHERE seq = 1 OR quantity IS NOT previous_quantity OR purchase_price IS NOT previous_price
+                  UNION ALL
+                  SELECT next.id, last.user_id, last.symbol, 0, last.purchase_price, next.timestamp FROM
+                    (SELECT user_id, symbol, quantity, purchase_price, timestamp,
+                            ROW_NUMBER() OVER (PARTITION BY user_id, symbol ORDER BY timestamp DESC, id DESC) AS age
+                     FROM portfolio) AS last
+                  JOIN portfolio AS next ON next.id =
+                    (SELECT id FROM portfolio
+                     WHERE user_id = last.user_id
+                       AND timestamp > strftime('%Y-%m-%d %H:%M:%f', last.timestamp, '+1 second')
+                     ORDER BY timestamp, id
+                     LIMIT 1)
+                  WHERE last.age = 1 AND last.quantity != 0)
+               ORDER BY timestamp, id''',
+            # Current state: each user's latest snapshot, without the positions it left out
+            '''INSERT OR REPLACE INTO holdings (user_id, symbol, quantity, purchase_price, updated_at)
+               SELECT user_id, symbol, quantity, purchase_price, timestamp FROM
+                 (SELECT portfolio.user_id, symbol, quantity, purchase_price, timestamp,
+                         ROW_NUMBER() OVER (PARTITION BY portfolio.user_id, symbol ORDER BY timestamp DESC, id DESC) AS age
+                  FROM portfolio
+                  JOIN (SELECT user_id, MAX(timestamp) AS latest FROM portfolio GROUP BY user_id) AS snapshot
+                    ON snapshot.user_id = portfolio.user_id
+                  WHERE timestamp >= strftime('%Y-%m-%d %H:%M:%f', snapshot.latest, '-1 second'))
+               WHERE age = 1 AND quantity != 0''',
+        ]),
+    ],
+    'conversation': [
+        (1, [
+            '''CREATE TABLE IF NOT EXISTS conversation_history
+               (id INTEGER PRIMARY KEY,
+                user_id TEXT,
+                question TEXT,
+                answer TEXT,
+                timestamp DATETIME)''',
+        ]),
+        (2, [
+            'CREATE INDEX IF NOT EXISTS idx_conversation_user_ts ON conversation_history (user_id, timestamp)',
+        ]),
+        (3, [
+            # Rolling summary of each user's turns older than the in-memory window
+            '''CREATE TABLE IF NOT EXISTS conversation_summaries
+               (user_id TEXT PRIMARY KEY,
+                summary TEXT,
+                updated_at DATETIME) WITHOUT ROWID''',
+            # Retention purges delete by age across all users
+            'CREATE INDEX IF NOT EXISTS idx_conversation_ts ON conversation_history (timestamp)',
+        ]),
+    ],
+}
+
+
+def configure(conn):
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+
+def current_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                    (version INTEGER PRIMARY KEY,
+                     applied_at DATETIME)''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(conn, database):
+    """Bring `conn` up to the latest schema version for `database`; returns that version"""
+    version = current_version(conn)
+    for target, steps in MIGRATIONS[database]:
+        if target <= version:
+            continue
+        # IMMEDIATE takes the write lock up front so concurrent processes migrate one at a time
+        conn.commit()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if current_version(conn) < target:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(
+                    'INSERT INTO schema_version (version, applied_at) VALUES (?, ?)',
+                    (target, datetime.now())
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        version = target
+    return version
@@ -0,0 +1,121 @@
+import atexit
+import os
+import sqlite3
+import threading
+
+from .schema import configure as configure_connection, migrate
+
+DATABASES = {
+    'market_data': os.getenv('MARKET_DB_PATH', 'market_data.db'),
+    'portfolio': os.getenv('PORTFOLIO_DB_PATH', 'portfolio.db'),
+    'conversation': os.getenv('CONVERSATION_DB_PATH', 'conversation.db'),
+}
+
+
+class ConnectionPool:
+    """Hands each thread its own SQLite connection per database.
+
+    Connections are opened lazily, configured and migrated once per database, and
+    returned to a bounded idle list by release() so short-lived request threads
+    reuse them (and their prepared-statement caches) instead of reconnecting.
+    """
+
+    def __init__(self, databases=None, max_idle=8, cached_statements=256):
+        self.databases = dict(databases or DATABASES)
+        self.max_idle = max_idle
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+        self._idle = {}
+        self._open = set()
+        self._prepared = set()
+
+    def _thread_connections(self):
+        conns = getattr(self._local, 'connections', None)
+        if conns is None:
+            conns = self._local.connections = {}
+        return conns
+
+    def _open_connection(self, name):
+        path = self.databases[name]
+        conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            uri=path.startswith('file:')
+        )
+        configure_connection(conn)
+        with self._migrate_lock:
+            if name not in self._prepared:
+                migrate(conn, name)
+                self._prepared.add(name)
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def connection(self, name):
+        conns = self._thread_connections()
+        conn = conns.get(name)
+        if conn is None:
+            with self._lock:
+                idle = self._idle.get(name)
+                conn = idle.pop() if idle else None
+            if conn is None:
+                conn = self._open_connection(name)
+            conns[name] = conn
+        return conn
+
+    def release(self):
+        """Return the calling thread's connections to the idle list (call at request teardown)"""
+        conns = self._thread_connections()
+        for name, conn in conns.items():
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                idle = self._idle.setdefault(name, [])
+                if len(idle) < self.max_idle:
+                    idle.append(conn)
+                    continue
+                self._open.discard(conn)
+            conn.close()
+        conns.clear()
+
+    def close_all(self):
+        with self._lock:
+            conns, self._open = self._open, set()
+            self._idle = {}
+            self._prepared = set()
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+pool = ConnectionPool()
+
+
+def connection(name):
+    return pool.connection(name)
+
+
+def release():
+    pool.release()
+
+
+def records(cursor):
+    """Remaining rows of an executed cursor as dicts keyed by column name"""
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]
+
+
+@atexit.register
+def close_all():
+    pool.close_all()
+
+
+def configure(databases=None, **options):
+    """Point the shared pool at different database files, closing any open connections"""
+    global pool
+    pool.close_all()
+    pool = ConnectionPool({**DATABASES, **(databases or {})}, **options)
+    return pool
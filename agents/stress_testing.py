@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+
+def load_sector_map(path=None):
+    """{symbol: sector} from a JSON file (SECTOR_MAP_PATH by default); empty when unset"""
+    path = path or os.getenv('SECTOR_MAP_PATH')
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class ScenarioSet:
+    """Named price-shock scenarios, resolved into a (scenario x symbol) matrix.
+
+    Each scenario has a default shock for every symbol, optional per-sector shocks and
+    optional per-symbol shocks; the most specific one wins. Shocks are fractional
+    price moves, e.g. -0.2 for a 20% fall.
+    """
+
+    def __init__(self, scenarios=None):
+        self.scenarios = list(scenarios or [])
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    @property
+    def names(self):
+        return [scenario['name'] for scenario in self.scenarios]
+
+    def add(self, name, default=0.0, sectors=None, symbols=None):
+        self.scenarios.append({
+            'name': name,
+            'default': float(default),
+            'sectors': {sector: float(shock) for sector, shock in (sectors or {}).items()},
+            'symbols': {symbol: float(shock) for symbol, shock in (symbols or {}).items()},
+        })
+        return self
+
+    @classmethod
+    def uniform(cls, shocks):
+        scenario_set = cls()
+        for shock in shocks:
+            scenario_set.add(shock, default=shock)
+        return scenario_set
+
+    @classmethod
+    def sector_shocks(cls, scenarios):
+        """`scenarios` maps a scenario name to {sector: shock}"""
+        scenario_set = cls()
+        for name, sectors in scenarios.items():
+            scenario_set.add(name, sectors=sectors)
+        return scenario_set
+
+    @classmethod
+    def load(cls, path):
+        """Read scenarios from JSON or CSV.
+
+        JSON is a list of {"name", "default", "sectors", "symbols"} objects. CSV has a
+        `name` column, an optional `default` column, `sector:<name>` columns and one
+        column per symbol; blank cells fall through to the next rule.
+        """
+        scenario_set = cls()
+        if path.endswith('.json'):
+            with open(path) as f:
+                for scenario in json.load(f):
+                    scenario_set.add(
+                        scenario['name'],
+                        scenario.get('default', 0.0),
+                        scenario.get('sectors'),
+                        scenario.get('symbols')
+                    )
+            return scenario_set
+
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                name = row.pop('name')
+                default = row.pop('default', '') or 0.0
+                sectors, symbols = {}, {}
+                for column, value in row.items():
+                    if value in ('', None):
+                        continue
+                    if column.startswith('sector:'):
+                        sectors[column[len('sector:'):]] = value
+                    else:
+                        symbols[column] = value
+                scenario_set.add(name, default, sectors, symbols)
+        return scenario_set
+
+    def extend(self, other):
+        self.scenarios.extend(other.scenarios)
+        return self
+
+    def matrix(self, symbols, sector_map=None):
+        sector_map = sector_map or {}
+        columns = {symbol: index for index, symbol in enumerate(symbols)}
+        sector_columns = {}
+        for symbol, index in columns.items():
+            sector = sector_map.get(symbol)
+            if sector is not None:
+                sector_columns.setdefault(sector, []).append(index)
+
+        shocks = np.empty((len(self.scenarios), len(symbols)))
+        shocks[:] = np.array([scenario['default'] for scenario in self.scenarios])[:, None]
+        for row, scenario in enumerate(self.scenarios):
+            for sector, shock in scenario['sectors'].items():
+                shocks[row, sector_columns.get(sector, [])] = shock
+            for symbol, shock in scenario['symbols'].items():
+                if symbol in columns:
+                    shocks[row, columns[symbol]] = shock
+        return shocks
+
+
+def replay_shocks(price_matrix, window):
+    """Every historical `window`-step move in a (time x symbol) price matrix, one row per start.
+
+    Symbols without history over a window replay as unchanged (0.0).
+    """
+    if window < 1 or price_matrix.shape[0] <= window:
+        return np.empty((0, price_matrix.shape[1]))
+    shocks = price_matrix[window:] / price_matrix[:-window] - 1
+    return np.nan_to_num(shocks, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def scenario_losses(shocks, position_values):
+    """Loss per scenario for a (scenario x symbol) shock matrix; positive numbers are losses"""
+    return 0.0 - shocks @ position_values
@@ -0,0 +1,319 @@
+"""ASGI serving mode for the API, runnable under any ASGI server, e.g.
+
+    uvicorn asgi:app --workers 4
+
+Agent code is synchronous, so every request's handler runs on an executor while the event
+loop keeps serving other connections: CPU-heavy routes on a small bounded pool, database and
+network-bound routes on a larger I/O pool. Each route has its own concurrency limit and wait
+queue; requests arriving to a full queue get an immediate 503, and requests that overrun the
+timeout (queueing included) get a 504. /api/stream pushes server-sent events from the
+in-process event bus; an idle stream costs a queue and a coroutine, not a thread.
+/api/chat/stream sends an answer's tokens as server-sent events while the model generates.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from dotenv import load_dotenv
+
+import handlers
+from agents import storage
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class RouteLimiter:
+    """At most `limit` requests of one route in flight, and at most `queue_limit` waiting"""
+
+    def __init__(self, limit, queue_limit):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self):
+        if self._slots.locked() and self.waiting >= self.queue_limit:
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+
+class AsyncAPI:
+    def __init__(self, config=None, agent_overrides=None):
+        cpu_count = os.cpu_count() or 1
+        self.config = {
+            'CPU_WORKERS': int(os.getenv('ASGI_CPU_WORKERS', str(cpu_count))),
+            'IO_WORKERS': int(os.getenv('ASGI_IO_WORKERS', '64')),
+            # path -> concurrent requests; unlisted routes get their executor's size
+            'ROUTE_LIMITS': {},
+            'QUEUE_LIMIT': int(os.getenv('ASGI_QUEUE_LIMIT', '256')),
+            'REQUEST_TIMEOUT': float(os.getenv('ASGI_REQUEST_TIMEOUT', '30')),
+            'MAX_BODY_BYTES': int(os.getenv('ASGI_MAX_BODY_BYTES', '1048576')),
+            'MAX_STREAMS': int(os.getenv('ASGI_MAX_STREAMS', '10000')),
+        }
+        self.config.update(config or {})
+        if 'DATABASES' in self.config or 'STORAGE_OPTIONS' in self.config:
+            storage.configure(self.config.get('DATABASES'), **self.config.get('STORAGE_OPTIONS', {}))
+
+        self.agents = handlers.build_registry(agent_overrides)
+        self.executors = {
+            'cpu': ThreadPoolExecutor(max_workers=self.config['CPU_WORKERS'], thread_name_prefix='api-cpu'),
+            'io': ThreadPoolExecutor(max_workers=self.config['IO_WORKERS'], thread_name_prefix='api-io'),
+        }
+        workload_limits = {'cpu': self.config['CPU_WORKERS'], 'io': self.config['IO_WORKERS']}
+        self.routes = {}
+        self.limiters = {}
+        for method, path, handler, workload in handlers.ROUTES:
+            self.routes[(method, path)] = (handler, workload)
+            self.limiters[path] = RouteLimiter(
+                self.config['ROUTE_LIMITS'].get(path, workload_limits[workload]),
+                self.config['QUEUE_LIMIT']
+            )
+        self.streams = 0
+        self.price_store_started = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if handlers.scheduler_enabled(self.config):
+                    self.agents.get('scheduler').start()
+                self.price_store_started = await asyncio.get_running_loop().run_in_executor(
+                    self.executors['io'], handlers.start_price_store, self.config
+                )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        if 'scheduler' in self.agents.loaded():
+            self.agents.get('scheduler').stop(wait=False)
+        if self.price_store_started:
+            from agents import price_store
+            price_store.stop_refresher()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _params(self, scope):
+        params = {}
+        for name, value in parse_qsl(scope.get('query_string', b'').decode('latin-1')):
+            params.setdefault(name, value)
+        return params
+
+    async def _read_body(self, receive):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.config['MAX_BODY_BYTES']:
+                raise BodyTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _respond(self, send, payload, status, headers=()):
+        body = handlers.to_json(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _run(self, path, handler, workload, params, body):
+        limiter = self.limiters[path]
+        await limiter.acquire()
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executors[workload], handlers.dispatch, handler, self.agents, params, body
+        )
+
+        def finished(future):
+            # The slot stays taken until the work really ends, even after the client timed out
+            limiter.release()
+            if not future.cancelled():
+                future.exception()
+
+        future.add_done_callback(finished)
+        return await asyncio.shield(future)
+
+    async def _wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _stream(self, scope, receive, send, params):
+        if self.streams >= self.config['MAX_STREAMS']:
+            await self._respond(send, {'error': 'Server busy, retry shortly'}, 503, [(b'retry-after', b'5')])
+            return
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        executor = self.executors['io']
+        try:
+            # A portfolio stream loads the user's holdings (and may warm the price store), so
+            # opening and closing run on the I/O executor, never on the event loop
+            subscription = await loop.run_in_executor(
+                executor, lambda: handlers.open_stream(params, on_ready=lambda: loop.call_soon_threadsafe(ready.set))
+            )
+        except handlers.BadRequest as e:
+            await self._respond(send, {'error': str(e)}, 400)
+            return
+
+        self.streams += 1
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+            })
+            while not disconnected.done():
+                woken = asyncio.ensure_future(ready.wait())
+                await asyncio.wait({woken, disconnected}, timeout=handlers.STREAM_HEARTBEAT_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if disconnected.done():
+                    break
+                # Clear before draining so an event published in between wakes the next wait
+                ready.clear()
+                chunk = handlers.format_events(subscription.drain())
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        finally:
+            self.streams -= 1
+            disconnected.cancel()
+            await loop.run_in_executor(executor, subscription.close)
+
+    async def _chat_stream(self, receive, send, body):
+        # Shares /api/chat's limiter; the slot is held until the answer has streamed in full
+        limiter = self.limiters['/api/chat']
+        try:
+            await asyncio.wait_for(limiter.acquire(), self.config['REQUEST_TIMEOUT'])
+        except Overloaded:
+            await self._respond(send, {'error': 'Server busy, retry shortly'}, 503, [(b'retry-after', b'1')])
+            return
+        except asyncio.TimeoutError:
+            await self._respond(send, {'error': 'Request timed out'}, 504)
+            return
+
+        loop = asyncio.get_running_loop()
+        executor = self.executors['io']
+        disconnected = None
+        chat_events = None
+        try:
+            try:
+                chat_events = await loop.run_in_executor(executor, handlers.open_chat_stream, self.agents, body)
+            except handlers.BadRequest as e:
+                await self._respond(send, {'error': str(e)}, 400)
+                return
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')],
+            })
+            disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+            # The generator does blocking work (model calls, the history write), so each step
+            # runs on the I/O executor; only one step is ever in flight
+            while not disconnected.done():
+                try:
+                    event = await loop.run_in_executor(executor, next, chat_events, None)
+                except Exception as e:
+                    event = ('error', {'error': str(e)})
+                    chat_events = None
+                if event is None:
+                    break
+                await send({'type': 'http.response.body', 'body': handlers.format_events([event]).encode(),
+                            'more_body': True})
+                if chat_events is None:
+                    break
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if disconnected is not None:
+                disconnected.cancel()
+            if chat_events is not None:
+                try:
+                    chat_events.close()
+                except ValueError:
+                    # Cancelled mid-step: the generator is still running on the executor
+                    pass
+            limiter.release()
+
+    async def _http(self, scope, receive, send):
+        if scope['method'] == 'GET' and scope['path'] == '/api/stream':
+            await self._stream(scope, receive, send, self._params(scope))
+            return
+        chat_stream = scope['method'] == 'POST' and scope['path'] == '/api/chat/stream'
+        route = self.routes.get((scope['method'], scope['path']))
+        if route is None and not chat_stream:
+            known = any(path == scope['path'] for _, path in self.routes)
+            await self._respond(send, {'error': 'Method not allowed' if known else 'Not found'}, 405 if known else 404)
+            return
+
+        try:
+            raw = await self._read_body(receive)
+        except BodyTooLarge:
+            await self._respond(send, {'error': 'Request body too large'}, 413)
+            return
+        if raw is None:
+            return
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            await self._respond(send, {'error': 'Invalid JSON body'}, 400)
+            return
+        if chat_stream:
+            await self._chat_stream(receive, send, body)
+            return
+        handler, workload = route
+        params = self._params(scope)
+
+        try:
+            payload, status = await asyncio.wait_for(
+                self._run(scope['path'], handler, workload, params, body),
+                self.config['REQUEST_TIMEOUT']
+            )
+        except Overloaded:
+            await self._respond(send, {'error': 'Server busy, retry shortly'}, 503, [(b'retry-after', b'1')])
+            return
+        except asyncio.TimeoutError:
+            await self._respond(send, {'error': 'Request timed out'}, 504)
+            return
+        except Exception as e:
+            await self._respond(send, {'error': str(e)}, 500)
+            return
+        await self._respond(send, payload, status)
+
+
+def create_app(config=None, agent_overrides=None):
+    """ASGI counterpart of app.create_app(); takes the same DATABASES / STORAGE_OPTIONS /
+    RUN_SCHEDULER config"""
+    # Load environment variables
+    load_dotenv()
+    return AsyncAPI(config, agent_overrides)
+
+
+app = create_app()
@@ -0,0 +1,94 @@
+"""Bulk brokerage sync against a local mock brokerage.
+
+The mock answers GET /v1/portfolio?user_id=... with a few positions per user after a fixed
+latency, and rejects a share of requests with 429 + Retry-After to exercise the retries. The
+sync runs twice against throwaway SQLite files: the first run writes every position, the
+second finds nothing changed.
+
+    python benchmarks/brokerage_sync.py --users 2000 --latency 0.05 --rate 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agents import storage  # noqa: E402
+from agents.portfolio_tracker import PortfolioTracker  # noqa: E402
+
+SYMBOLS = ('AAPL', 'MSFT', 'NVDA', 'TSLA', 'AMZN', 'GOOGL', 'META', 'JPM')
+
+
+def mock_brokerage(latency, throttle):
+    """Start the mock on a free port; returns (server, base_url)"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            if random.random() < throttle:
+                self.send_response(429)
+                self.send_header('Retry-After', '0.05')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            user_id = parse_qs(urlsplit(self.path).query)['user_id'][0]
+            # Deterministic per user, so a second sync sees identical positions
+            picker = random.Random(user_id)
+            body = json.dumps({'positions': [
+                {'symbol': symbol, 'quantity': picker.randint(1, 100), 'price': round(picker.uniform(10, 500), 2)}
+                for symbol in picker.sample(SYMBOLS, 3)
+            ]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--rate', type=float, default=500, help='client-side requests per second')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock response time in seconds')
+    parser.add_argument('--throttle', type=float, default=0.02, help='share of requests answered 429')
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    server, url = mock_brokerage(args.latency, args.throttle)
+    with tempfile.TemporaryDirectory() as workdir:
+        storage.configure({name: os.path.join(workdir, f'{name}.db')
+                           for name in ('market_data', 'portfolio', 'conversation')})
+        tracker = PortfolioTracker({'url': url, 'workers': args.workers, 'rate': args.rate,
+                                    'burst': args.workers, 'backoff': 0.05, 'batch_size': args.batch_size})
+        user_ids = [f'user-{n}' for n in range(args.users)]
+        for label in ('initial', 'unchanged'):
+            stats = tracker.sync_all_portfolios(user_ids, active_users=user_ids[-10:])
+            print(f'{label:<10} {stats["synced"]:>6} synced  {stats["failed"]:>4} failed  '
+                  f'{stats["position_changes"]:>6} changes  {stats["batches"]:>4} batches  '
+                  f'{stats["users_per_second"]:8.1f} users/s  p99 {stats["p99_latency_seconds"] * 1000:7.1f} ms  '
+                  f'rate-limited {stats["rate_limit_wait_seconds"]:6.1f} s')
+        storage.close_all()
+    server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
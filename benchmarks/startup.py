@@ -0,0 +1,82 @@
+"""Cold-start cost of the API app and of each agent's first use.
+
+Every measurement runs in a fresh interpreter, as a newly scaled-out worker would, against
+throwaway SQLite files so migrations are part of the cost.
+
+    python benchmarks/startup.py --runs 5 --max-seconds 1.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from agents.metrics import percentile  # noqa: E402
+from agents.registry import DEFAULT_AGENTS  # noqa: E402
+
+APP_TARGET = ':app'
+HEAVY_MODULES = ('pandas', 'numpy', 'requests', 'textblob', 'sklearn', 'cerebras')
+
+# Runs in the child: reports seconds to import the registry and to build `agent` (APP_TARGET
+# imports app.py, which creates the default app), and which heavy modules ended up loaded.
+# Keep the ':app' literal below in step with APP_TARGET.
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from agents.registry import registry
+imported = time.perf_counter()
+if sys.argv[1] == ':app':
+    import app
+elif sys.argv[1]:
+    registry.get(sys.argv[1])
+built = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - started,
+    'build_seconds': built - imported,
+    'heavy_modules': sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules),
+}))
+'''
+
+
+def probe(agent, workdir):
+    env = dict(os.environ,
+               PYTHONPATH=ROOT,
+               MARKET_DB_PATH=os.path.join(workdir, 'market_data.db'),
+               PORTFOLIO_DB_PATH=os.path.join(workdir, 'portfolio.db'),
+               CONVERSATION_DB_PATH=os.path.join(workdir, 'conversation.db'))
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, agent, json.dumps(HEAVY_MODULES)],
+        env=env, cwd=workdir, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--agents', nargs='*', default=['', APP_TARGET] + list(DEFAULT_AGENTS),
+                        help=f"agents to build ('' measures the bare registry import, {APP_TARGET!r} the app)")
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='exit non-zero if any p50 import+build time exceeds this')
+    args = parser.parse_args()
+
+    failed = False
+    for agent in args.agents:
+        totals, result = [], None
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as workdir:
+                result = probe(agent, workdir)
+            totals.append(result['import_seconds'] + result['build_seconds'])
+        p50 = percentile(totals, 50)
+        failed |= args.max_seconds is not None and p50 > args.max_seconds
+        print(f'{agent or "(registry)":<16} p50 {p50 * 1000:8.1f} ms  max {max(totals) * 1000:8.1f} ms  '
+              f'loads: {", ".join(result["heavy_modules"]) or "-"}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""API handlers shared by the Flask (app.py) and ASGI (asgi.py) servers.
+
+Each handler takes the agent registry, the query parameters (a mapping of strings) and the
+parsed JSON body (or None) and returns (payload, status).
+"""
+import json
+import os
+from datetime import date
+
+from agents import events
+from agents.registry import DEFAULT_AGENTS, AgentRegistry
+from agents.scheduler import default_scheduler
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def build_registry(agent_overrides=None):
+    """Agent registry with the package defaults, the LLM client (LLM_BACKEND) and any overrides.
+
+    Overrides map names to instances, factories or 'module:attribute' specs; everything is
+    built on first use.
+    """
+    registry = AgentRegistry({**DEFAULT_AGENTS, 'llm': 'agents.llm:from_env'})
+    registry.register('scheduler', lambda: default_scheduler(registry))
+    for name, agent in (agent_overrides or {}).items():
+        if isinstance(agent, str) or callable(agent):
+            registry.register(name, agent)
+        else:
+            registry.provide(name, agent)
+    return registry
+
+
+def _param(params, name, default, convert):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        raise BadRequest(f'Invalid {name}: {value!r}')
+
+
+def risk_analysis(agents, params, body):
+    user_id = params.get('user_id', 'default_user')
+    method = params.get('method')
+    if method is None:
+        return agents.get('risk').get_risk_metrics(user_id), 200
+    confidence_level = _param(params, 'confidence_level', 0.95, float)
+    horizon_days = _param(params, 'horizon_days', 1, int)
+    # Written so NaN fails too
+    if not 0 < confidence_level < 1:
+        raise BadRequest(f'confidence_level must be between 0 and 1, got {confidence_level}')
+    if horizon_days < 1:
+        raise BadRequest(f'horizon_days must be at least 1, got {horizon_days}')
+    try:
+        # Full VaR / expected shortfall / component VaR from the risk engine
+        result = agents.get('risk').simulate_value_at_risk(
+            user_id,
+            method=method,
+            confidence_level=confidence_level,
+            horizon_days=horizon_days
+        )
+    except ValueError as e:
+        # Unknown VaR method
+        raise BadRequest(str(e))
+    return result, 200
+
+
+def market_insights(agents, params, body):
+    return agents.get('market_insight').get_latest_reports(), 200
+
+
+def recommendations(agents, params, body):
+    user_id = params.get('user_id', 'default_user')
+    return agents.get('recommendation').get_user_recommendations(user_id), 200
+
+
+def chat(agents, params, body):
+    body = body or {}
+    user_id = body.get('user_id', 'default_user')
+    question = body.get('question', '')
+
+    if not question:
+        return {'error': 'No question provided'}, 400
+
+    conversational_agent = agents.get('conversational')
+    # The registry stands in for the agents dict, so only the agent a question needs gets built
+    completion = conversational_agent.respond(user_id, question, agents)
+    response = completion.read()
+
+    conversational_agent.add_conversation(user_id, question, response)
+
+    return {
+        'response': response,
+        'confidence': completion.confidence,
+        'sources': completion.sources,
+        'usage': completion.usage
+    }, 200
+
+
+def open_chat_stream(agents, body):
+    """Answer a chat question as ('token', text) events, then one ('done', ...) event.
+
+    The answer is saved to the conversation history once it has streamed in full.
+    """
+    body = body or {}
+    user_id = body.get('user_id', 'default_user')
+    question = body.get('question', '')
+    if not question:
+        raise BadRequest('No question provided')
+
+    conversational_agent = agents.get('conversational')
+    completion = conversational_agent.respond(user_id, question, agents)
+
+    def generate():
+        for token in completion:
+            yield 'token', token
+        conversational_agent.add_conversation(user_id, question, completion.text)
+        yield 'done', {'confidence': completion.confidence, 'sources': completion.sources, 'usage': completion.usage}
+
+    return generate()
+
+
+def chat_usage(agents, params, body):
+    # Only report on an LLM client this process has actually used
+    if 'llm' not in agents.loaded():
+        return {}, 200
+    return agents.get('llm').stats(), 200
+
+
+def jobs(agents, params, body):
+    # Only report on a scheduler this process actually runs
+    if 'scheduler' not in agents.loaded():
+        return {}, 200
+    return agents.get('scheduler').metrics(), 200
+
+
+def scheduler_enabled(config):
+    """Whether this process should run the background jobs (enable it in one process only)"""
+    return bool(config.get('RUN_SCHEDULER', os.getenv('RUN_SCHEDULER', '0') == '1'))
+
+
+def start_price_store(config):
+    """Warm the resident price store and start its background refresh, unless WARM_PRICE_STORE
+    (default: the WARM_PRICE_STORE env var, on) turns it off; returns whether it was started"""
+    if not config.get('WARM_PRICE_STORE', os.getenv('WARM_PRICE_STORE', '1') == '1'):
+        return False
+    # Imported here: the price store pulls in numpy
+    from agents import price_store
+    return price_store.start_refresher()
+
+
+# Push topics for /api/stream; 'portfolio' and 'risk' carry only the requesting user's events
+STREAM_TOPICS = ('ticks', 'insights', 'portfolio', 'risk')
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+
+
+def open_stream(params, on_ready=None):
+    """Subscribe to the event bus for one streaming client; close() the result when it leaves"""
+    user_id = params.get('user_id', 'default_user')
+    topics = [topic for topic in params.get('topics', ','.join(STREAM_TOPICS)).split(',') if topic]
+    unknown = sorted(set(topics) - set(STREAM_TOPICS))
+    if unknown:
+        raise BadRequest(f'Unknown topics {unknown}; expected some of {list(STREAM_TOPICS)}')
+    subscription = events.bus.subscribe(topics, user_id=user_id, on_ready=on_ready)
+    if 'portfolio' in topics:
+        # Imported here: the tracker pulls in the price store, which only streams need
+        from agents.portfolio_stream import tracker
+        subscription.on_close(lambda: tracker.unwatch(user_id))
+        tracker.watch(user_id)
+    return subscription
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        # NumPy scalars
+        return value.item()
+    return str(value)
+
+
+def to_json(payload):
+    return json.dumps(payload, default=_json_default)
+
+
+def format_events(stream_events):
+    """Server-sent events wire format; a comment line keeps idle connections alive"""
+    if not stream_events:
+        return ': keepalive\n\n'
+    return ''.join(f'event: {topic}\ndata: {to_json(data)}\n\n' for topic, data in stream_events)
+
+
+def dispatch(handler, agents, params, body):
+    """Run a handler, turning invalid input into a 400"""
+    try:
+        return handler(agents, params, body)
+    except BadRequest as e:
+        return {'error': str(e)}, 400
+
+
+# (method, path, handler, workload); the ASGI server runs 'cpu' work on its bounded CPU
+# executor and 'io' work (database reads, outbound HTTP, LLM calls) on its I/O executor
+ROUTES = [
+    ('GET', '/api/risk-analysis', risk_analysis, 'cpu'),
+    ('GET', '/api/market-insights', market_insights, 'io'),
+    ('GET', '/api/recommendations', recommendations, 'io'),
+    ('POST', '/api/chat', chat, 'io'),
+    ('GET', '/api/jobs', jobs, 'io'),
+    ('GET', '/api/chat/usage', chat_usage, 'io'),
+]
@@ -0,0 +1,162 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Importing app.py or asgi.py builds an app; keep that from warming the default databases
+os.environ['WARM_PRICE_STORE'] = '0'
+
+from agents import price_store, rollups, schema, storage  # noqa: E402
+from agents.content_hash import content_hash  # noqa: E402
+from agents.data_ingestion_agent import DataIngestionAgent  # noqa: E402
+from agents.portfolio_tracker import PortfolioTracker  # noqa: E402
+from agents.risk_analyzer import RiskAnalyzer  # noqa: E402
+
+QUOTE_TIME = '2026-01-05T15:30:00Z'
+
+
+def _reset_price_store():
+    for store in (price_store.store, price_store.daily):
+        store._series = {}
+        store.warmed = False
+    price_store._refresh_state.update(tick_id=0)
+
+
+@pytest.fixture(autouse=True)
+def databases(tmp_path):
+    """Every test gets its own throwaway SQLite files and a cold price store"""
+    paths = {name: str(tmp_path / f'{name}.db') for name in storage.DATABASES}
+    storage.configure(paths)
+    _reset_price_store()
+    yield paths
+    price_store.stop_refresher()
+    storage.close_all()
+    _reset_price_store()
+
+
+def store_ticks(rows):
+    """Write (symbol, price, timestamp) ticks and their bars the way ingestion does"""
+    conn = storage.connection('market_data')
+    rows = sorted(rows, key=lambda row: row[2])
+    with conn:
+        conn.executemany('INSERT INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)', rows)
+        rollups.update_bars(conn, rows)
+
+
+def store_articles(articles):
+    """Write (title, content) articles as ingestion does, without the dedup; returns their ids"""
+    conn = storage.connection('market_data')
+    with conn:
+        return [conn.execute(
+            'INSERT INTO news_articles (title, content, source, timestamp, content_hash) VALUES (?, ?, ?, ?, ?)',
+            (title, content, 'test', datetime.now(), content_hash(content, title))
+        ).lastrowid for title, content in articles]
+
+
+def daily_ticks(symbol, prices, skip=(), end=None):
+    """One midday tick per day ending today, oldest first, leaving out the day offsets in `skip`"""
+    end = (end or datetime.now()).replace(hour=12, minute=0, second=0, microsecond=0)
+    return [(symbol, float(price), end - timedelta(days=len(prices) - 1 - day))
+            for day, price in enumerate(prices) if day not in skip]
+
+
+def stub_server(respond):
+    """Serve GETs on a free local port with respond(path, query) -> (status, body bytes).
+
+    Returns (server, base_url); call server.shutdown() when done.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            status, body = respond(url.path, {name: values[0] for name, values in parse_qs(url.query).items()})
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+@pytest.fixture
+def quote_server():
+    """Stub market API: `prices` are served, BROKEN answers 500, GARBLED answers invalid JSON"""
+    state = {'requests': 0, 'prices': {'AAPL': 190.5, 'MSFT': 410.25, 'NVDA': 880.0}}
+
+    def respond(path, query):
+        state['requests'] += 1
+        if path == '/quotes':
+            return 200, json.dumps({'quotes': [
+                {'symbol': symbol, 'price': state['prices'][symbol], 'timestamp': QUOTE_TIME}
+                for symbol in query['symbols'].split(',') if symbol in state['prices']
+            ]}).encode()
+        symbol = path.rsplit('/', 1)[-1]
+        if symbol == 'BROKEN':
+            return 500, b''
+        if symbol == 'GARBLED':
+            return 200, b'{not json'
+        return 200, json.dumps({'price': state['prices'][symbol], 'timestamp': QUOTE_TIME}).encode()
+
+    server, state['url'] = stub_server(respond)
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def ingestion_agent(quote_server, **config):
+    return DataIngestionAgent({'market_url': quote_server['url'], 'retries': 1, 'backoff': 0.01,
+                               'timeout': 2, 'budget': 10, **config})
+
+
+def baseline_database(path, database):
+    """A database as the app created it before schema versioning: version-1 tables, no schema_version"""
+    conn = sqlite3.connect(path)
+    for step in schema.MIGRATIONS[database][0][1]:
+        conn.execute(step)
+    conn.commit()
+    return conn
+
+
+def random_walk(seed, days=25, start=100.0):
+    rng = np.random.default_rng(seed)
+    return start * np.cumprod(1 + rng.normal(0, 0.02, days))
+
+
+def hold(user_id, positions):
+    """Sync {symbol: quantity} as the user's whole portfolio"""
+    PortfolioTracker().sync_positions(user_id, [
+        {'symbol': symbol, 'quantity': quantity, 'price': 100.0} for symbol, quantity in positions.items()
+    ])
+
+
+@pytest.fixture
+def analyzer():
+    analyzer = RiskAnalyzer(sector_map={})
+    yield analyzer
+    analyzer.close()
+
+
+@pytest.fixture
+def book():
+    """A long/short book over a month of daily closes, one symbol missing a day"""
+    store_ticks(daily_ticks('AAPL', random_walk(1)) + daily_ticks('MSFT', random_walk(2))
+                + daily_ticks('NVDA', random_walk(3), skip={7}))
+    hold('alice', {'AAPL': 10, 'MSFT': -4, 'NVDA': 6})
+    return 'alice'
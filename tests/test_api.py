@@ -0,0 +1,40 @@
+import asyncio
+import json
+from datetime import datetime
+
+import numpy as np
+
+import app as flask_app
+import asgi
+
+
+class StubRisk:
+    def get_risk_metrics(self, user_id):
+        return {'timestamp': datetime(2026, 1, 5, 10, 30), 'value_at_risk_95': np.float64(12.5), 'user_id': user_id}
+
+
+def _asgi_get(api, path, query=b''):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(api({'type': 'http', 'method': 'GET', 'path': path, 'query_string': query}, receive, send))
+    api.close()
+    return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_flask_and_asgi_serialize_alike(databases):
+    config = {'DATABASES': databases, 'RUN_SCHEDULER': False}
+    client = flask_app.create_app(config, {'risk': StubRisk()}).test_client()
+
+    flask_response = client.get('/api/risk-analysis?user_id=alice')
+    status, body = _asgi_get(asgi.create_app(config, {'risk': StubRisk()}), '/api/risk-analysis', b'user_id=alice')
+
+    assert flask_response.status_code == status == 200
+    assert flask_response.content_type == 'application/json'
+    assert flask_response.data == body
+    assert json.loads(body) == {'timestamp': '2026-01-05T10:30:00', 'value_at_risk_95': 12.5, 'user_id': 'alice'}
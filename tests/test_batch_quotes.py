@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from conftest import QUOTE_TIME, ingestion_agent
+
+from agents import storage
+
+
+def test_batch_endpoint(quote_server):
+    stats = ingestion_agent(quote_server, batch_size=2).fetch_market_data(['AAPL', 'MSFT', 'NVDA'])
+
+    assert stats['requests'] == 2
+    assert stats['inserted'] == 3
+    assert quote_server['requests'] == 2
+
+
+def test_utc_timestamps_are_stored_as_local_time(quote_server):
+    ingestion_agent(quote_server).fetch_market_data(['AAPL'])
+
+    expected = datetime.fromisoformat(QUOTE_TIME.replace('Z', '+00:00')).astimezone().replace(tzinfo=None)
+    stored = storage.connection('market_data').execute('SELECT timestamp FROM market_data').fetchone()[0]
+    assert stored == str(expected)
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from conftest import stub_server
+
+from agents import storage
+from agents.portfolio_tracker import PortfolioTracker
+
+
+@pytest.fixture
+def brokerage():
+    """Mock brokerage: GET /portfolio?user_id=... answers from `positions`; other users get 500"""
+    state = {'positions': {}, 'requests': []}
+
+    def respond(path, query):
+        user_id = query['user_id']
+        state['requests'].append(user_id)
+        if user_id == 'garbled':
+            return 200, b'{"positions": ['
+        if user_id not in state['positions']:
+            return 500, b''
+        return 200, json.dumps({'positions': [
+            {'symbol': symbol, 'quantity': quantity, 'price': price}
+            for symbol, (quantity, price) in state['positions'][user_id].items()
+        ]}).encode()
+
+    server, state['url'] = stub_server(respond)
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def _tracker(brokerage):
+    return PortfolioTracker({'url': brokerage['url'], 'rate': 1000, 'burst': 1000, 'retries': 0,
+                             'timeout': 2, 'batch_size': 2, 'workers': 4})
+
+
+def _holdings():
+    return storage.connection('portfolio').execute(
+        'SELECT user_id, symbol, quantity, purchase_price FROM holdings ORDER BY user_id, symbol'
+    ).fetchall()
+
+
+def _history():
+    return storage.connection('portfolio').execute(
+        'SELECT user_id, symbol, quantity FROM holdings_history ORDER BY id'
+    ).fetchall()
+
+
+def test_sync_upserts_and_deletes_only_changes(brokerage):
+    brokerage['positions'] = {'alice': {'AAPL': (10, 150.0), 'MSFT': (5, 300.0)}, 'bob': {'NVDA': (2, 800.0)}}
+    tracker = _tracker(brokerage)
+
+    stats = tracker.sync_all_portfolios(['alice', 'bob'], active_users=[])
+
+    assert stats['synced'] == 2 and stats['position_changes'] == 3
+    assert _holdings() == [('alice', 'AAPL', 10, 150.0), ('alice', 'MSFT', 5, 300.0), ('bob', 'NVDA', 2, 800.0)]
+
+    brokerage['positions']['alice'] = {'AAPL': (12, 155.0)}
+    stats = tracker.sync_all_portfolios(['alice', 'bob'], active_users=[])
+
+    assert stats['changed_users'] == 1 and stats['position_changes'] == 2
+    assert _holdings() == [('alice', 'AAPL', 12, 155.0), ('bob', 'NVDA', 2, 800.0)]
+    assert sorted(_history()[3:]) == [('alice', 'AAPL', 12), ('alice', 'MSFT', 0)]
+
+
+def test_failing_users_do_not_abort_the_batch(brokerage):
+    brokerage['positions'] = {'alice': {'AAPL': (10, 150.0)}, 'carol': {'MSFT': (1, 300.0)}}
+
+    stats = _tracker(brokerage).sync_all_portfolios(['alice', 'broken', 'garbled', 'carol'], active_users=[])
+
+    assert stats['failed'] == 2
+    assert stats['synced'] == 2
+    assert _holdings() == [('alice', 'AAPL', 10, 150.0), ('carol', 'MSFT', 1, 300.0)]
+
+
+def test_default_users_include_closed_and_streaming_users(brokerage):
+    brokerage['positions'] = {'alice': {'AAPL': (10, 150.0)}, 'bob': {}, 'dave': {'TSLA': (3, 200.0)}}
+    tracker = _tracker(brokerage)
+    tracker.sync_all_portfolios(['alice'], active_users=[])
+    tracker.sync_positions('alice', [])
+    brokerage['positions']['alice'] = {'MSFT': (1, 300.0)}
+
+    stats = tracker.sync_all_portfolios(active_users=['dave'])
+
+    # alice closed everything but is still synced; dave streams and has never been synced
+    assert stats['users'] == 2
+    assert set(brokerage['requests'][-2:]) == {'alice', 'dave'}
+    assert _holdings() == [('alice', 'MSFT', 1, 300.0), ('dave', 'TSLA', 3, 200.0)]
@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+
+from agents.conversational_agent import HELP_MESSAGE, ConversationalAgent
+from agents.llm import FakeChat, LLMClient, from_env, normalize_question
+
+
+class StubAgent:
+    def __init__(self, **answers):
+        for name, answer in answers.items():
+            setattr(self, name, lambda *args, answer=answer: answer)
+
+
+# The four data agents, as callers passed them before there was an LLM client
+AGENTS = {
+    'portfolio': StubAgent(get_user_portfolio={'AAPL': 10}),
+    'risk': StubAgent(get_risk_metrics={'value_at_risk_95': 12.5}),
+    'recommendation': StubAgent(get_user_recommendations=[]),
+    'market_insight': StubAgent(get_latest_reports=[]),
+}
+
+
+@pytest.fixture
+def make_agent():
+    agents = []
+
+    def make(**kwargs):
+        agents.append(ConversationalAgent(**kwargs))
+        return agents[-1]
+
+    yield make
+    for agent in agents:
+        agent.memory.close()
+
+
+def test_llm_client_from_the_constructor(make_agent):
+    backend = FakeChat(reply='You hold 10 AAPL.')
+    agent = make_agent(llm=LLMClient(backend))
+
+    text, confidence = agent.generate_response('alice', 'What is in my portfolio?', AGENTS)
+
+    assert text == 'You hold 10 AAPL.'
+    assert confidence == 0.9
+    assert backend.calls == 1
+
+
+def test_missing_llm_falls_back_to_the_environment(make_agent, monkeypatch):
+    monkeypatch.setenv('LLM_BACKEND', 'fake')
+    agent = make_agent()
+
+    text, confidence = agent.generate_response('alice', 'How risky is my portfolio?', AGENTS)
+
+    assert text == 'You asked: How risky is my portfolio?'
+    assert confidence == 0.85
+
+
+def test_questions_without_an_intent_get_help(make_agent):
+    agent = make_agent(llm=LLMClient(FakeChat()))
+
+    text, _ = agent.generate_response('alice', 'Hello there', AGENTS)
+
+    assert text == HELP_MESSAGE
+
+
+def test_stuck_agents_cannot_fill_the_pool(make_agent):
+    release = threading.Event()
+    agents = dict(AGENTS, risk=StubAgent(get_risk_metrics=None))
+    agents['risk'].get_risk_metrics = lambda user_id: release.wait(5)
+    agent = make_agent(llm=LLMClient(FakeChat()), fanout_config={'workers': 4, 'timeout': 0.05, 'max_inflight': 2})
+
+    statuses = [agent.respond('alice', 'How risky is my portfolio?', agents).sources for _ in range(4)]
+
+    assert [sources['risk']['status'] for sources in statuses] == ['timeout', 'timeout', 'busy', 'busy']
+    # The two stuck risk calls hold two of the four workers; portfolio questions still get through
+    assert all(sources['portfolio']['status'] == 'ok' for sources in statuses)
+    release.set()
+
+
+MESSAGES = [{'role': 'system', 'content': 'Be brief.'}, {'role': 'user', 'content': 'data\n\nQuestion: How am I doing?'}]
+
+
+class BrokenChat:
+    def stream(self, messages, usage):
+        yield 'Partial '
+        raise ConnectionError('backend went away')
+
+
+def test_streams_the_fake_backend_word_by_word():
+    completion = LLMClient(FakeChat()).stream(MESSAGES)
+
+    assert list(completion) == ['You ', 'asked: ', 'How ', 'am ', 'I ', 'doing?']
+    assert completion.text == 'You asked: How am I doing?'
+    assert completion.usage['cached'] is False
+    assert completion.usage['completion_tokens'] > 0
+
+
+def test_answers_are_cached_per_key():
+    backend = FakeChat(reply='Up 3% this week.')
+    client = LLMClient(backend)
+    key = (normalize_question('How am I doing?'), 'digest')
+
+    first = client.complete(MESSAGES, cache_key=key)
+    second = client.stream(MESSAGES, cache_key=(normalize_question('how am i doing'), 'digest'))
+
+    assert second.read() == first
+    assert second.usage['cached'] is True
+    assert backend.calls == 1
+    assert client.stats()['cached'] == 1
+
+
+def test_backend_errors_fall_back_and_are_not_cached():
+    client = LLMClient(BrokenChat())
+
+    completion = client.stream(MESSAGES, cache_key=('q', 'd'), fallback='Portfolio: 100')
+
+    assert completion.read() == 'Partial \n\nPortfolio: 100'
+    assert 'ConnectionError' in completion.usage['error']
+    assert client.cache.get(('q', 'd')) is None
+    assert client.stats()['errors'] == 1
+
+
+def test_backend_errors_raise_without_a_fallback():
+    with pytest.raises(ConnectionError):
+        LLMClient(BrokenChat()).complete(MESSAGES)
+
+
+def test_from_env_picks_the_backend(monkeypatch):
+    monkeypatch.setenv('LLM_BACKEND', 'fake')
+    assert isinstance(from_env().backend, FakeChat)
+    monkeypatch.setenv('LLM_BACKEND', 'nope')
+    with pytest.raises(ValueError):
+        from_env()
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from agents import storage
+from agents.conversation_memory import ConversationMemory
+
+
+@pytest.fixture
+def make_memory():
+    memories = []
+
+    def make(**config):
+        # Flushed by hand: the background flusher only runs at close()
+        memories.append(ConversationMemory({'flush_interval': 60, **config}))
+        return memories[-1]
+
+    yield make
+    for memory in memories:
+        memory.close()
+
+
+def stored_turns(user_id):
+    return [row[0] for row in storage.connection('conversation').execute(
+        'SELECT question FROM conversation_history WHERE user_id = ? ORDER BY id', (user_id,)
+    )]
+
+
+def test_failed_flush_is_retried(make_memory, monkeypatch):
+    memory = make_memory()
+    memory.add('alice', 'first?', 'One.')
+    write = memory._write
+
+    def failing_write(turns, summaries):
+        monkeypatch.setattr(memory, '_write', write)
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(memory, '_write', failing_write)
+    with pytest.raises(RuntimeError):
+        memory.flush()
+    memory.add('alice', 'second?', 'Two.')
+
+    assert memory.memory_stats()['pending'] == 2
+    assert memory.flush() == 2
+    assert stored_turns('alice') == ['first?', 'second?']
+    assert memory.stats['flush_failures'] == 1
+    assert 'database is locked' in memory.last_flush_error
+
+
+def test_users_with_unflushed_turns_are_not_evicted(make_memory):
+    memory = make_memory(max_users=1)
+    memory.add('alice', 'first?', 'One.')
+    memory.add('bob', 'second?', 'Two.')
+
+    # alice's turn is not in the database yet, so she stays over the cap
+    assert memory.memory_stats()['users'] == 2
+    assert memory.recent('alice')[1][0]['question'] == 'first?'
+
+    memory.flush()
+    memory.recent('carol')
+
+    assert memory.memory_stats()['users'] == 1
+    assert memory.stats['evictions'] == 2
+    assert memory.recent('alice')[1][0]['question'] == 'first?'
+
+
+def test_turns_past_the_window_are_folded_into_the_summary(make_memory):
+    memory = make_memory(window=2)
+    for n in range(3):
+        memory.add('alice', f'question {n}?', f'Answer {n}. More detail.')
+
+    summary, turns = memory.recent('alice')
+
+    assert [turn['question'] for turn in turns] == ['question 2?', 'question 1?']
+    assert summary == 'Asked "question 0?"; answered: Answer 0.'
+    memory.flush()
+    assert ConversationMemory().recent('alice')[0] == summary
+
+
+def test_turns_over_the_token_budget_are_folded(make_memory):
+    memory = make_memory(token_budget=60)
+    memory.add('alice', 'short?', 'Yes.')
+    memory.add('alice', 'long?', 'word ' * 100)
+
+    summary, turns = memory.recent('alice')
+
+    # The newest turn stays even when it alone is over the budget
+    assert [turn['question'] for turn in turns] == ['long?']
+    assert summary.startswith('Asked "short?"')
+    assert memory.stats['summarized'] == 1
+
+
+def test_purge_drops_turns_and_summaries_past_retention(make_memory):
+    memory = make_memory(retention_days=30, purge_batch_size=2, idle_seconds=0)
+    old = datetime.now() - timedelta(days=31)
+    conn = storage.connection('conversation')
+    with conn:
+        conn.executemany(
+            'INSERT INTO conversation_history (user_id, question, answer, timestamp) VALUES (?, ?, ?, ?)',
+            [('alice', f'old {n}?', 'Old.', old) for n in range(5)]
+        )
+        conn.execute('INSERT INTO conversation_summaries (user_id, summary, updated_at) VALUES (?, ?, ?)',
+                     ('alice', 'Old summary', old))
+    memory.add('bob', 'new?', 'New.')
+    memory.flush()
+
+    result = memory.purge()
+
+    assert result == {'turns': 5, 'summaries': 1, 'forgotten_users': 1, 'users': 0}
+    assert stored_turns('alice') == []
+    assert stored_turns('bob') == ['new?']
+    assert memory.recent('alice') == ('', [])
+
+
+def test_close_writes_pending_turns(make_memory):
+    memory = make_memory()
+    memory.add('alice', 'first?', 'One.')
+    memory.add('bob', 'second?', 'Two.')
+
+    memory.close()
+
+    assert stored_turns('alice') == ['first?']
+    assert stored_turns('bob') == ['second?']
+    assert memory.memory_stats()['pending'] == 0
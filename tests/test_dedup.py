@@ -0,0 +1,115 @@
+import json
+from datetime import datetime
+
+import pytest
+from conftest import ingestion_agent, stub_server
+
+from agents import market_insight_agent, storage
+from agents.content_hash import content_hash
+from agents.market_insight_agent import MarketInsightAgent
+
+
+@pytest.fixture
+def news_feed(quote_server):
+    """Stub news API serving whatever `results` holds"""
+    feed = {'results': []}
+    server, url = stub_server(lambda path, query: (200, json.dumps({'results': feed['results']}).encode()))
+    feed['agent'] = ingestion_agent(quote_server, news_url=url)
+    yield feed
+    server.shutdown()
+    server.server_close()
+
+
+def article(title, content):
+    return {'title': title, 'content': content, 'source': 'wire'}
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """Contents actually scored, in-process"""
+    calls = []
+    score = market_insight_agent.score_article
+
+    def counting(content):
+        calls.append(content)
+        return score(content)
+
+    monkeypatch.setattr(market_insight_agent, 'score_article', counting)
+    return calls
+
+
+def test_reposts_are_stored_once(news_feed):
+    news_feed['results'] = [
+        article('Chips rally', 'Chip stocks <b>rallied</b> today.'),
+        article('CHIPS RALLY!', 'chip stocks rallied today'),
+        article('Oil slides', 'Crude fell.'),
+    ]
+
+    first = news_feed['agent'].fetch_news(['markets'])
+    again = news_feed['agent'].fetch_news(['markets'])
+
+    assert (first['received'], first['inserted'], first['duplicates']) == (3, 2, 1)
+    assert (again['inserted'], again['duplicates']) == (0, 3)
+
+
+def test_articles_without_text_are_never_duplicates(news_feed):
+    news_feed['results'] = [article('', ''), article(None, '<p> </p>'), article('Oil slides', 'Crude fell.')]
+
+    stats = news_feed['agent'].fetch_news(['markets'])
+
+    assert stats['inserted'] == 3
+    hashes = [row[0] for row in storage.connection('market_data').execute(
+        'SELECT content_hash FROM news_articles ORDER BY id'
+    )]
+    assert hashes == [None, None, content_hash('Crude fell.')]
+
+
+def test_identical_text_is_scored_once(scored):
+    # Reposts stored before content hashing have a NULL hash and reach the pipeline
+    conn = storage.connection('market_data')
+    with conn:
+        conn.executemany(
+            'INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)',
+            [('Chips rally', 'Chip stocks rallied today.', 'wire', datetime.now()),
+             ('Chips rally', 'chip stocks RALLIED today', 'wire', datetime.now()),
+             ('Oil slides', 'Crude fell.', 'wire', datetime.now())]
+        )
+
+    stats = MarketInsightAgent().run_sentiment_pipeline(workers=1)
+
+    assert stats['articles'] == 3 and stats['cache_hits'] == 1
+    assert scored == ['Chip stocks rallied today.', 'Crude fell.']
+    reports = conn.execute('SELECT summary, sentiment_label FROM sentiment_reports ORDER BY article_id').fetchall()
+    assert reports[0] == reports[1]
+
+
+def test_analyses_are_reused_from_the_cache_table(scored):
+    conn = storage.connection('market_data')
+    insert = 'INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)'
+    with conn:
+        conn.execute(insert, ('Chips rally', 'Chip stocks rallied today.', 'wire', datetime.now()))
+    MarketInsightAgent().run_sentiment_pipeline(workers=1)
+    with conn:
+        conn.execute(insert, ('Chips rally again', 'Chip stocks rallied today!', 'wire', datetime.now()))
+
+    # A fresh agent has an empty in-memory cache and falls back to analysis_cache
+    stats = MarketInsightAgent().run_sentiment_pipeline(workers=1)
+
+    assert stats['articles'] == 1 and stats['cache_hits'] == 1
+    assert scored == ['Chip stocks rallied today.']
+    assert conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0] == 1
+
+
+def test_articles_without_text_are_not_cached(scored):
+    conn = storage.connection('market_data')
+    with conn:
+        conn.executemany(
+            'INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)',
+            [('', '', 'wire', datetime.now()), (None, None, 'wire', datetime.now())]
+        )
+
+    stats = MarketInsightAgent().run_sentiment_pipeline(workers=1)
+
+    assert stats['articles'] == 2
+    assert conn.execute('SELECT COUNT(*) FROM sentiment_reports').fetchone()[0] == 2
+    assert conn.execute('SELECT COUNT(*) FROM analysis_cache').fetchone()[0] == 0
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+from conftest import daily_ticks, store_ticks
+
+import asgi
+from agents import events, price_store
+from agents.events import EventBus
+from agents.portfolio_stream import PortfolioValueTracker
+from agents.portfolio_tracker import PortfolioTracker
+
+
+def test_full_queue_drops_the_oldest_events():
+    bus = EventBus(maxsize=2)
+    subscription = bus.subscribe(['ticks'])
+
+    for number in range(3):
+        bus.publish('ticks', number)
+
+    assert subscription.drain() == [('ticks', 1), ('ticks', 2)]
+    assert subscription.dropped == 1
+    assert bus.stats()['dropped'] == 1
+
+
+def test_user_events_reach_only_that_user():
+    bus = EventBus()
+    alice, bob, everyone = bus.subscribe(['risk'], 'alice'), bus.subscribe(['risk'], 'bob'), bus.subscribe(['risk'])
+
+    assert bus.publish('risk', {'var': 1.0}, user_id='alice') == 1
+    assert bus.publish('risk', {'var': 2.0}) == 3
+
+    assert alice.drain() == [('risk', {'var': 1.0}), ('risk', {'var': 2.0})]
+    assert bob.drain() == everyone.drain() == [('risk', {'var': 2.0})]
+
+
+def test_close_unsubscribes():
+    bus = EventBus()
+    subscription = bus.subscribe(['ticks', 'risk'], 'alice')
+    closed = []
+    subscription.on_close(lambda: closed.append(True))
+
+    subscription.close()
+    subscription.close()
+
+    assert bus.publish('ticks', 1) == 0
+    assert bus.publish('risk', 1, user_id='alice') == 0
+    assert not bus.has_subscribers('ticks') and not bus.has_subscribers('risk', 'alice')
+    assert bus.stats()['subscriptions'] == 0
+    assert closed == [True]
+
+
+@pytest.fixture
+def tracked():
+    store_ticks(daily_ticks('AAPL', [100.0]) + daily_ticks('MSFT', [200.0]))
+    PortfolioTracker().sync_many({
+        'alice': [{'symbol': 'AAPL', 'quantity': 10, 'price': 90.0}],
+        'bob': [{'symbol': 'MSFT', 'quantity': 2, 'price': 150.0}],
+    })
+    bus = EventBus()
+    tracker = PortfolioValueTracker(bus)
+    streams = {user_id: bus.subscribe(['portfolio'], user_id) for user_id in ('alice', 'bob')}
+    for user_id in streams:
+        tracker.watch(user_id)
+    assert streams['alice'].drain() == [('portfolio', {'value': 1000.0, 'delta': 0.0, 'symbols': []})]
+    assert streams['bob'].drain() == [('portfolio', {'value': 400.0, 'delta': 0.0, 'symbols': []})]
+    return bus, tracker, streams
+
+
+def test_ticks_update_only_their_holders(tracked):
+    bus, tracker, streams = tracked
+
+    bus.publish('ticks', [{'symbol': 'AAPL', 'price': 101.0, 'timestamp': 'now'},
+                          {'symbol': 'AAPL', 'price': 102.0, 'timestamp': 'now'}])
+
+    assert streams['alice'].drain() == [('portfolio', {'value': 1020.0, 'delta': 20.0, 'symbols': ['AAPL']})]
+    assert streams['bob'].drain() == []
+    assert tracker.value('alice') == 1020.0
+
+
+def test_position_changes_reload_only_that_user(tracked):
+    bus, tracker, streams = tracked
+    PortfolioTracker().sync_positions('bob', [{'symbol': 'MSFT', 'quantity': 3, 'price': 150.0}])
+
+    bus.publish('positions', {'user_id': 'bob', 'changes': []})
+
+    assert streams['bob'].drain() == [('portfolio', {'value': 600.0, 'delta': 200.0, 'symbols': []})]
+    assert streams['alice'].drain() == []
+
+
+def _asgi_stream(api, query):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream', 'query_string': query}
+    asyncio.run(api(scope, receive, send))
+    api.close()
+    return sent
+
+
+def test_stream_rejects_unknown_topics(databases):
+    sent = _asgi_stream(asgi.create_app({'DATABASES': databases}), b'topics=ticks,bogus')
+
+    assert sent[0]['status'] == 400
+    assert 'bogus' in json.loads(sent[1]['body'])['error']
+
+
+def test_portfolio_stream_unwatches_on_disconnect(databases):
+    from agents.portfolio_stream import tracker
+
+    sent = _asgi_stream(asgi.create_app({'DATABASES': databases}), b'topics=portfolio&user_id=carol')
+
+    assert sent[0]['status'] == 200
+    assert 'carol' not in tracker.watched()
+    assert not events.bus.has_subscribers('portfolio', 'carol')
+    # Opening the stream warmed the price store off the event loop
+    assert price_store.store.warmed
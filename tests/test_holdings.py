@@ -0,0 +1,53 @@
+from conftest import baseline_database
+
+from agents import schema
+
+
+def test_portfolio_baseline(databases):
+    conn = baseline_database(databases['portfolio'], 'portfolio')
+    conn.executemany('INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)', [
+        ('alice', 'AAPL', 10, 150.0, '2026-01-01 10:00:00'),
+        ('alice', 'MSFT', 5, 300.0, '2026-01-01 10:00:00'),
+        ('alice', 'AAPL', 10, 150.0, '2026-01-02 10:00:00'),
+        ('alice', 'MSFT', 5, 300.0, '2026-01-02 10:00:00'),
+        ('alice', 'AAPL', 12, 155.0, '2026-01-03 10:00:00'),
+        ('alice', 'MSFT', 0, 300.0, '2026-01-03 10:00:00'),
+    ])
+    conn.commit()
+
+    assert schema.migrate(conn, 'portfolio') == schema.MIGRATIONS['portfolio'][-1][0]
+
+    holdings = conn.execute('SELECT user_id, symbol, quantity, purchase_price FROM holdings').fetchall()
+    assert holdings == [('alice', 'AAPL', 12, 155.0)]
+    history = conn.execute('SELECT symbol, quantity, timestamp FROM holdings_history ORDER BY id').fetchall()
+    assert history == [('AAPL', 10, '2026-01-01 10:00:00'), ('MSFT', 5, '2026-01-01 10:00:00'),
+                       ('AAPL', 12, '2026-01-03 10:00:00'), ('MSFT', 0, '2026-01-03 10:00:00')]
+
+
+def test_positions_left_out_of_the_latest_snapshot_are_closed(databases):
+    conn = baseline_database(databases['portfolio'], 'portfolio')
+    # As the old tracker wrote them: every row of a snapshot stamped separately
+    conn.executemany('INSERT INTO portfolio (user_id, symbol, quantity, purchase_price, timestamp) VALUES (?, ?, ?, ?, ?)', [
+        ('bob', 'AAPL', 10, 150.0, '2026-01-01 10:00:00.000100'),
+        ('bob', 'MSFT', 5, 300.0, '2026-01-01 10:00:00.000900'),
+        ('bob', 'NVDA', 2, 500.0, '2026-01-01 10:00:00.001500'),
+        ('carol', 'MSFT', 1, 310.0, '2026-01-01 11:00:00.000100'),
+        ('bob', 'AAPL', 10, 150.0, '2026-01-02 10:00:00.000100'),
+        ('bob', 'NVDA', 3, 520.0, '2026-01-02 10:00:00.000800'),
+        ('bob', 'AAPL', 11, 151.0, '2026-01-03 10:00:00.000100'),
+    ])
+    conn.commit()
+
+    schema.migrate(conn, 'portfolio')
+
+    holdings = conn.execute('SELECT user_id, symbol, quantity FROM holdings ORDER BY user_id, symbol').fetchall()
+    assert holdings == [('bob', 'AAPL', 11), ('carol', 'MSFT', 1)]
+    history = conn.execute(
+        "SELECT symbol, quantity, timestamp FROM holdings_history WHERE user_id = 'bob' ORDER BY id"
+    ).fetchall()
+    assert history == [
+        ('AAPL', 10, '2026-01-01 10:00:00.000100'), ('MSFT', 5, '2026-01-01 10:00:00.000900'),
+        ('NVDA', 2, '2026-01-01 10:00:00.001500'),
+        ('MSFT', 0, '2026-01-02 10:00:00.000100'), ('NVDA', 3, '2026-01-02 10:00:00.000800'),
+        ('AAPL', 11, '2026-01-03 10:00:00.000100'), ('NVDA', 0, '2026-01-03 10:00:00.000100'),
+    ]
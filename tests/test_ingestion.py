@@ -0,0 +1,47 @@
+import time
+
+from conftest import ingestion_agent
+
+from agents import storage
+
+
+def test_fetch_stores_every_quote_in_one_batch(quote_server):
+    stats = ingestion_agent(quote_server).fetch_market_data(['AAPL', 'MSFT', 'NVDA', 'AAPL'])
+
+    assert stats['requested'] == 3
+    assert stats['fetched'] == 3
+    assert stats['inserted'] == 3
+    assert stats['failed'] == []
+    assert stats['symbols_per_second'] > 0
+    rows = storage.connection('market_data').execute(
+        'SELECT symbol, price FROM market_data ORDER BY symbol'
+    ).fetchall()
+    assert rows == [('AAPL', 190.5), ('MSFT', 410.25), ('NVDA', 880.0)]
+
+
+def test_failures_are_reported_per_symbol(quote_server):
+    stats = ingestion_agent(quote_server).fetch_market_data(['AAPL', 'BROKEN', 'GARBLED'])
+
+    assert stats['inserted'] == 1
+    assert sorted(stats['failed']) == ['BROKEN', 'GARBLED']
+
+
+def test_repeated_quotes_are_duplicates(quote_server):
+    agent = ingestion_agent(quote_server)
+    agent.fetch_market_data(['AAPL', 'MSFT'])
+    stats = agent.fetch_market_data(['AAPL', 'MSFT'])
+
+    assert stats['inserted'] == 0
+    assert stats['duplicates'] == 2
+    count = storage.connection('market_data').execute('SELECT COUNT(*) FROM market_data').fetchone()[0]
+    assert count == 2
+
+
+def test_deadline_bounds_the_fetch(quote_server):
+    started = time.monotonic()
+    stats = ingestion_agent(quote_server, retries=5, backoff=0.5).fetch_market_data(
+        ['BROKEN'], deadline=time.monotonic() + 0.3
+    )
+
+    assert time.monotonic() - started < 2
+    assert stats['failed'] == ['BROKEN']
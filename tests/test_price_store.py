@@ -0,0 +1,89 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from conftest import ingestion_agent, store_ticks
+
+import app as flask_app
+import asgi
+from agents import price_store, storage
+
+
+def test_new_ticks_reach_a_warm_price_store(quote_server):
+    price_store.ensure_warm(lambda: storage.connection('market_data'))
+    ingestion_agent(quote_server).fetch_market_data(['AAPL'])
+
+    times, prices = price_store.store.window('AAPL')
+    assert list(prices) == [190.5]
+    _, closes = price_store.daily.window('AAPL')
+    assert list(closes) == [190.5]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_reads_do_not_refresh():
+    price_store.ensure_warm(lambda: storage.connection('market_data'))
+    # Written by another process: nothing to append it to the resident store
+    store_ticks([('AAPL', 190.5, datetime.now())])
+
+    price_store.ensure_warm(lambda: storage.connection('market_data'))
+
+    assert price_store.store.window('AAPL') is None
+
+
+def test_the_refresher_catches_up_in_the_background():
+    store_ticks([('AAPL', 190.5, datetime.now() - timedelta(minutes=1))])
+
+    assert price_store.start_refresher(interval=0.01)
+    assert not price_store.start_refresher(interval=0.01)
+    assert list(price_store.store.window('AAPL')[1]) == [190.5]
+    store_ticks([('AAPL', 191.0, datetime.now())])
+
+    wait_for(lambda: price_store.latest_price('AAPL') == 191.0)
+    price_store.stop_refresher()
+    assert price_store._refresher['thread'] is None
+
+
+def test_flask_app_warms_at_startup(databases):
+    store_ticks([('AAPL', 190.5, datetime.now())])
+
+    flask_app.create_app({'DATABASES': databases, 'WARM_PRICE_STORE': True})
+
+    assert price_store.store.warmed and price_store.daily.warmed
+    assert price_store.latest_price('AAPL') == 190.5
+    assert price_store._refresher['thread'].is_alive()
+
+
+def test_flask_app_can_leave_the_store_cold(databases):
+    flask_app.create_app({'DATABASES': databases, 'WARM_PRICE_STORE': False})
+
+    assert not price_store.store.warmed
+    assert price_store._refresher['thread'] is None
+
+
+def test_asgi_app_warms_at_lifespan_startup(databases):
+    store_ticks([('AAPL', 190.5, datetime.now())])
+    api = asgi.create_app({'DATABASES': databases, 'WARM_PRICE_STORE': True})
+    sent = []
+    messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+
+    async def receive():
+        message = next(messages)
+        if message['type'] == 'lifespan.shutdown':
+            # Checked between startup and shutdown
+            assert price_store.latest_price('AAPL') == 190.5
+            assert price_store._refresher['thread'].is_alive()
+        return message
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(api({'type': 'lifespan'}, receive, send))
+
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert price_store._refresher['thread'] is None
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+from conftest import hold, ingestion_agent, store_articles
+
+from agents import storage
+from agents.market_insight_agent import MarketInsightAgent
+from agents.recommendation_agent import RecommendationAgent
+
+
+@pytest.fixture
+def coverage(quote_server):
+    """Bad news for AAPL and MSFT, good news for NVDA"""
+    store_articles([
+        ('Apple slumps', 'Apple had a terrible, awful quarter.'),
+        ('Microsoft slumps', 'Microsoft had a terrible, awful quarter.'),
+        ('Nvidia soars', 'Nvidia posted great results.'),
+    ])
+    ingestion_agent(quote_server).index_article_symbols()
+    MarketInsightAgent().run_sentiment_pipeline(workers=1)
+
+
+def set_var(user_id, var_percentage):
+    conn = storage.connection('portfolio')
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO risk_metrics (user_id, var_percentage, timestamp) VALUES (?, ?, ?)',
+                     (user_id, var_percentage, datetime.now()))
+
+
+def kinds(recommendations):
+    return [rec['recommendation'].split(' ', 1)[0] for rec in recommendations]
+
+
+def test_a_user_across_a_chunk_boundary_gets_one_set(coverage):
+    hold('alice', {'AAPL': 1, 'MSFT': 1, 'NVDA': 1})
+    hold('bob', {'AAPL': 1})
+    set_var('alice', 9.0)
+    agent = RecommendationAgent()
+    expected = {user_id: [rec['message'] for rec in agent.generate_recommendations(user_id)]
+                for user_id in ('alice', 'bob')}
+
+    stats = agent.generate_all_recommendations(chunk_size=2)
+
+    assert stats['users'] == 2 and stats['holdings'] == 4
+    for user_id, messages in expected.items():
+        assert [rec['recommendation'] for rec in agent.get_user_recommendations(user_id, limit=10)] == messages
+    assert kinds(agent.get_user_recommendations('alice', limit=10)) == ['High', 'Consider', 'Consider', 'Positive']
+
+
+def test_reruns_replace_earlier_recommendations(coverage):
+    hold('alice', {'AAPL': 1})
+    agent = RecommendationAgent()
+
+    agent.generate_all_recommendations()
+    first = agent.get_user_recommendations('alice')
+    agent.generate_all_recommendations()
+
+    count = storage.connection('market_data').execute('SELECT COUNT(*) FROM recommendations').fetchone()[0]
+    assert count == len(first) == 2
+    assert kinds(agent.get_user_recommendations('alice')) == ['Consider', 'Positive']
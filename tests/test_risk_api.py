@@ -0,0 +1,47 @@
+import json
+
+import pytest
+from conftest import hold
+
+import app as flask_app
+
+
+@pytest.fixture
+def client(databases, book):
+    return flask_app.create_app({'DATABASES': databases, 'RUN_SCHEDULER': False}).test_client()
+
+
+@pytest.mark.parametrize('query', [
+    'confidence_level=nan', 'confidence_level=inf', 'confidence_level=1.5', 'confidence_level=0',
+    'confidence_level=-0.5', 'horizon_days=0', 'horizon_days=-3', 'horizon_days=two',
+])
+def test_invalid_var_parameters_are_rejected(client, query):
+    response = client.get(f'/api/risk-analysis?user_id=alice&method=historical&{query}')
+
+    assert response.status_code == 400
+    assert 'error' in json.loads(response.data)
+
+
+def test_unknown_method_is_rejected(client):
+    response = client.get('/api/risk-analysis?user_id=alice&method=guesswork')
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('method', ['parametric', 'historical', 'monte_carlo'])
+def test_var_over_a_longer_horizon(client, method):
+    response = client.get(f'/api/risk-analysis?user_id=alice&method={method}&confidence_level=0.99&horizon_days=10')
+
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result['confidence_level'] == 0.99 and result['horizon_days'] == 10
+    assert result['var'] > 0
+
+
+def test_metrics_without_a_method(client):
+    hold('bob', {'AAPL': 1})
+
+    response = client.get('/api/risk-analysis?user_id=bob')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['position_count'] == 1
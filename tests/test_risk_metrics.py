@@ -0,0 +1,49 @@
+from conftest import hold
+
+from agents import events
+from agents.portfolio_tracker import PortfolioTracker
+from agents.risk_analyzer import RiskAnalyzer
+
+
+def test_position_changes_invalidate_cached_metrics(analyzer, book):
+    before = analyzer.get_risk_metrics(book)
+    hold(book, {'AAPL': 20})
+
+    after = analyzer.get_risk_metrics(book)
+
+    assert after['position_count'] == 1
+    assert after['position_count'] != before['position_count']
+
+
+def test_closed_analyzers_stop_listening():
+    listeners = len(events.bus._listeners.get('positions', ()))
+    analyzers = [RiskAnalyzer(sector_map={}) for _ in range(3)]
+    assert len(events.bus._listeners['positions']) == listeners + 3
+
+    for analyzer in analyzers:
+        analyzer.close()
+    analyzers[0].close()
+
+    assert len(events.bus._listeners.get('positions', ())) == listeners
+
+
+def test_a_failing_listener_does_not_stop_invalidation(analyzer, book, caplog):
+    hold('bob', {'AAPL': 5})
+    # Registered first, so it runs before the analyzer's listener for every user
+    events.bus.add_listener('positions', failing)
+    try:
+        cached = {user_id: analyzer.get_risk_metrics(user_id) for user_id in (book, 'bob')}
+        PortfolioTracker().sync_many({
+            book: [{'symbol': 'AAPL', 'quantity': 20, 'price': 100.0}],
+            'bob': [{'symbol': 'AAPL', 'quantity': 5, 'price': 100.0}, {'symbol': 'MSFT', 'quantity': 1, 'price': 100.0}],
+        })
+    finally:
+        events.bus.remove_listener('positions', failing)
+
+    assert analyzer.get_risk_metrics(book)['position_count'] == 1 != cached[book]['position_count']
+    assert analyzer.get_risk_metrics('bob')['position_count'] == 2 != cached['bob']['position_count']
+    assert caplog.text.count('positions listener') == 2
+
+
+def failing(change):
+    raise RuntimeError('listener bug')
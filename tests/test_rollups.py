@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+
+import pytest
+from conftest import _reset_price_store, daily_ticks, hold, store_ticks
+
+from agents import events, rollups, storage
+from agents.portfolio_stream import PortfolioValueTracker
+
+
+def test_stress_snapshot_uses_latest_tick_however_old(analyzer):
+    store_ticks(daily_ticks('AAPL', [100.0] * 5, end=datetime.now() - timedelta(days=3)))
+    hold('bob', {'AAPL': 10})
+
+    losses = analyzer.perform_stress_test('bob')
+
+    assert losses == pytest.approx({-0.2: 200.0, -0.5: 500.0, -0.7: 700.0})
+
+
+def test_prices_fall_back_to_daily_closes_after_compaction(analyzer):
+    store_ticks(daily_ticks('AAPL', [90.0, 95.0, 100.0], end=datetime.now() - timedelta(days=20)))
+    hold('bob', {'AAPL': 10})
+    conn = storage.connection('market_data')
+    deleted = rollups.compact(conn)
+    # As after a restart: nothing resident, no raw ticks left to warm from
+    _reset_price_store()
+
+    tracker = PortfolioValueTracker(events.EventBus())
+    tracker.watch('bob')
+
+    assert deleted['tick'] == 3
+    assert analyzer.perform_stress_test('bob') == pytest.approx({-0.2: 200.0, -0.5: 500.0, -0.7: 700.0})
+    assert tracker.value('bob') == 1000.0
@@ -0,0 +1,74 @@
+import threading
+
+from conftest import ingestion_agent
+
+from agents.registry import AgentRegistry
+from agents.scheduler import Scheduler, default_scheduler
+
+
+def _job(runs, name):
+    done = threading.Event()
+
+    def run(deadline):
+        runs.append(name)
+        done.set()
+    return run, done
+
+
+def test_downstream_jobs_run_after_upstream():
+    runs = []
+    scheduler = Scheduler()
+    ingest, _ = _job(runs, 'ingest')
+    risk, risk_done = _job(runs, 'risk')
+    scheduler.add('ingest', ingest)
+    scheduler.add('risk', risk, after=('ingest',))
+
+    scheduler.trigger('ingest')
+
+    assert risk_done.wait(2)
+    assert runs == ['ingest', 'risk']
+    scheduler.stop()
+
+
+def test_restart_after_stop():
+    runs = []
+    scheduler = Scheduler()
+    ingest, ingest_done = _job(runs, 'ingest')
+    scheduler.add('ingest', ingest)
+    scheduler.start()
+    scheduler.stop()
+
+    scheduler.start()
+    scheduler.trigger('ingest')
+
+    assert ingest_done.wait(2)
+    assert runs == ['ingest']
+    scheduler.stop()
+
+
+class StubSentiment:
+    def __init__(self):
+        self.ran = threading.Event()
+
+    def run_sentiment_pipeline(self, deadline=None):
+        self.ran.set()
+        return {'articles': 0}
+
+
+def test_news_failures_do_not_break_the_chain(quote_server):
+    data = ingestion_agent(quote_server, news_url='http://127.0.0.1:9', retries=0)
+    sentiment = StubSentiment()
+    registry = AgentRegistry()
+    registry.provide('data', data)
+    registry.provide('market_insight', sentiment)
+    scheduler = default_scheduler(registry, {'symbols': 'AAPL'})
+
+    scheduler.trigger('ingest')
+
+    assert sentiment.ran.wait(5)
+    ingest = scheduler.metrics()['ingest']
+    assert ingest['failures'] == 0
+    assert ingest['last_result']['market']['inserted'] == 1
+    assert ingest['last_result']['news'] is None
+    assert ingest['last_result']['news_failures'] == 1
+    scheduler.stop(wait=False)
@@ -0,0 +1,63 @@
+import pytest
+from conftest import baseline_database
+
+from agents import schema, storage
+
+LATEST = {name: steps[-1][0] for name, steps in schema.MIGRATIONS.items()}
+
+
+def test_market_databaseline_database(databases):
+    conn = baseline_database(databases['market_data'], 'market_data')
+    conn.executemany('INSERT INTO market_data (symbol, price, timestamp) VALUES (?, ?, ?)', [
+        ('AAPL', 100.0, '2026-01-05 10:00:00'),
+        ('AAPL', 100.0, '2026-01-05 10:00:00'),
+        ('AAPL', 104.0, '2026-01-05 15:00:00'),
+        ('AAPL', 101.0, '2026-01-06 10:00:00'),
+    ])
+    conn.executemany('INSERT INTO news_articles (title, content, source, timestamp) VALUES (?, ?, ?, ?)', [
+        ('Apple beats', 'Apple beat estimates.', 'wire', '2026-01-05 09:00:00'),
+        ('Apple beats', 'Apple beat estimates.', 'repost', '2026-01-05 09:05:00'),
+        ('Chips rally', 'Chipmakers rallied.', 'wire', '2026-01-05 11:00:00'),
+    ])
+    conn.executemany('INSERT INTO sentiment_reports (article_id, summary, sentiment_polarity, sentiment_label, timestamp) '
+                     'VALUES (?, ?, ?, ?, ?)', [
+        (1, 'old', 0.1, 'neutral', '2026-01-05 09:01:00'),
+        (1, 'new', 0.5, 'positive', '2026-01-05 09:02:00'),
+    ])
+    conn.commit()
+
+    assert schema.migrate(conn, 'market_data') == LATEST['market_data']
+
+    assert conn.execute('SELECT COUNT(*) FROM market_data').fetchone()[0] == 3
+    daily = conn.execute(
+        "SELECT bucket, open, high, low, close, volume FROM market_bars WHERE resolution = '1d' ORDER BY bucket"
+    ).fetchall()
+    assert daily == [('2026-01-05 00:00:00', 100.0, 104.0, 100.0, 104.0, 2),
+                     ('2026-01-06 00:00:00', 101.0, 101.0, 101.0, 101.0, 1)]
+    assert conn.execute('SELECT article_id, summary FROM sentiment_reports').fetchall() == [(1, 'new')]
+    # The repost keeps a NULL hash instead of being deleted
+    hashes = conn.execute('SELECT id, content_hash IS NOT NULL FROM news_articles ORDER BY id').fetchall()
+    assert hashes == [(1, 1), (2, 0), (3, 1)]
+    marks = dict(conn.execute('SELECT name, value FROM pipeline_state'))
+    # Article 2 is the oldest without a report
+    assert marks == {'sentiment_high_water_mark': 1, 'symbol_index_high_water_mark': 0}
+
+
+@pytest.mark.parametrize('database', sorted(schema.MIGRATIONS))
+def test_migrations_are_idempotent(databases, database):
+    conn = baseline_database(databases[database], database)
+
+    assert schema.migrate(conn, database) == LATEST[database]
+    assert schema.migrate(conn, database) == LATEST[database]
+    versions = [row[0] for row in conn.execute('SELECT version FROM schema_version ORDER BY version')]
+    assert versions == [version for version, _ in schema.MIGRATIONS[database]]
+
+
+def test_pool_migrates_on_first_connection(databases):
+    baseline_database(databases['conversation'], 'conversation').close()
+
+    conn = storage.connection('conversation')
+
+    assert schema.current_version(conn) == LATEST['conversation']
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {'conversation_history', 'conversation_summaries'} <= tables
@@ -0,0 +1,45 @@
+from conftest import store_articles
+
+from agents import storage
+from agents.market_insight_agent import MarketInsightAgent
+
+
+def report_ids():
+    return [row[0] for row in storage.connection('market_data').execute(
+        'SELECT article_id FROM sentiment_reports ORDER BY article_id'
+    )]
+
+
+def test_a_rerun_scores_nothing_new():
+    ids = store_articles([('Rally', 'Shares rose on great earnings.'), ('Slump', 'The stock fell badly.')])
+    agent = MarketInsightAgent()
+
+    first = agent.run_sentiment_pipeline(batch_size=1)
+    second = agent.run_sentiment_pipeline(batch_size=1)
+
+    assert first['articles'] == 2 and first['batches'] == 2
+    assert second['articles'] == 0 and second['batches'] == 0
+    assert second['high_water_mark'] == ids[-1]
+    assert report_ids() == ids
+
+
+def test_new_articles_are_picked_up_after_the_mark():
+    ids = store_articles([('Rally', 'Shares rose on great earnings.')])
+    MarketInsightAgent().run_sentiment_pipeline()
+    ids += store_articles([('Slump', 'The stock fell badly.'), ('Flat', 'Markets were unchanged.')])
+
+    # A new instance resumes from the stored mark, not from the start
+    stats = MarketInsightAgent().run_sentiment_pipeline()
+
+    assert stats['articles'] == 2
+    assert stats['high_water_mark'] == ids[-1]
+    assert report_ids() == ids
+
+
+def test_an_expired_deadline_leaves_the_mark_in_place():
+    store_articles([('Rally', 'Shares rose on great earnings.')])
+
+    stats = MarketInsightAgent().run_sentiment_pipeline(deadline=0)
+
+    assert stats['articles'] == 0 and stats['high_water_mark'] == 0
+    assert report_ids() == []
@@ -0,0 +1,29 @@
+from conftest import store_articles
+
+from agents import storage
+from agents.market_insight_agent import MarketInsightAgent, score_article
+
+
+def test_a_backlog_is_scored_in_the_process_pool():
+    articles = [(f'Story {n}', f'Shares rose {n} points on great earnings.' if n % 2 else f'Stock {n} fell badly.')
+                for n in range(10)]
+    ids = store_articles(articles)
+
+    stats = MarketInsightAgent().run_sentiment_pipeline(batch_size=4, workers=2)
+
+    assert stats['workers'] == 2
+    assert stats['articles'] == 10 and stats['batches'] == 3
+    assert stats['high_water_mark'] == ids[-1]
+    rows = storage.connection('market_data').execute(
+        'SELECT article_id, summary, sentiment_label, sentiment_polarity FROM sentiment_reports ORDER BY article_id'
+    ).fetchall()
+    # Same results as scoring in-process
+    assert rows == [(article_id, *score_article(content)) for article_id, (_, content) in zip(ids, articles)]
+
+
+def test_small_increments_are_scored_in_process():
+    store_articles([('Story', 'Shares rose on great earnings.')])
+
+    stats = MarketInsightAgent().run_sentiment_pipeline(batch_size=4, workers=2)
+
+    assert stats['workers'] == 1 and stats['articles'] == 1
@@ -0,0 +1,9 @@
+import pytest
+
+from agents.stress_testing import ScenarioSet
+
+
+def test_stress_scenarios_scale_with_the_shock(analyzer, book):
+    losses = analyzer.run_stress_tests(book, ScenarioSet.uniform([-0.1, -0.2]))
+
+    assert losses[-0.2] == pytest.approx(2 * losses[-0.1])
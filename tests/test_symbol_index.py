@@ -0,0 +1,87 @@
+from conftest import hold, ingestion_agent, store_articles
+
+from agents import storage
+from agents.entity_index import SymbolMatcher
+from agents.market_insight_agent import MarketInsightAgent
+from agents.recommendation_agent import RecommendationAgent
+
+ALIASES = {
+    'AAPL': ['Apple'],
+    'GOOG': ['Alphabet Class C'],
+    'GOOGL': ['Alphabet', 'Google'],
+    'JPM': ['JPMorgan', 'JPMorgan Chase', 'JP Morgan'],
+    'JNJ': ['Johnson & Johnson'],
+    'IT': ['Gartner'],
+}
+
+
+def test_tickers_match_whole_words_only():
+    matcher = SymbolMatcher(ALIASES)
+
+    assert matcher.extract('AAPL beat estimates.') == {'AAPL'}
+    assert matcher.extract('Analysts like AAPL.') == {'AAPL'}
+    assert matcher.extract('AAPLX and XAAPL are other funds; aapl is lowercase') == set()
+    assert matcher.extract('Pineapple and Applebee earnings') == set()
+
+
+def test_overlapping_tickers_are_told_apart():
+    matcher = SymbolMatcher(ALIASES)
+
+    assert matcher.extract('GOOGL rose') == {'GOOGL'}
+    assert matcher.extract('GOOG rose') == {'GOOG'}
+    # The longer alias matches its own ticker, and its prefix still matches the shorter one
+    assert matcher.extract('Alphabet Class C shares') == {'GOOG', 'GOOGL'}
+
+
+def test_ambiguous_tickers_need_a_cashtag():
+    matcher = SymbolMatcher(ALIASES)
+
+    assert matcher.extract('IT spending is up') == set()
+    assert matcher.extract('$IT and $aapl') == {'IT', 'AAPL'}
+
+
+def test_company_names_match_in_any_case_and_spacing():
+    matcher = SymbolMatcher(ALIASES)
+
+    assert matcher.extract('Shares of apple fell') == {'AAPL'}
+    assert matcher.extract('JP  Morgan and JPMorgan Chase') == {'JPM'}
+    assert matcher.extract('Johnson & Johnson settles') == {'JNJ'}
+    assert matcher.extract('Gartner says cloud spending grew') == {'IT'}
+
+
+def test_indexed_mentions_feed_symbol_sentiment(quote_server):
+    ids = store_articles([
+        ('Apple slumps', 'Apple had a terrible, awful quarter.'),
+        ('Tech roundup', 'MSFT and $NVDA posted great results.'),
+        ('Apple recovers', 'Apple posted great results.'),
+        ('Weather', 'Rain is expected.'),
+    ])
+    assert ingestion_agent(quote_server).index_article_symbols() == 4
+    MarketInsightAgent().run_sentiment_pipeline(workers=1)
+    agent = RecommendationAgent()
+
+    mentions = storage.connection('market_data').execute(
+        'SELECT article_id, symbol FROM article_symbols ORDER BY article_id, symbol'
+    ).fetchall()
+    assert mentions == [(ids[0], 'AAPL'), (ids[1], 'MSFT'), (ids[1], 'NVDA'), (ids[2], 'AAPL')]
+
+    # Latest report per symbol; `symbols` and the first article narrow it down
+    sentiment = {symbol: label for symbol, label, _ in agent._get_symbol_sentiment(ids[0])}
+    assert sentiment == {'AAPL': 'positive', 'MSFT': 'positive', 'NVDA': 'positive'}
+    assert [row[0] for row in agent._get_symbol_sentiment(ids[0], ['AAPL', 'TSLA'])] == ['AAPL']
+    assert agent._get_symbol_sentiment(ids[0], []) == []
+    assert agent._get_symbol_sentiment(ids[3]) == []
+
+
+def test_negative_coverage_of_a_holding_is_recommended(quote_server):
+    store_articles([('Apple slumps', 'Apple had a terrible, awful quarter.')])
+    ingestion_agent(quote_server).index_article_symbols()
+    MarketInsightAgent().run_sentiment_pipeline(workers=1)
+    hold('alice', {'AAPL': 10})
+    hold('bob', {'MSFT': 5})
+
+    agent = RecommendationAgent()
+
+    assert [rec['type'] for rec in agent.generate_recommendations('alice')] == ['sentiment']
+    assert 'AAPL' in agent.generate_recommendations('alice')[0]['message']
+    assert agent.generate_recommendations('bob') == []
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+
+def test_vectorized_var_matches_per_position_sum(analyzer, book):
+    # The original per-position computation: one history, one percentile per holding
+    portfolio = analyzer._load_portfolio(book)
+    expected_var, expected_value = 0.0, 0.0
+    for _, position in portfolio.iterrows():
+        prices = analyzer._get_historical_prices(position['symbol'])['price']
+        position_value = position['quantity'] * prices.iloc[-1]
+        expected_var += position_value * np.percentile(prices.pct_change().dropna(), 5)
+        expected_value += position_value
+
+    var, total_value = analyzer.calculate_value_at_risk(book)
+
+    assert var == pytest.approx(abs(expected_var), rel=1e-12)
+    assert total_value == pytest.approx(expected_value, rel=1e-12)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from conftest import daily_ticks, hold, random_walk, store_ticks
+
+from agents.risk_analyzer import VAR_METHODS
+
+
+@pytest.mark.parametrize('method', VAR_METHODS)
+def test_component_var_adds_up_to_var(analyzer, book, method):
+    result = analyzer.simulate_value_at_risk(book, method=method, paths=20000, seed=7)
+
+    assert result['var'] > 0
+    assert result['cvar'] >= result['var'] - 1e-9
+    assert sum(result['component_var'].values()) == pytest.approx(result['var'], rel=1e-9)
+    assert set(result['component_var']) == {'AAPL', 'MSFT', 'NVDA'}
+
+
+def test_returns_line_up_on_shared_days(analyzer):
+    # Same prices, but one history lacks a day: still perfectly correlated
+    prices = random_walk(4)
+    store_ticks(daily_ticks('LONG', prices) + daily_ticks('SHORT', prices, skip={10}))
+    hold('hedged', {'LONG': 10, 'SHORT': -10})
+
+    symbols, values, returns = analyzer._position_exposures(analyzer._load_portfolio('hedged'))
+
+    assert symbols == ['LONG', 'SHORT']
+    assert np.corrcoef(returns.T)[0, 1] == pytest.approx(1.0)
+    assert values.sum() == pytest.approx(0.0)
+    for method in VAR_METHODS:
+        result = analyzer.simulate_value_at_risk('hedged', method=method, paths=20000, seed=7)
+        assert result['var'] == pytest.approx(0.0, abs=1e-6)